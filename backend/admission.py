@@ -0,0 +1,228 @@
+import os
+import math
+import time
+import threading
+from collections import OrderedDict, deque
+
+from generate_swap_gcode import find_plate_gcodes, source_key, SWAP_SEQUENCE_GCODE
+from .archives import open_source
+from .janitor import STORAGE_BUDGET_BYTES
+
+def _physical_memory():
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return 2 * 1024 ** 3
+
+# Budgets the running builds of one API worker share (its job pool). A job only
+# starts once its estimated cost fits next to theirs; a job that could never fit
+# is refused outright.
+ADMISSION_MEMORY_BYTES = int(os.environ.get("SWAPLIST_ADMISSION_MEMORY_BYTES", str(_physical_memory() // 2)))
+ADMISSION_DISK_BYTES = int(os.environ.get("SWAPLIST_ADMISSION_DISK_BYTES", str(STORAGE_BUDGET_BYTES)))
+# Working set of one build on top of its memory-mapped sources (worker process,
+# deflate blocks in flight)
+BUILD_MEMORY_BYTES = int(os.environ.get("SWAPLIST_BUILD_MEMORY_BYTES", str(256 * 1024 ** 2)))
+# Jobs one client may have waiting or running at once
+MAX_PENDING_PER_CLIENT = int(os.environ.get("SWAPLIST_MAX_PENDING_PER_CLIENT", "8"))
+# Build throughput (combined G-code bytes per second) assumed until jobs have been timed
+DEFAULT_BUILD_BYTES_PER_SECOND = 50 * 1024 * 1024
+MAX_RETRY_AFTER_SECONDS = 300
+
+_SWAP_BYTES = len(SWAP_SEQUENCE_GCODE.encode("utf-8")) + 1
+
+class JobQueueFull(Exception):
+    """No room in the queue right now; retry_after is a suggested delay in seconds."""
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class JobTooLarge(Exception):
+    """The job would never fit in the admission budgets."""
+    pass
+
+class JobCost:
+    """
+    Estimated resources of one build: work (bytes of combined G-code to write),
+    memory (working set plus mapped sources) and disk (output plus plate
+    segments), in bytes.
+    """
+    __slots__ = ("work", "memory", "disk")
+
+    def __init__(self, work=0, memory=0, disk=0):
+        self.work = work
+        self.memory = memory
+        self.disk = disk
+
+    def to_dict(self):
+        return {"work": self.work, "memory": self.memory, "disk": self.disk}
+
+def estimate_job_cost(playlist):
+    """
+    JobCost of a (path, index, count) playlist, from the plate G-code members of
+    its sources (uncompressed and compressed sizes x copies). Distinct sources
+    are read once, stored uploads through the archive registry.
+    Raises UnknownUpload, OSError or zipfile.BadZipFile if a source can't be read.
+    """
+    cost = JobCost(memory=BUILD_MEMORY_BYTES)
+    members = {}
+    plates = set()
+    for path, index, count in playlist:
+        key = source_key(path)
+        if key not in members:
+            with open_source(path) as source:
+                members[key] = dict(source.metadata)
+                cost.memory += os.path.getsize(source.path)
+        for gcode_name in find_plate_gcodes(members[key], index):
+            info = members[key][gcode_name]
+            cost.work += (info.file_size + _SWAP_BYTES) * count
+            # Compressed about as well as in the source, plus the plate's deflate segment once
+            cost.disk += info.compress_size * count
+            if (key, gcode_name) not in plates:
+                plates.add((key, gcode_name))
+                cost.disk += info.compress_size
+    return cost
+
+class AdmissionQueue:
+    """
+    Fair queue in front of the job pool. The next job comes from the client
+    with the fewest jobs running, the one served longest ago on a tie, so one
+    client's 50-copy playlists don't hold everyone else up. It starts when a
+    worker slot is free and its cost fits next to the running jobs' within the
+    memory and disk budgets.
+    Build times are measured to suggest Retry-After delays and wait estimates.
+    """
+    def __init__(self, slots, max_pending, memory_budget=ADMISSION_MEMORY_BYTES, disk_budget=ADMISSION_DISK_BYTES,
+                 max_pending_per_client=MAX_PENDING_PER_CLIENT):
+        self.slots = slots
+        self.max_pending = max_pending
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self.max_pending_per_client = max_pending_per_client
+        self._queues = OrderedDict() # client -> deque of (job_id, cost), in order of arrival
+        self._pending_by_client = {}
+        self._last_started = {} # client -> time its last job started
+        self._running = {} # job_id -> (client, cost, started_at)
+        self._memory = 0
+        self._disk = 0
+        self._rate = DEFAULT_BUILD_BYTES_PER_SECOND
+        self._lock = threading.Lock()
+
+    def _queued_count(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _retry_after(self, now):
+        # Room frees up when the first running job is done
+        remaining = [max(0.0, cost.work / self._rate - (now - started_at))
+                     for _, cost, started_at in self._running.values()]
+        seconds = min(remaining) if remaining else 1
+        return max(1, min(MAX_RETRY_AFTER_SECONDS, math.ceil(seconds)))
+
+    def _check(self, client, jobs):
+        # Called with the lock held
+        pending = self._queued_count() + len(self._running)
+        if pending + jobs > self.max_pending:
+            raise JobQueueFull(f"{pending} jobs already pending", self._retry_after(time.time()))
+        client_pending = self._pending_by_client.get(client, 0)
+        if client_pending + jobs > self.max_pending_per_client:
+            raise JobQueueFull(f"{client_pending} of your jobs already pending", self._retry_after(time.time()))
+
+    def admit(self, job_id, client, cost):
+        """
+        Queues a job. Raises JobTooLarge if its cost exceeds a budget, JobQueueFull
+        if the queue (or the client's share of it) is full.
+        """
+        self.admit_all([(job_id, cost)], client)
+
+    def admit_all(self, jobs, client):
+        """
+        Queues [(job_id, cost)] for one client, all or none: raises (as admit)
+        before anything is queued if any of them doesn't fit.
+        """
+        for _, cost in jobs:
+            if cost.memory > self.memory_budget or cost.disk > self.disk_budget:
+                raise JobTooLarge(f"Playlist needs about {cost.memory // 2 ** 20} MB of memory and "
+                                  f"{cost.disk // 2 ** 20} MB of disk to build; this server allows "
+                                  f"{self.memory_budget // 2 ** 20} MB and {self.disk_budget // 2 ** 20} MB")
+        if len(jobs) > self.max_pending_per_client:
+            raise JobTooLarge(f"At most {self.max_pending_per_client} jobs can be queued at once")
+        if not jobs:
+            return
+        with self._lock:
+            self._check(client, len(jobs))
+            self._queues.setdefault(client, deque()).extend(jobs)
+            self._pending_by_client[client] = self._pending_by_client.get(client, 0) + len(jobs)
+
+    def take(self):
+        """
+        Removes the jobs that may start now from the queue and reserves their cost.
+        Returns their ids, in start order.
+        """
+        started = []
+        with self._lock:
+            while self._queues and len(self._running) < self.slots:
+                running = {}
+                for running_client, _, _ in self._running.values():
+                    running[running_client] = running.get(running_client, 0) + 1
+                client = min(self._queues, key=lambda c: (running.get(c, 0), self._last_started.get(c, 0.0)))
+                queue = self._queues[client]
+                job_id, cost = queue[0]
+                # Wait for room rather than skip ahead, so big jobs don't starve
+                if self._running and (self._memory + cost.memory > self.memory_budget or
+                                      self._disk + cost.disk > self.disk_budget):
+                    break
+                queue.popleft()
+                if not queue:
+                    del self._queues[client]
+                self._last_started[client] = now = time.time()
+                self._running[job_id] = (client, cost, now)
+                self._memory += cost.memory
+                self._disk += cost.disk
+                started.append(job_id)
+        return started
+
+    def release(self, job_id, succeeded=True):
+        """Frees a started job's reservation; successful builds refine the throughput estimate."""
+        with self._lock:
+            entry = self._running.pop(job_id, None)
+            if entry is None:
+                return
+            client, cost, started_at = entry
+            self._memory -= cost.memory
+            self._disk -= cost.disk
+            self._pending_by_client[client] -= 1
+            if not self._pending_by_client[client]:
+                del self._pending_by_client[client]
+                self._last_started.pop(client, None)
+            seconds = time.time() - started_at
+            if succeeded and cost.work and seconds > 0:
+                self._rate = 0.8 * self._rate + 0.2 * (cost.work / seconds)
+
+    def estimated_wait(self):
+        """Seconds until a job queued now would start, from the work ahead of it."""
+        with self._lock:
+            now = time.time()
+            ahead = sum(cost.work for queue in self._queues.values() for _, cost in queue)
+            ahead += sum(max(0.0, cost.work - self._rate * (now - started_at))
+                         for _, cost, started_at in self._running.values())
+            if len(self._running) < self.slots and not self._queues:
+                return 0.0
+            return ahead / (self._rate * self.slots)
+
+    def gauges(self):
+        """Metrics gauge callback: queue depth, estimated wait and reserved budgets."""
+        wait = self.estimated_wait()
+        with self._lock:
+            depth = self._queued_count()
+            clients = len(self._queues)
+            memory, disk = self._memory, self._disk
+            rate = self._rate
+        return [
+            ("swaplist_job_queue_depth", {}, depth),
+            ("swaplist_job_queue_clients", {}, clients),
+            ("swaplist_job_queue_estimated_wait_seconds", {}, round(wait, 3)),
+            ("swaplist_build_bytes_per_second", {}, round(rate)),
+            ("swaplist_admission_reserved_bytes", {"resource": "memory"}, memory),
+            ("swaplist_admission_reserved_bytes", {"resource": "disk"}, disk),
+            ("swaplist_admission_budget_bytes", {"resource": "memory"}, self.memory_budget),
+            ("swaplist_admission_budget_bytes", {"resource": "disk"}, self.disk_budget),
+        ]
@@ -1,12 +1,41 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from typing import List
-from pydantic import BaseModel
-import shutil
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request, Response
+from fastapi.responses import RedirectResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from typing import List, Literal, Optional
+from pydantic import BaseModel, Field
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
-import tempfile
-from .core import parse_3mf, generate_swap_file
+import json
+import logging
+import zipfile
+from .core import parse_3mf, open_thumbnail, build_playlist, read_playlist_stats, span, collect_spans
+from .farm import plan_farm, read_plate_predictions, MAX_PRINTERS, MAX_FARM_COPIES
+from .ordering import plan_reorder
+from .store import store_upload, upload_path, upload_key, metadata_cache, CONTENT_HASH_RE, UnknownUpload
+from .storage import storage
+from .jobs import job_manager, JobQueueFull, JobTooLarge
+from .janitor import janitor
+from .checks import plate_checks
+from .uploads import (upload_sessions, MAX_CHUNK_SIZE, UploadSessionNotFound, UploadOffsetMismatch,
+                      UploadChecksumMismatch, UploadInvalid)
+from .metrics import metrics, server_timing
 
 router = APIRouter()
+log = logging.getLogger("swaplist.api")
+
+# Batch uploads are stored and parsed concurrently on this many threads
+PARSE_WORKERS = int(os.environ.get("SWAPLIST_PARSE_WORKERS", "4"))
+MAX_BATCH_FILES = int(os.environ.get("SWAPLIST_MAX_BATCH_FILES", "50"))
+_parse_pool = ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix="upload-parse")
+
+# Thumbnail URLs embed content hashes, so a response never goes stale
+THUMBNAIL_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Shown instead of parser internals ("seek out of range") for files that aren't 3MF archives
+INVALID_3MF_MESSAGE = "Not a valid 3MF file"
+# Seconds a client should wait before asking for plate checks that are still running
+CHECKS_RETRY_AFTER = 1
+# Copies of a single playlist item
+MAX_COPIES = 1000
 
 class PlateItem(BaseModel):
     id: str
@@ -15,34 +44,449 @@ class PlateItem(BaseModel):
     image_url: str
     print_time: int
     weight: float
-    file_path: str # Validation? Internal use.
+    # Opaque handle of the stored source 3mf, as returned by /upload
+    upload_token: Optional[str] = None
+    # Older clients echo the stored path instead; only paths inside the upload store are accepted
+    file_path: Optional[str] = None
     # We will use this to track how many copies user wants
-    count: int = 1
+    count: int = Field(1, ge=1, le=MAX_COPIES)
+    # Pinned items keep their position when the order is optimized
+    pinned: bool = False
+
+class UploadSessionRequest(BaseModel):
+    filename: str
+    size: int = Field(..., gt=0)
+    # Optional SHA-256 of the whole file, checked once the last chunk lands
+    sha256: Optional[str] = None
 
-class GenerateRequest(BaseModel):
+class PlaylistRequest(BaseModel):
     playlist: List[PlateItem]
 
+class GenerateRequest(PlaylistRequest):
+    # Output compression: lower levels / "rle" / "huffman" build faster, 9 gives the smallest file
+    compression_level: int = Field(6, ge=0, le=9)
+    compression_strategy: Literal["default", "filtered", "huffman", "rle"] = "default"
+    # Reorder unpinned items to group plates by filament before building
+    optimize_order: bool = False
+
+class FarmRequest(GenerateRequest):
+    # Number of printers to split the playlist across (one swap file each)
+    printers: int = Field(2, ge=1, le=MAX_PRINTERS)
+
 @router.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
-    # Save uploaded file to temp
-    temp_dir = tempfile.mkdtemp(prefix="swap_upload_")
-    file_path = os.path.join(temp_dir, file.filename)
+def upload_file(response: Response, file: UploadFile = File(...)):
+    with collect_spans() as spans:
+        result = _upload(file)
+    response.headers["Server-Timing"] = server_timing(spans)
+    return result
+
+def _upload(file):
+    # Hash the upload and store it under its content hash (skips the write for duplicates)
+    with span("store") as record:
+        file_path, content_hash, is_new = store_upload(file.file)
+        record["bytes"] = os.path.getsize(file_path)
+    metrics.inc("swaplist_upload_bytes_total", record["bytes"])
+    return _register_upload(file_path, content_hash, is_new, file.filename)
+
+def _register_upload(file_path, content_hash, is_new, filename):
+    """
+    Returns the upload response for a file in the upload store, parsing it
+    unless its plates are cached, and publishes new uploads to the shared storage.
+    Raises HTTPException(400) if it can't be read, 503 if it can't be published.
+    """
+    janitor.touch(file_path)
     
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Same project uploaded before? Reuse the parsed metadata.
+    plates = metadata_cache.get(content_hash, filename)
+    if plates is not None:
+        metrics.inc("swaplist_uploads_total", cache="hit")
+        _schedule_checks(content_hash)
+        return {"plates": _with_checks(content_hash, plates), "temp_id": content_hash, "content_hash": content_hash,
+                "upload_token": content_hash, "cache_hit": True}
         
     # Parse 3MF/Gcode and return metadata
     try:
-        plates = parse_3mf(file_path)
-        return {"plates": plates, "temp_id": temp_dir}
+        plates = parse_3mf(file_path, filename)
     except Exception as e:
+        if is_new:
+            os.remove(file_path) # Don't keep archives we can't read
+        metrics.inc("swaplist_uploads_total", cache="invalid")
+        if isinstance(e, (zipfile.BadZipFile, OSError, ValueError)):
+            log.warning("invalid upload filename=%s content_hash=%s error=%s", filename, content_hash, e)
+        else:
+            log.exception("could not parse upload filename=%s content_hash=%s", filename, content_hash)
+        raise HTTPException(status_code=400, detail=INVALID_3MF_MESSAGE)
+    
+    if is_new:
+        # Other workers and nodes resolve the upload token from the storage
+        try:
+            with span("publish", bytes=os.path.getsize(file_path)):
+                storage.publish(upload_key(content_hash))
+        except Exception as e:
+            os.remove(file_path) # stored again (and published) on the next attempt
+            log.error("could not publish upload content_hash=%s error=%s", content_hash, e)
+            raise HTTPException(status_code=503, detail="Upload storage is unavailable, try again shortly")
+    
+    metadata_cache.put(content_hash, plates)
+    metrics.inc("swaplist_uploads_total", cache="miss")
+    _schedule_checks(content_hash)
+    return {"plates": _with_checks(content_hash, plates), "temp_id": content_hash, "content_hash": content_hash,
+            "upload_token": content_hash, "cache_hit": False}
+
+def _schedule_checks(content_hash):
+    # Plate G-code is scanned after the response; the client fetches each plate's checks_url
+    try:
+        plate_checks.schedule(content_hash)
+    except (UnknownUpload, OSError, zipfile.BadZipFile) as e:
+        log.warning("could not schedule plate checks content_hash=%s error=%s", content_hash, e)
+
+def _with_checks(content_hash, plates):
+    """Plates with the checks already done filled in (and no checks_url to poll); the cached plates are not modified."""
+    filled = []
+    for plate in plates:
+        checks = plate_checks.cached(content_hash, plate["plate_index"])
+        filled.append(plate if checks is None else dict(plate, **checks, checks_url=None))
+    return filled
+
+@router.post("/upload/batch")
+def upload_batch(files: List[UploadFile] = File(...)):
+    """
+    Stores and parses many 3MFs at once. The response is NDJSON: one line per
+    file, written as soon as that file is done (not in upload order):
+    {"index", "filename", "plates", "content_hash", "upload_token", "cache_hit"} or {"index", "filename", "error"}.
+    """
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_FILES} files per batch")
+    
+    futures = [_parse_pool.submit(_batch_upload_result, index, file) for index, file in enumerate(files)]
+    
+    def results():
+        for future in as_completed(futures):
+            yield json.dumps(future.result()) + "\n"
+    
+    # X-Accel-Buffering: let nginx pass lines through as they are produced
+    return StreamingResponse(results(), media_type="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
+
+def _batch_upload_result(index, file):
+    try:
+        result = _upload(file)
+    except HTTPException as e:
+        return {"index": index, "filename": file.filename, "error": e.detail}
+    except Exception:
+        log.exception("batch upload failed filename=%s", file.filename)
+        return {"index": index, "filename": file.filename, "error": "Upload failed"}
+    return dict(result, index=index, filename=file.filename)
+
+@router.post("/uploads", status_code=201)
+def create_upload_session(request: UploadSessionRequest):
+    """
+    Starts a resumable upload. The client then sends the file in order with
+    PATCH /uploads/{upload_id}, each chunk carrying:
+      Upload-Offset: byte offset of the chunk (must equal the current offset)
+      Upload-Checksum: sha256 <hex digest of the chunk> (optional)
+    After a dropped connection, GET /uploads/{upload_id} returns the offset to resume from.
+    """
+    try:
+        session = upload_sessions.create(request.filename, request.size, request.sha256)
+    except UploadInvalid as e:
         raise HTTPException(status_code=400, detail=str(e))
+    return session.to_dict()
 
-@router.post("/generate")
-async def generate_swap(request: GenerateRequest):
-    # Call core logic to generate swap file
+@router.get("/uploads/{upload_id}")
+def get_upload_session(upload_id: str, response: Response):
     try:
-        download_url = generate_swap_file(request.playlist)
-        return {"download_url": download_url}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        session = upload_sessions.get(upload_id)
+    except UploadSessionNotFound:
+        raise HTTPException(status_code=404, detail="Unknown or expired upload")
+    response.headers["Upload-Offset"] = str(session.offset)
+    return session.to_dict()
+
+@router.patch("/uploads/{upload_id}")
+async def upload_chunk(upload_id: str, request: Request, response: Response):
+    """
+    Appends one chunk. When the last chunk lands the file is validated, moved
+    into the upload store and parsed; the response then also carries the same
+    fields as /upload (plates, content_hash, upload_token, cache_hit) and "complete": true.
+    """
+    try:
+        offset = int(request.headers["upload-offset"])
+    except (KeyError, ValueError):
+        raise HTTPException(status_code=400, detail="Missing or invalid Upload-Offset header")
+    checksum = None
+    if "upload-checksum" in request.headers:
+        algorithm, _, checksum = request.headers["upload-checksum"].strip().partition(" ")
+        if algorithm.lower() != "sha256" or not checksum:
+            raise HTTPException(status_code=400, detail="Upload-Checksum must be 'sha256 <hex digest>'")
+    data = await _read_chunk(request)
+    try:
+        session, stored = await run_in_threadpool(upload_sessions.write_chunk, upload_id, offset, data, checksum)
+    except UploadSessionNotFound:
+        raise HTTPException(status_code=404, detail="Unknown or expired upload")
+    except UploadOffsetMismatch as e:
+        raise HTTPException(status_code=409, detail=str(e), headers={"Upload-Offset": str(e.offset)})
+    except UploadChecksumMismatch as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except UploadInvalid as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    response.headers["Upload-Offset"] = str(session.offset)
+    if stored is None:
+        return dict(session.to_dict(), complete=False)
+    
+    file_path, content_hash, is_new = stored
+    metrics.inc("swaplist_upload_bytes_total", session.size)
+    result = await run_in_threadpool(_register_upload, file_path, content_hash, is_new, session.filename)
+    return dict(session.to_dict(), complete=True, **result)
+
+async def _read_chunk(request):
+    """
+    Reads a chunk request body of at most MAX_CHUNK_SIZE bytes. A declared
+    Content-Length is checked up front; without one the limit applies while reading.
+    Raises HTTPException 400 for a malformed Content-Length, 413 for an oversized chunk.
+    """
+    too_large = HTTPException(status_code=413, detail=f"Chunks are limited to {MAX_CHUNK_SIZE} bytes")
+    if "content-length" in request.headers:
+        try:
+            length = int(request.headers["content-length"])
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Content-Length header")
+        if length < 0:
+            raise HTTPException(status_code=400, detail="Invalid Content-Length header")
+        if length > MAX_CHUNK_SIZE:
+            raise too_large
+    
+    data = bytearray()
+    async for part in request.stream():
+        data += part
+        if len(data) > MAX_CHUNK_SIZE:
+            raise too_large
+    return bytes(data)
+
+@router.delete("/uploads/{upload_id}", status_code=204)
+def abort_upload_session(upload_id: str):
+    try:
+        upload_sessions.abort(upload_id)
+    except UploadSessionNotFound:
+        raise HTTPException(status_code=404, detail="Unknown or expired upload")
+
+@router.get("/thumbnails/{content_hash}/{plate_index}/{image_hash}.png")
+def get_thumbnail(content_hash: str, plate_index: int, image_hash: str, request: Request):
+    # Streams plate_N.png out of the stored upload; no thumbnail files are kept on disk
+    if not CONTENT_HASH_RE.fullmatch(content_hash):
+        raise HTTPException(status_code=404, detail="Unknown upload")
+    
+    headers = {"ETag": f'"{image_hash}"', "Cache-Control": THUMBNAIL_CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or headers["ETag"] in (t.strip().removeprefix("W/") for t in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    
+    thumbnail = open_thumbnail(content_hash, plate_index)
+    if thumbnail is None:
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+    janitor.touch(upload_path(content_hash))
+    
+    size, chunks = thumbnail
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(chunks, media_type="image/png", headers=headers)
+
+@router.get("/plates/{content_hash}/{plate_index}/checks")
+def get_plate_checks(content_hash: str, plate_index: int, response: Response):
+    """
+    A plate's G-code checks: {"status": "done", "gcode_stats", "warnings"}, or
+    202 {"status": "pending"} with Retry-After while its scan is running (the
+    scan is started by the upload, or here if this worker hasn't run it).
+    """
+    if not CONTENT_HASH_RE.fullmatch(content_hash):
+        raise HTTPException(status_code=404, detail="Unknown upload")
+    try:
+        checks = plate_checks.get(content_hash, plate_index)
+    except (UnknownUpload, OSError, zipfile.BadZipFile):
+        raise HTTPException(status_code=404, detail="Unknown upload")
+    janitor.touch(upload_path(content_hash))
+    
+    if checks is None:
+        response.status_code = 202
+        response.headers["Retry-After"] = str(CHECKS_RETRY_AFTER)
+        return {"status": "pending"}
+    return dict(checks, status="done")
+
+def _build_playlist(items):
+    """
+    build_playlist for request items. Raises HTTPException(410) if an item's
+    upload is unknown or was evicted, so the client knows to upload it again.
+    """
+    try:
+        return build_playlist(items)
+    except UnknownUpload as e:
+        raise HTTPException(status_code=410, detail=str(e))
+
+def _client(http_request):
+    # nginx passes the remote address on; without it, the direct peer
+    return http_request.headers.get("x-real-ip") or (http_request.client.host if http_request.client else "unknown")
+
+def _busy(e):
+    # Saturated: tell the client when it is worth asking again
+    return HTTPException(status_code=503, detail=f"Generator is busy, try again shortly ({e})",
+                         headers={"Retry-After": str(e.retry_after)})
+
+def _submit(playlist, build_options, client):
+    """
+    job_manager.submit_playlist for a request. Raises HTTPException 503 (with
+    Retry-After) when the queue is full, 413 if the job exceeds the admission
+    budgets, 410/400 if its sources can't be read.
+    """
+    return _submit_all([playlist], build_options, client)[0]
+
+def _submit_all(playlists, build_options, client):
+    """_submit for several playlists, queued all or none (job_manager.submit_playlists)."""
+    try:
+        with span("submit", jobs=len(playlists)):
+            return job_manager.submit_playlists(playlists, build_options, client)
+    except JobQueueFull as e:
+        raise _busy(e)
+    except JobTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except UnknownUpload as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    except (OSError, zipfile.BadZipFile) as e:
+        raise HTTPException(status_code=400, detail=f"Could not read playlist sources: {e}")
+
+def _plan_reorder(items, playlist_stats=None):
+    """
+    Runs plan_reorder for request playlist items.
+    Returns (items in the new order, reorder summary for the response).
+    Raises HTTPException(400) if a source can't be read.
+    """
+    playlist = _build_playlist(items)
+    with span("reorder", entries=len(playlist)):
+        try:
+            plan = plan_reorder(playlist, [item.pinned for item in items], playlist_stats)
+        except (OSError, zipfile.BadZipFile) as e:
+            raise HTTPException(status_code=400, detail=f"Could not read playlist sources: {e}")
+    reordered = [items[position] for position in plan.pop("order")]
+    return reordered, dict(order=[item.id for item in reordered], **plan)
+
+@router.post("/playlist/optimize")
+def optimize_playlist(request: PlaylistRequest, response: Response):
+    """
+    Suggests an order that groups plates by filament (pinned items stay put).
+    Returns {"order": [item ids], "original", "optimized", "saved"}, each
+    estimate being {"filament_changes", "seconds", "grams"}.
+    """
+    with collect_spans() as spans:
+        _, plan = _plan_reorder(request.playlist)
+    response.headers["Server-Timing"] = server_timing(spans)
+    return plan
+
+@router.post("/generate", status_code=202)
+def generate_swap(request: GenerateRequest, response: Response, http_request: Request):
+    # Queue generation on the worker pool and hand back a job id right away
+    build_options = {
+        "compress_level": request.compression_level,
+        "compress_strategy": request.compression_strategy,
+    }
+    items, reorder = request.playlist, None
+    with collect_spans() as spans:
+        if request.optimize_order:
+            items, reorder = _plan_reorder(items)
+        playlist = _build_playlist(items)
+        job = _submit(playlist, build_options, _client(http_request))
+    response.headers["Server-Timing"] = server_timing(spans)
+    
+    result = _job_response(job)
+    if reorder is not None:
+        result["reorder"] = reorder
+    return result
+
+def _job_response(job):
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "cache_hit": job.cache_hit,
+        "download_url": job.download_url if job.status == "done" else None,
+        "estimate": job.estimate if job.status == "done" else None,
+        "status_url": f"/api/jobs/{job.id}",
+        "result_url": f"/api/jobs/{job.id}/result",
+    }
+
+@router.post("/generate/farm", status_code=202)
+def generate_farm(request: FarmRequest, response: Response, http_request: Request):
+    """
+    Splits the playlist across `printers` printers by print time (slice_info
+    prediction + swap sequence per copy) and queues one swap file per printer.
+    The builds run in parallel on the job pool; poll each printer's job.
+    """
+    build_options = {
+        "compress_level": request.compression_level,
+        "compress_strategy": request.compression_strategy,
+    }
+    items, reorder = request.playlist, None
+    copies = sum(item.count for item in items)
+    if copies > MAX_FARM_COPIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_FARM_COPIES} copies per farm, got {copies}")
+    playlist = _build_playlist(items)
+    
+    with collect_spans() as spans:
+        with span("farm_plan", printers=request.printers, entries=len(playlist)):
+            try:
+                playlist_stats = read_playlist_stats(playlist)
+            except (OSError, zipfile.BadZipFile) as e:
+                raise HTTPException(status_code=400, detail=f"Could not read playlist sources: {e}")
+            # Each printer keeps the (optimized) playlist order for its share
+            positions = list(range(len(items)))
+            if request.optimize_order:
+                items, reorder = _plan_reorder(items, playlist_stats)
+                index_of = {id(item): position for position, item in enumerate(request.playlist)}
+                positions = [index_of[id(item)] for item in items]
+                playlist = _build_playlist(items)
+            plans = plan_farm(playlist, request.printers, read_plate_predictions(playlist, playlist_stats))
+        
+        # Every printer's job is queued, or none (no half-started farm on a 503)
+        busy = [plan for plan in plans if plan["playlist"]]
+        jobs = iter(_submit_all([plan["playlist"] for plan in busy], build_options, _client(http_request)))
+        
+        printers = []
+        for number, plan in enumerate(plans, 1):
+            printer = {
+                "printer": number,
+                "planned_seconds": plan["planned_seconds"],
+                # positions refer to the request playlist
+                "items": [{"position": positions[position], "count": count} for position, count in plan["entries"]],
+                "job": None,
+            }
+            if plan["playlist"]:
+                printer["job"] = _job_response(next(jobs))
+            printers.append(printer)
+    response.headers["Server-Timing"] = server_timing(spans)
+    
+    result = {
+        "printers": printers,
+        "makespan_seconds": max(plan["planned_seconds"] for plan in plans),
+        "total_seconds": sum(plan["planned_seconds"] for plan in plans),
+    }
+    if reorder is not None:
+        result["reorder"] = reorder
+    return result
+
+@router.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job
+
+@router.get("/jobs/{job_id}/result")
+def get_job_result(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=job["error"])
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    return RedirectResponse(job["download_url"], status_code=303)
+
+@router.get("/storage/stats")
+def storage_stats():
+    # Janitor view of the managed storage (bytes used, evictions, budget)
+    return janitor.stats()
@@ -1,8 +1,43 @@
-from fastapi import FastAPI
+import logging
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, FileResponse
 from .api import router as api_router
+from .core import add_span_listener, output_key
+from .jobs import job_manager
+from .janitor import janitor
+from .archives import archive_registry
+from .checks import plate_checks
+from .uploads import upload_sessions
+from .metrics import metrics, configure_logging
+from .storage import storage
+import gcode_scanner
 
-app = FastAPI(title="SwapList App")
+log = logging.getLogger("swaplist.app")
+
+configure_logging()
+# Spans finished in this process (uploads, fingerprints); worker spans arrive via the job manager
+add_span_listener(metrics.record_span)
+metrics.add_gauge_callback(job_manager.gauges)
+metrics.add_gauge_callback(janitor.gauges)
+metrics.add_gauge_callback(archive_registry.gauges)
+
+@asynccontextmanager
+async def lifespan(app):
+    if gcode_scanner.np is None:
+        log.warning("NumPy is not installed; plate G-code checks and print time estimates use the slower per-line parsers")
+    janitor.add_protected_provider(job_manager.paths_in_use)
+    janitor.add_protected_provider(upload_sessions.paths_in_use)
+    janitor.start()
+    yield
+    janitor.stop()
+    # Let running generate jobs finish and stop the worker pool
+    job_manager.shutdown()
+    plate_checks.shutdown()
+    archive_registry.close()
+
+app = FastAPI(title="SwapList App", lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -13,17 +48,26 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-from fastapi.staticfiles import StaticFiles
-import os
-
 app.include_router(api_router, prefix="/api")
 
-# Mount Static
-static_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
-if not os.path.exists(static_dir):
-    os.makedirs(static_dir)
+@app.get("/static/{filename}")
+def download_output(filename: str):
+    # Generated swap files, by storage key: built here, or fetched once from the
+    # shared storage if another worker or node built it
+    try:
+        if not filename.endswith(".3mf"): # never a build still in progress
+            raise FileNotFoundError(filename)
+        path = storage.fetch(output_key(filename))
+    except (ValueError, FileNotFoundError):
+        raise HTTPException(status_code=404, detail="Not Found")
+    # Feed downloads to the janitor's LRU
+    janitor.touch(path)
+    return FileResponse(path, media_type="application/octet-stream", filename=filename)
 
-app.mount("/static", StaticFiles(directory=static_dir), name="static")
+@app.get("/metrics")
+def read_metrics():
+    # Prometheus text exposition
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/")
 def read_root():
@@ -0,0 +1,141 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from generate_swap_gcode import SourceArchive
+from .store import resolve_upload, stored_hash
+
+# Stored uploads kept open (memory-mapped, zip directory indexed) between requests.
+# Each one costs a file mapping and its parsed directory, not its size in RAM.
+OPEN_ARCHIVES = int(os.environ.get("SWAPLIST_OPEN_ARCHIVES", "64"))
+
+class _OpenArchive:
+    __slots__ = ("source", "leases", "evicted")
+
+    def __init__(self, source):
+        self.source = source
+        self.leases = 0
+        self.evicted = False
+
+class ArchiveLease:
+    """
+    A borrowed archive from ArchiveRegistry.lease(). Use it as a context manager
+    (yields the SourceArchive) or call release() when done with .source.
+    """
+    def __init__(self, registry, entry):
+        self._registry = registry
+        self._entry = entry
+        self.source = entry.source
+
+    def release(self):
+        if self._entry is not None:
+            self._registry._release(self._entry)
+            self._entry = None
+
+    def __enter__(self):
+        return self.source
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+class ArchiveRegistry:
+    """
+    Bounded LRU of uploaded 3MFs kept open, keyed by upload token (the content
+    hash /upload hands out). Archives are memory-mapped with their Metadata/
+    index built, so thumbnails, plate stats and playlist planning read them
+    without reopening or rescanning the zip.
+    Archives are lent out with lease(); one evicted while leased is closed when
+    its last lease is released.
+    """
+    def __init__(self, max_open=OPEN_ARCHIVES):
+        self.max_open = max_open
+        self._entries = OrderedDict() # token -> _OpenArchive
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def lease(self, upload_token):
+        """
+        Returns an ArchiveLease on the stored upload.
+        Raises UnknownUpload if there is no such upload, zipfile.BadZipFile if it can't be read.
+        """
+        with self._lock:
+            entry = self._entries.get(upload_token)
+            if entry is not None:
+                entry.leases += 1
+                self._entries.move_to_end(upload_token)
+                self._stats["hits"] += 1
+                return ArchiveLease(self, entry)
+
+        # Open outside the lock; the central directory scan is the slow part
+        source = SourceArchive(resolve_upload(upload_token), mapped=True)
+        with self._lock:
+            self._stats["misses"] += 1
+            entry = self._entries.get(upload_token)
+            if entry is not None: # opened concurrently; keep the first
+                source.close()
+            else:
+                entry = self._entries[upload_token] = _OpenArchive(source)
+            entry.leases += 1
+            self._entries.move_to_end(upload_token)
+            while len(self._entries) > self.max_open:
+                _, oldest = self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+                self._retire(oldest)
+        return ArchiveLease(self, entry)
+
+    def discard(self, upload_token):
+        """Forgets an upload (e.g. evicted from the store); closed once no longer leased."""
+        with self._lock:
+            entry = self._entries.pop(upload_token, None)
+            if entry is not None:
+                self._retire(entry)
+
+    def close(self):
+        with self._lock:
+            while self._entries:
+                self._retire(self._entries.popitem()[1])
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, open=len(self._entries))
+
+    def gauges(self):
+        """Metrics gauge callback: open archives and lookup results."""
+        stats = self.stats()
+        return [
+            ("swaplist_open_archives", {}, stats["open"]),
+            ("swaplist_archive_leases_total", {"result": "hit"}, stats["hits"]),
+            ("swaplist_archive_leases_total", {"result": "miss"}, stats["misses"]),
+        ]
+
+    def _retire(self, entry):
+        # Called with the lock held
+        entry.evicted = True
+        if entry.leases == 0:
+            entry.source.close()
+
+    def _release(self, entry):
+        with self._lock:
+            entry.leases -= 1
+            if entry.evicted and entry.leases == 0:
+                entry.source.close()
+
+archive_registry = ArchiveRegistry()
+
+@contextmanager
+def open_source(file_path):
+    """
+    Yields an open SourceArchive for file_path: leased from archive_registry for
+    stored uploads, opened (and closed afterwards) for any other path.
+    """
+    upload_token = stored_hash(file_path)
+    if upload_token is None:
+        source = SourceArchive(file_path)
+        try:
+            yield source
+        finally:
+            source.close()
+    else:
+        with archive_registry.lease(upload_token) as source:
+            yield source
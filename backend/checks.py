@@ -0,0 +1,108 @@
+import os
+import re
+import logging
+import threading
+import zipfile
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from generate_swap_gcode import scan_plate_gcode, span
+from .archives import archive_registry
+
+log = logging.getLogger("swaplist.checks")
+
+# Plate checks scan the whole plate G-code, so they run on their own threads
+# after the upload has been answered
+CHECK_WORKERS = int(os.environ.get("SWAPLIST_CHECK_WORKERS", "2"))
+# Finished checks kept, keyed by upload content hash + plate file
+CHECK_CACHE_SIZE = 1024
+PLATE_GCODE_RE = re.compile(r"plate_\d+\.gcode")
+DAMAGED_WARNING = "G-code could not be read, the file may be damaged"
+
+class PlateChecks:
+    """
+    Background plate checks (see scan_plate_gcode) for stored uploads.
+    A plate's G-code is scanned once per upload content hash (the SHA-256 of the
+    whole archive, which pins every member; the zip's own CRC-32 can be forged),
+    started when its file is uploaded or on the first get(); finished checks are
+    kept in a bounded LRU. Each scan leases its archive from archive_registry.
+    """
+    def __init__(self, max_workers=CHECK_WORKERS, max_entries=CHECK_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="plate-checks")
+        self._results = OrderedDict() # (content hash, plate file) -> {"gcode_stats", "warnings"}
+        self._pending = set() # (content hash, plate file) being scanned
+        self._lock = threading.Lock()
+
+    def schedule(self, content_hash):
+        """
+        Starts the checks of every plate of a stored upload not checked yet.
+        Raises UnknownUpload if there is no such upload.
+        """
+        with archive_registry.lease(content_hash) as source:
+            for name in source.metadata:
+                if PLATE_GCODE_RE.fullmatch(name):
+                    self._start(content_hash, name)
+
+    def cached(self, content_hash, plate_index):
+        """A plate's finished checks {"gcode_stats", "warnings"}, or None if they aren't done (or not started)."""
+        key = (content_hash, f"plate_{plate_index}.gcode")
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+            return result
+
+    def get(self, content_hash, plate_index):
+        """
+        Returns a plate's checks {"gcode_stats", "warnings"} (gcode_stats None if it
+        has no G-code), or None while they are running; started here if needed.
+        Raises UnknownUpload if there is no such upload.
+        """
+        result = self.cached(content_hash, plate_index)
+        if result is not None:
+            return result
+
+        name = f"plate_{plate_index}.gcode"
+        with archive_registry.lease(content_hash) as source:
+            if name not in source.metadata:
+                return {"gcode_stats": None, "warnings": []}
+        self._start(content_hash, name)
+        return None
+
+    def shutdown(self):
+        """Drops the checks not started yet and waits for the running ones."""
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def _start(self, content_hash, name):
+        key = (content_hash, name)
+        with self._lock:
+            if key in self._results or key in self._pending:
+                return
+            self._pending.add(key)
+        self._pool.submit(self._run, content_hash, name)
+
+    def _run(self, content_hash, name):
+        result = None
+        try:
+            with archive_registry.lease(content_hash) as source:
+                info = source.metadata[name]
+                with span("plate_checks", bytes=info.file_size):
+                    stats = scan_plate_gcode(source, info)
+            result = {"warnings": stats.pop("warnings"), "gcode_stats": stats}
+        except (zipfile.BadZipFile, zlib.error, EOFError) as e:
+            log.warning("could not scan plate gcode content_hash=%s file=%s error=%s", content_hash, name, e)
+            result = {"gcode_stats": None, "warnings": [DAMAGED_WARNING]}
+        except Exception:
+            # e.g. the upload was evicted; the next get() starts over
+            log.exception("plate checks failed content_hash=%s file=%s", content_hash, name)
+        finally:
+            with self._lock:
+                self._pending.discard((content_hash, name))
+                if result is not None:
+                    self._results[content_hash, name] = result
+                    while len(self._results) > self.max_entries:
+                        self._results.popitem(last=False)
+
+plate_checks = PlateChecks()
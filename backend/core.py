@@ -1,111 +1,308 @@
 import os
 import sys
-import shutil
 import tempfile
 import uuid
+import json
+import hashlib
+import logging
+import zipfile
 
 # Add parent directory to path to import generate_swap_gcode
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from generate_swap_gcode import extract_3mf_to_temp, process_3mf_playlist
+from generate_swap_gcode import SourceArchive, process_3mf_playlist, source_key, SWAP_TEMPLATE_VERSION
+from generate_swap_gcode import METADATA_PREFIX, SWAP_ESTIMATE_NAME
+from generate_swap_gcode import span, collect_spans, add_span_listener
 import xml.etree.ElementTree as ET
+import re
+
+from .store import content_hash_for, resolve_upload, stored_hash, UnknownUpload
+from .archives import archive_registry, open_source
+from .storage import storage_key, OUTPUTS, OUTPUT_DIR
+
+log = logging.getLogger("swaplist.core")
 
 TEMP_STORAGE = tempfile.gettempdir()
-STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+# Generated swap files (local backend), or this node's cache of them (see storage.py)
+STATIC_DIR = OUTPUT_DIR
+
+# Thumbnails are streamed out of the stored upload in chunks of this size
+THUMBNAIL_CHUNK_SIZE = 64 * 1024
+# Hex digits of the image SHA-256 used in thumbnail URLs / ETags
+THUMBNAIL_HASH_LENGTH = 16
+
+# Bump when the layout of generated 3MFs changes, to invalidate cached outputs.
+OUTPUT_CACHE_VERSION = 2
 
-def parse_3mf(file_path):
+def parse_3mf(file_path, filename=None):
     """
     Parses a 3MF file and returns a list of plates with metadata.
+    filename: Name to report for the plates (defaults to the file's basename).
+    Only the zip central directory, slice_info.config and the plate thumbnails
+    (to hash them) are read; G-code is never decompressed and nothing is written
+    to disk. Stored uploads stay open in the archive registry afterwards.
+    Plate checks (G-code stats and warnings) come later, from each plate's
+    checks_url (see PlateChecks).
     """
-    # Extract to temp
-    extract_dir = extract_3mf_to_temp(file_path)
-    metadata_dir = os.path.join(extract_dir, "Metadata")
-    
-    plates = []
-    
     # We need to return info for the UI:
-    # - Thumbnail URL (we need to serve this)
+    # - Thumbnail URL (served from the stored archive, see open_thumbnail)
     # - Plate Index
     # - Weight / Time
+    # - G-code size (straight from the zip directory entry)
+    # - Where to fetch the plate checks (bounds vs. the swap sequence, truncation)
     
-    if os.path.exists(metadata_dir):
-        # Find slice_info
-        slice_info_path = os.path.join(metadata_dir, "slice_info.config")
-        stats_map = {} # index -> {weight, time}
-        
-        if os.path.exists(slice_info_path):
-            try:
-                tree = ET.parse(slice_info_path)
-                root = tree.getroot()
-                for plate in root.findall('plate'):
-                    idx_meta = plate.find("metadata[@key='index']")
-                    idx = idx_meta.get('value') if idx_meta is not None else "1"
-                    
-                    weight_meta = plate.find("metadata[@key='weight']")
-                    pred_meta = plate.find("metadata[@key='prediction']")
-                    
-                    stats_map[idx] = {
-                        "weight": float(weight_meta.get('value', 0)) if weight_meta is not None else 0,
-                        "time": int(pred_meta.get('value', 0)) if pred_meta is not None else 0
-                    }
-            except Exception as e:
-                print(f"Error parsing slice_info: {e}")
-
-        # List plates
-        for f in os.listdir(metadata_dir):
-            if f.startswith("plate_") and f.endswith(".png"):
-                # Found a plate thumbnail -> valid plate
-                # plate_1.png -> index 1
-                # STRICT match to avoid matching 'plate_1_small.png'
-                import re
-                match = re.search(r"^plate_(\d+)\.png$", f)
-                if match:
-                    idx = match.group(1)
-                    
-                    # Copy thumbnail to STATIC_DIR
-                    if not os.path.exists(STATIC_DIR):
-                        os.makedirs(STATIC_DIR)
-                        
-                    unique_img_name = f"thumb_{uuid.uuid4().hex[:8]}_{f}"
-                    dst_img_path = os.path.join(STATIC_DIR, unique_img_name)
-                    shutil.copy(os.path.join(metadata_dir, f), dst_img_path)
-                    
-                    # Public URL
-                    image_url = f"/static/{unique_img_name}"
-                    
-                    stats = stats_map.get(idx, {"weight": 0, "time": 0})
-                    
-                    plates.append({
-                        "id": str(uuid.uuid4()),
-                        "filename": os.path.basename(file_path),
-                        "file_path": file_path, # Keep track of where the source 3mf is (temp)
-                        "plate_index": int(idx),
-                        "image_url": image_url, # Now a URL
-                        "weight": stats['weight'],
-                        "print_time": stats['time']
-                    })
+    with span("parse_3mf", bytes=os.path.getsize(file_path)) as record:
+        with open_source(file_path) as source:
+            plates = _read_plates(source, file_path, filename)
+        record["plates"] = len(plates)
     
     return plates
 
-def generate_swap_file(playlist_items):
+def read_plate_stats(source):
     """
-    Generates the swap file from the playlist items.
+    Reads per-plate weight, print time ('prediction', seconds) and filaments
+    from the slice_info.config of an open SourceArchive.
+    Returns a dict of plate index (str) -> {"weight", "time", "filaments"}, each
+    filament being {"id", "type", "color", "used_g"}; empty if unreadable.
+    """
+    stats_map = {} # index -> {weight, time, filaments}
+    if "slice_info.config" not in source.metadata:
+        return stats_map
+    
+    with span("parse_3mf.slice_info"):
+        try:
+            root = ET.fromstring(source.read_metadata("slice_info.config"))
+            for plate in root.findall('plate'):
+                idx_meta = plate.find("metadata[@key='index']")
+                idx = idx_meta.get('value') if idx_meta is not None else "1"
+                
+                weight_meta = plate.find("metadata[@key='weight']")
+                pred_meta = plate.find("metadata[@key='prediction']")
+                
+                stats_map[idx] = {
+                    "weight": float(weight_meta.get('value', 0)) if weight_meta is not None else 0,
+                    "time": int(pred_meta.get('value', 0)) if pred_meta is not None else 0,
+                    "filaments": [
+                        {
+                            "id": filament.get('id'),
+                            "type": filament.get('type', ''),
+                            "color": filament.get('color', '').upper(),
+                            "used_g": float(filament.get('used_g', 0)),
+                        }
+                        for filament in plate.findall('filament')
+                    ],
+                }
+        except Exception as e:
+            log.warning("could not parse slice_info.config file=%s error=%s", source.path, e)
+    return stats_map
+
+def read_playlist_stats(playlist):
+    """
+    Returns {(path, plate_index): plate stats (see read_plate_stats)} for a
+    (path, index, count) playlist. Every distinct archive is read once (stored
+    uploads through the archive registry); plates missing from slice_info.config
+    are left out.
+    """
+    playlist_stats = {}
+    stats_by_source = {}
+    for path, index, _ in playlist:
+        key = source_key(path)
+        if key not in stats_by_source:
+            with open_source(path) as source:
+                stats_by_source[key] = read_plate_stats(source)
+        stats = stats_by_source[key].get(str(index))
+        if stats is not None:
+            playlist_stats[(path, index)] = stats
+    return playlist_stats
+
+def _read_plates(source, file_path, filename):
+    """Reads plate stats and thumbnails from an open SourceArchive (see parse_3mf)."""
+    plates = []
+    stats_map = read_plate_stats(source)
+
+    # List plates
+    content_hash = content_hash_for(file_path)
+    with span("parse_3mf.thumbnails"):
+        for f, info in source.metadata.items():
+            # Found a plate thumbnail -> valid plate
+            # plate_1.png -> index 1
+            # STRICT match to avoid matching 'plate_1_small.png'
+            match = re.search(r"^plate_(\d+)\.png$", f)
+            if not match:
+                continue
+            idx = match.group(1)
+            
+            # Thumbnails are served from the stored archive; the URL carries the
+            # image's own hash so it can be cached forever.
+            image_hash = hashlib.sha256(source.zip.read(info)).hexdigest()[:THUMBNAIL_HASH_LENGTH]
+            image_url = thumbnail_url(content_hash, idx, image_hash)
+            
+            stats = stats_map.get(idx, {"weight": 0, "time": 0, "filaments": []})
+            gcode_info = source.metadata.get(f"plate_{idx}.gcode")
+            
+            plates.append({
+                "id": str(uuid.uuid4()),
+                "filename": filename or os.path.basename(file_path),
+                "upload_token": content_hash, # Opaque handle the client sends back to /generate
+                "plate_index": int(idx),
+                "image_url": image_url, # Relative to the API root
+                "weight": stats['weight'],
+                "print_time": stats['time'],
+                "filaments": [{"type": fil["type"], "color": fil["color"]} for fil in stats['filaments']],
+                "gcode_size": gcode_info.file_size if gcode_info else 0,
+                "gcode_compressed_size": gcode_info.compress_size if gcode_info else 0,
+                # Filled in by the client from checks_url once the G-code scan is done
+                # (the upload response fills them in, with no checks_url, if it already is)
+                "gcode_stats": None,
+                "warnings": [],
+                "checks_url": checks_url(content_hash, idx), # Relative to the API root
+            })
+    
+    return plates
+
+def build_playlist(playlist_items):
+    """
+    Converts UI playlist items to (path, index, count) tuples.
+    Items name their source by upload_token; a file_path echoed by older clients
+    is only accepted if it points into the upload store.
+    Raises UnknownUpload for a token (or path) with no stored upload behind it.
     """
-    # Convert UI playlist items to (path, index, count) tuple
     playlist = []
     for item in playlist_items:
-        # item has 'file_path' (source temp 3mf), 'plate_index', 'count'
-        playlist.append((item.file_path, item.plate_index, item.count))
-        
-    output_filename = f"swap_playlist_{uuid.uuid4().hex[:8]}.3mf"
+        # item has 'upload_token' (stored source 3mf), 'plate_index', 'count'
+        upload_token = item.upload_token
+        if upload_token is None:
+            upload_token = stored_hash(item.file_path) if item.file_path else None
+            if upload_token is None:
+                raise UnknownUpload(f"Playlist item {item.id} does not reference an upload")
+        playlist.append((resolve_upload(upload_token), item.plate_index, item.count))
+    return playlist
+
+def playlist_fingerprint(playlist, build_options=None):
+    """
+    Canonical fingerprint of a (path, index, count) playlist: source content
+    hashes + plate indices + counts + swap template version + build options.
+    Two playlists with the same fingerprint produce the same swap file.
+    """
+    fingerprint = {
+        "version": OUTPUT_CACHE_VERSION,
+        "swap_template": SWAP_TEMPLATE_VERSION,
+        "items": [[content_hash_for(path), index, count] for path, index, count in playlist],
+        "options": build_options or {},
+    }
+    encoded = json.dumps(fingerprint, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+def new_output_target(fingerprint=None):
+    """
+    Returns (output_path, download_url) for a swap file in STATIC_DIR.
+    With a fingerprint the name is deterministic, so an existing file at that
+    path is a finished build of the same playlist.
+    """
+    if fingerprint:
+        output_filename = f"swap_playlist_{fingerprint[:16]}.3mf"
+    else:
+        output_filename = f"swap_playlist_{uuid.uuid4().hex[:8]}.3mf"
     
     if not os.path.exists(STATIC_DIR):
         os.makedirs(STATIC_DIR)
         
     output_path = os.path.join(STATIC_DIR, output_filename)
     
-    process_3mf_playlist(playlist, output_path)
-    
     # Return relative URL for download
-    return f"/static/{output_filename}"
+    return output_path, f"/static/{output_filename}"
+
+def output_key(output_path):
+    """Storage key of a generated swap file (see new_output_target)."""
+    return storage_key(OUTPUTS, os.path.basename(output_path))
+
+def thumbnail_url(content_hash, plate_index, image_hash):
+    """
+    API-relative URL of a plate thumbnail. Both hashes are content hashes, so
+    the URL changes whenever the image could.
+    """
+    return f"/thumbnails/{content_hash}/{plate_index}/{image_hash}.png"
 
+def checks_url(content_hash, plate_index):
+    """API-relative URL of a plate's checks (G-code stats and warnings, see PlateChecks)."""
+    return f"/plates/{content_hash}/{plate_index}/checks"
+
+def open_thumbnail(content_hash, plate_index):
+    """
+    Opens plate_N.png inside a stored upload.
+    Returns (size, chunk iterator) or None if the upload or the plate image is
+    missing. The iterator streams the decompressed PNG and releases its lease on
+    the (registry-held) archive when exhausted (or garbage collected).
+    """
+    try:
+        lease = archive_registry.lease(content_hash)
+    except (UnknownUpload, FileNotFoundError):
+        return None
+    
+    info = lease.source.metadata.get(f"plate_{plate_index}.png")
+    if info is None:
+        lease.release()
+        return None
+    
+    def chunks():
+        try:
+            with lease.source.zip.open(info) as src:
+                for chunk in iter(lambda: src.read(THUMBNAIL_CHUNK_SIZE), b""):
+                    yield chunk
+        finally:
+            lease.release()
+    
+    return info.file_size, chunks()
+
+def build_swap_file(playlist, output_path, progress=None, build_options=None, source_cache=None, segment_cache=None):
+    """
+    Runs process_3mf_playlist into a temp name and moves the result into place,
+    so a half-written file is never mistaken for a cached output.
+    build_options: Extra process_3mf_playlist keyword arguments (compression).
+    source_cache: SourceCache of already open sources to build from.
+    segment_cache: SegmentCache of plate G-code compressed by earlier builds.
+    Returns the job time estimate (see read_swap_estimate).
+    """
+    partial_path = f"{output_path}.part-{uuid.uuid4().hex[:8]}"
+    try:
+        estimate = process_3mf_playlist(playlist, partial_path, progress=progress, source_cache=source_cache,
+                                        segment_cache=segment_cache, **(build_options or {}))
+        if not os.path.exists(partial_path):
+            raise ValueError("No swap file was produced (empty playlist?)")
+        os.replace(partial_path, output_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    return estimate
+
+def read_swap_estimate(output_path):
+    """
+    Reads the time estimate stored in a generated swap file:
+    {"total_seconds", "init_seconds", "plates": [{"source", "gcode", "count", "plate_seconds", "swap_seconds"}]}
+    Returns None if the file has none (or can't be read).
+    """
+    try:
+        source = SourceArchive(output_path)
+    except (OSError, zipfile.BadZipFile):
+        return None
+    try:
+        if SWAP_ESTIMATE_NAME not in source.metadata:
+            return None
+        return json.loads(source.read_metadata(SWAP_ESTIMATE_NAME))
+    except ValueError:
+        return None
+    finally:
+        source.close()
+
+def generate_swap_file(playlist_items, progress=None, build_options=None):
+    """
+    Generates the swap file from the playlist items.
+    Returns the existing download URL if the same playlist was built before.
+    """
+    playlist = build_playlist(playlist_items)
+    output_path, download_url = new_output_target(playlist_fingerprint(playlist, build_options))
+    
+    if not os.path.exists(output_path):
+        build_swap_file(playlist, output_path, progress=progress, build_options=build_options)
+    
+    return download_url
@@ -0,0 +1,62 @@
+import heapq
+from collections import Counter
+
+from generate_swap_gcode import swap_sequence_seconds
+
+from .core import read_playlist_stats
+
+MAX_PRINTERS = 32
+# plan_farm places every copy on its own, so a farm is limited to this many copies in total
+MAX_FARM_COPIES = 10000
+
+def read_plate_predictions(playlist, playlist_stats=None):
+    """
+    Returns {(path, plate_index): print time in seconds} for a (path, index, count)
+    playlist, taken from each source's slice_info.config ('prediction').
+    playlist_stats: read_playlist_stats(playlist), read here if not given.
+    Unknown plates are left out.
+    """
+    if playlist_stats is None:
+        playlist_stats = read_playlist_stats(playlist)
+    return {plate: stats["time"] for plate, stats in playlist_stats.items()}
+
+def plan_farm(playlist, printers, predictions, swap_seconds=None):
+    """
+    Splits a (path, index, count) playlist across printers so the last printer
+    finishes as early as possible.
+    Every copy is a unit costing its print time plus one swap sequence. Units are
+    placed longest first onto the least loaded printer (LPT), which is within 4/3
+    of the optimal makespan and exact for equal plates.
+    swap_seconds: Time the swap sequence (eject the finished plate, load the
+    next) adds after every print; by default the estimate the per-job
+    swap_estimate.json uses (swap_sequence_seconds).
+    Returns one plan per printer:
+    {"entries": [(playlist position, count)], "playlist": [(path, index, count)], "planned_seconds": t}
+    Each printer keeps the original playlist order, with its copies of an entry merged.
+    """
+    if swap_seconds is None:
+        swap_seconds = swap_sequence_seconds()
+    units = []
+    for position, (path, index, count) in enumerate(playlist):
+        duration = predictions.get((path, index), 0) + swap_seconds
+        units.extend([(duration, position)] * count)
+    # Longest first; ties keep playlist order so plans are deterministic
+    units.sort(key=lambda unit: (-unit[0], unit[1]))
+
+    loads = [(0, printer) for printer in range(printers)]
+    assigned = [Counter() for _ in range(printers)]
+    for duration, position in units:
+        load, printer = heapq.heappop(loads)
+        assigned[printer][position] += 1
+        heapq.heappush(loads, (load + duration, printer))
+
+    plans = []
+    for counts in assigned:
+        entries = sorted(counts.items())
+        plans.append({
+            "entries": entries,
+            "playlist": [(playlist[position][0], playlist[position][1], count) for position, count in entries],
+            "planned_seconds": round(sum((predictions.get(playlist[position][:2], 0) + swap_seconds) * count
+                                         for position, count in entries)),
+        })
+    return plans
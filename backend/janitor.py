@@ -0,0 +1,203 @@
+import os
+import re
+import time
+import shutil
+import tempfile
+import logging
+import threading
+
+from generate_swap_gcode import SEGMENT_CACHE_DIR
+from .core import STATIC_DIR
+from .store import UPLOAD_STORE_DIR, metadata_cache
+from .storage import JOB_RECORD_DIR
+from .archives import archive_registry
+from .uploads import UPLOAD_SESSION_DIR
+
+log = logging.getLogger("swaplist.janitor")
+
+# Byte budget for generated files (static outputs + stored uploads + partial chunked uploads +
+# plate deflate segments).
+# With the s3 storage backend these directories are only this node's cache of the bucket.
+STORAGE_BUDGET_BYTES = int(os.environ.get("SWAPLIST_STORAGE_BUDGET_BYTES", str(2 * 1024 ** 3)))
+# Anything not accessed for this long is removed regardless of the budget
+FILE_TTL_SECONDS = int(os.environ.get("SWAPLIST_FILE_TTL_SECONDS", str(24 * 3600)))
+JANITOR_INTERVAL_SECONDS = int(os.environ.get("SWAPLIST_JANITOR_INTERVAL_SECONDS", "300"))
+
+# Leftover working directories from older builds/uploads (TTL only)
+TEMP_DIR_PREFIXES = ("swap_upload_", "swap_extract_", "swap_segments_")
+
+def _in_progress(path):
+    """Temp names of uploads, fetches and builds not moved into place yet, and partial chunked uploads."""
+    name = os.path.basename(path)
+    return name.startswith(".") or ".part-" in name or name.endswith(".part")
+
+class StorageJanitor:
+    """
+    Evicts files from the managed directories by TTL and, when over the byte
+    budget, least recently used first. Accesses are recorded with touch(), which
+    also sets the file's atime so the janitors of other API workers see them;
+    files never touched fall back to their mtime.
+    """
+    def __init__(self, managed_dirs, budget_bytes=STORAGE_BUDGET_BYTES, ttl_seconds=FILE_TTL_SECONDS,
+                 interval_seconds=JANITOR_INTERVAL_SECONDS, temp_root=None):
+        self.managed_dirs = managed_dirs
+        self.budget_bytes = budget_bytes
+        self.ttl_seconds = ttl_seconds
+        self.interval_seconds = interval_seconds
+        self.temp_root = temp_root or tempfile.gettempdir()
+        self._last_access = {}
+        self._protected_providers = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {
+            "bytes_used": 0,
+            "files": 0,
+            "evictions": 0,
+            "evicted_bytes": 0,
+            "temp_dirs_removed": 0,
+            "runs": 0,
+            "last_run": None,
+        }
+
+    def touch(self, path):
+        """Records an access to a managed file."""
+        now = time.time()
+        with self._lock:
+            self._last_access[os.path.abspath(path)] = now
+        try:
+            os.utime(path, ns=(int(now * 1e9), os.stat(path).st_mtime_ns))
+        except OSError:
+            pass
+
+    def add_protected_provider(self, provider):
+        """
+        Registers a callable returning paths that must not be evicted right now
+        (e.g. sources and outputs of running jobs).
+        """
+        self._protected_providers.append(provider)
+
+    def _protected_paths(self):
+        protected = set()
+        for provider in self._protected_providers:
+            protected.update(os.path.abspath(p) for p in provider())
+        return protected
+
+    def _scan(self):
+        entries = []
+        for directory in self.managed_dirs:
+            if not os.path.isdir(directory):
+                continue
+            for entry in os.scandir(directory):
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                st = entry.stat(follow_symlinks=False)
+                path = os.path.abspath(entry.path)
+                with self._lock:
+                    last_access = max(self._last_access.get(path, 0), st.st_mtime, st.st_atime)
+                entries.append((last_access, st.st_size, path))
+        return entries
+
+    def _evict(self, path, size):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            self._last_access.pop(path, None)
+            self._stats["evictions"] += 1
+            self._stats["evicted_bytes"] += size
+        
+        # Stored uploads back cached plate lists and open archives; drop them together
+        if os.path.dirname(path) == os.path.abspath(UPLOAD_STORE_DIR):
+            name = os.path.splitext(os.path.basename(path))[0]
+            metadata_cache.discard(name)
+            archive_registry.discard(name)
+        return True
+
+    def _clean_temp_dirs(self, now):
+        if not os.path.isdir(self.temp_root):
+            return
+        for entry in os.scandir(self.temp_root):
+            if not entry.name.startswith(TEMP_DIR_PREFIXES) or not entry.is_dir(follow_symlinks=False):
+                continue
+            if now - entry.stat(follow_symlinks=False).st_mtime < self.ttl_seconds:
+                continue
+            shutil.rmtree(entry.path, ignore_errors=True)
+            with self._lock:
+                self._stats["temp_dirs_removed"] += 1
+
+    def run_once(self):
+        """
+        Runs one eviction pass and returns the updated stats.
+        """
+        now = time.time()
+        protected = self._protected_paths()
+        entries = sorted(self._scan()) # oldest access first
+        
+        kept = []
+        for last_access, size, path in entries:
+            if path not in protected and now - last_access >= self.ttl_seconds:
+                self._evict(path, size)
+            else:
+                kept.append((last_access, size, path))
+        
+        bytes_used = sum(size for _, size, _ in kept)
+        remaining = []
+        for last_access, size, path in kept:
+            # Files still being written (by this or another worker) only expire by TTL
+            if bytes_used > self.budget_bytes and path not in protected and not _in_progress(path) \
+                    and self._evict(path, size):
+                bytes_used -= size
+            else:
+                remaining.append(path)
+        
+        self._clean_temp_dirs(now)
+        
+        with self._lock:
+            # Forget accesses of files that are gone
+            remaining_set = set(remaining)
+            for path in [p for p in self._last_access if p not in remaining_set]:
+                del self._last_access[path]
+            self._stats["bytes_used"] = bytes_used
+            self._stats["files"] = len(remaining)
+            self._stats["runs"] += 1
+            self._stats["last_run"] = now
+        return self.stats()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, budget_bytes=self.budget_bytes, ttl_seconds=self.ttl_seconds)
+
+    def gauges(self):
+        """Metrics gauge callback: storage usage as of the last pass."""
+        stats = self.stats()
+        return [
+            ("swaplist_storage_bytes", {}, stats["bytes_used"]),
+            ("swaplist_storage_files", {}, stats["files"]),
+            ("swaplist_storage_evictions_total", {}, stats["evictions"]),
+        ]
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                log.exception("janitor pass failed: %s", e)
+            self._stop.wait(self.interval_seconds)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="storage-janitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+
+janitor = StorageJanitor([STATIC_DIR, UPLOAD_STORE_DIR, UPLOAD_SESSION_DIR, JOB_RECORD_DIR, SEGMENT_CACHE_DIR])
@@ -0,0 +1,392 @@
+import os
+import re
+import time
+import uuid
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+
+from generate_swap_gcode import SourceCache, SegmentCache
+from .janitor import janitor
+from .archives import OPEN_ARCHIVES
+from .admission import AdmissionQueue, JobQueueFull, JobTooLarge, estimate_job_cost
+from .core import (build_playlist, new_output_target, build_swap_file, read_swap_estimate, playlist_fingerprint,
+                   output_key, span, add_span_listener)
+from .storage import storage, storage_key, JOBS
+from .metrics import metrics, configure_logging, LOG_LEVEL
+
+log = logging.getLogger("swaplist.jobs")
+
+# Generation runs in a separate process pool so big builds never block the event loop.
+MAX_WORKERS = int(os.environ.get("SWAPLIST_JOB_WORKERS", "2"))
+MAX_PENDING_JOBS = int(os.environ.get("SWAPLIST_MAX_PENDING_JOBS", "32"))
+MAX_FINISHED_JOBS = 200
+JOB_ID_RE = re.compile(r"[0-9a-f]{32}")
+
+# Minimum progress change worth sending back from a worker
+PROGRESS_STEP = 0.01
+
+class Job:
+    """
+    State of one generate request, as seen by the status endpoint.
+    """
+    def __init__(self, download_url, fingerprint=None, output_path=None, source_paths=(), client=None):
+        self.id = uuid.uuid4().hex
+        self.output_path = output_path
+        self.source_paths = list(source_paths)
+        self.fingerprint = fingerprint
+        self.client = client
+        # Estimated JobCost, and what the worker needs, while the job waits for admission
+        self.cost = None
+        self.build_args = None
+        self.cache_hit = False
+        self.status = "queued" # queued -> running -> done | failed
+        self.stage = None
+        self.progress = None
+        self.download_url = download_url
+        # Estimated print time of the whole job (set once the file exists)
+        self.estimate = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "download_url": self.download_url if self.status == "done" else None,
+            "error": self.error,
+            "estimate": self.estimate,
+            "cache_hit": self.cache_hit,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+# --- WORKER SIDE ---
+
+_progress_queue = None
+# Sources stay memory-mapped and indexed across the jobs a worker runs, so a
+# playlist built again (or another one from the same uploads) copies G-code
+# straight away. The pages themselves are shared through the page cache.
+_source_cache = None
+# Plate G-code is deflated once per node and spliced into every output that
+# repeats it (SWAPLIST_SEGMENT_DIR, shared by the workers, trimmed by the janitor)
+_segment_cache = None
+
+def _init_worker(progress_queue, log_level):
+    global _progress_queue, _source_cache, _segment_cache
+    _progress_queue = progress_queue
+    _source_cache = SourceCache(max_open=OPEN_ARCHIVES, mapped=True)
+    _segment_cache = SegmentCache()
+    configure_logging(log_level)
+    # Stage timings are recorded by the parent's metrics registry
+    add_span_listener(lambda record: progress_queue.put(("span", record)))
+
+def _run_generate_job(job_id, playlist, output_path, build_options):
+    """
+    Runs in a pool process. Progress is sent back as ("progress", job_id, stage, fraction).
+    Returns the job time estimate.
+    """
+    last = {"stage": None, "fraction": None}
+
+    def progress(stage, fraction):
+        if stage == last["stage"] and fraction is not None and last["fraction"] is not None \
+                and fraction - last["fraction"] < PROGRESS_STEP:
+            return
+        last["stage"], last["fraction"] = stage, fraction
+        _progress_queue.put(("progress", job_id, stage, fraction))
+
+    progress("started", None)
+    log.info("job started job_id=%s entries=%d", job_id, len(playlist))
+    estimate = build_swap_file(playlist, output_path, progress=progress, build_options=build_options,
+                               source_cache=_source_cache, segment_cache=_segment_cache)
+    # Downloads (and cache hits) may land on another worker or node
+    with span("publish", bytes=os.path.getsize(output_path)):
+        storage.publish(output_key(output_path))
+    return estimate
+
+# --- SERVER SIDE ---
+
+class JobManager:
+    """
+    Bounded process-pool job system for swap file generation.
+    Jobs wait in an AdmissionQueue (fair across clients, within memory and disk
+    budgets) and are handed to the pool once they may start.
+    Jobs are tracked in memory; finished jobs are kept for polling until
+    MAX_FINISHED_JOBS newer ones have finished. Every status change is also
+    written to the storage as jobs/<id>.json, so any API worker can answer a
+    status poll (progress in between is only known to the owning worker).
+    """
+    def __init__(self, max_workers=MAX_WORKERS, max_pending=MAX_PENDING_JOBS):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.admission = AdmissionQueue(max_workers, max_pending)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._progress_queue = None
+        self._listener = None
+
+    def _ensure_started(self):
+        if self._executor is not None:
+            return
+        ctx = multiprocessing.get_context("spawn")
+        self._progress_queue = ctx.Queue()
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=ctx,
+            initializer=_init_worker,
+            initargs=(self._progress_queue, LOG_LEVEL),
+        )
+        self._listener = threading.Thread(target=self._listen, args=(self._progress_queue,), daemon=True)
+        self._listener.start()
+
+    def _listen(self, progress_queue):
+        while True:
+            message = progress_queue.get()
+            if message is None:
+                return
+            if message[0] == "span":
+                metrics.record_span(message[1])
+                continue
+            if message[0] == "dispatch":
+                self._dispatch()
+                continue
+            _, job_id, stage, fraction = message
+            record = None
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or job.finished:
+                    continue
+                if job.status == "queued":
+                    job.status = "running"
+                    job.started_at = time.time()
+                    record = job.to_dict()
+                if stage != "started":
+                    job.stage = stage
+                    job.progress = fraction
+            if record is not None:
+                self._save(record)
+
+    def pending_count(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if not job.finished)
+
+    def gauges(self):
+        """Metrics gauge callback: tracked jobs by status, and the admission queue."""
+        with self._lock:
+            counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        return [("swaplist_jobs", {"status": status}, count) for status, count in counts.items()] + \
+            self.admission.gauges()
+
+    def submit(self, playlist_items, build_options=None, client=None):
+        """
+        Queues a generate job and returns it immediately.
+        If the same playlist was already built, the returned job is finished
+        (cache_hit) and points at the existing file; if it is being built right
+        now, the in-flight job is returned.
+        client: Who asked (e.g. the remote address), for fair queueing.
+        Raises JobQueueFull if too many jobs are already waiting or running (in
+        total or for this client), JobTooLarge if the job exceeds the budgets.
+        """
+        return self.submit_playlist(build_playlist(playlist_items), build_options, client)
+
+    def submit_playlist(self, playlist, build_options=None, client=None):
+        """submit() for a playlist already converted to (path, index, count) tuples."""
+        return self.submit_playlists([playlist], build_options, client)[0]
+
+    def submit_playlists(self, playlists, build_options=None, client=None):
+        """
+        submit_playlist() for several playlists at once (e.g. one per printer),
+        all or none: if any of the new jobs isn't admitted, none is queued.
+        Returns the jobs, in playlist order.
+        """
+        jobs = [self._prepare(playlist, build_options, client) for playlist in playlists]
+        
+        with self._lock:
+            # The same playlist twice, or one being built right now, joins the first job
+            building = {other.fingerprint: other for other in self._jobs.values() if not other.finished}
+            new = []
+            for position, job in enumerate(jobs):
+                if job.finished:
+                    continue
+                other = building.get(job.fingerprint)
+                if other is not None:
+                    jobs[position] = other
+                    metrics.inc("swaplist_jobs_submitted_total", outcome="joined")
+                    continue
+                building[job.fingerprint] = job
+                new.append(job)
+            
+            try:
+                self.admission.admit_all([(job.id, job.cost) for job in new], client)
+            except JobTooLarge:
+                metrics.inc("swaplist_jobs_submitted_total", outcome="too_large")
+                raise
+            except JobQueueFull:
+                metrics.inc("swaplist_jobs_submitted_total", outcome="rejected")
+                raise
+            for job in jobs:
+                if job.cache_hit or job in new:
+                    self._jobs[job.id] = job
+            self._prune()
+        
+        for job in jobs:
+            if job.cache_hit:
+                self._save(job.to_dict())
+                metrics.inc("swaplist_jobs_submitted_total", outcome="cache_hit")
+        for job in new:
+            self._save(job.to_dict())
+            metrics.inc("swaplist_jobs_submitted_total", outcome="queued")
+            log.info("job queued job_id=%s client=%s work_bytes=%d memory_bytes=%d disk_bytes=%d", job.id, client,
+                     job.cost.work, job.cost.memory, job.cost.disk)
+        
+        if new:
+            self._dispatch()
+        return jobs
+
+    def _prepare(self, playlist, build_options, client):
+        """
+        A new Job for the playlist: finished (cache_hit) if it was built before,
+        else with its cost and build_args set, ready for admission.
+        """
+        with span("fingerprint", entries=len(playlist)):
+            fingerprint = playlist_fingerprint(playlist, build_options)
+        output_path, download_url = new_output_target(fingerprint)
+        job = Job(download_url, fingerprint, output_path, {path for path, _, _ in playlist}, client)
+        
+        # Built before, maybe by another worker or node (fetched here to read its estimate)
+        if storage.exists(output_key(output_path)):
+            try:
+                job.estimate = read_swap_estimate(storage.fetch(output_key(output_path)))
+            except FileNotFoundError:
+                pass # evicted in between; build it again
+            else:
+                janitor.touch(output_path)
+                job.status = job.stage = "done"
+                job.progress = 1.0
+                job.cache_hit = True
+                job.started_at = job.finished_at = time.time()
+                return job
+        
+        with span("estimate_cost", entries=len(playlist)):
+            job.cost = estimate_job_cost(playlist)
+        job.build_args = (playlist, build_options)
+        return job
+
+    def _dispatch(self):
+        """Hands every job the admission queue lets start now to the pool."""
+        for job_id in self.admission.take():
+            with self._lock:
+                job = self._jobs[job_id]
+                playlist, build_options = job.build_args
+                job.build_args = None
+                self._ensure_started()
+            metrics.observe("swaplist_job_queue_wait_seconds", time.time() - job.created_at)
+            try:
+                try:
+                    future = self._executor.submit(_run_generate_job, job.id, playlist, job.output_path, build_options)
+                except BrokenProcessPool:
+                    # A worker died (e.g. OOM killed); start a fresh pool and retry once
+                    log.warning("worker pool broken, restarting")
+                    with self._lock:
+                        self._reset()
+                        self._ensure_started()
+                    future = self._executor.submit(_run_generate_job, job.id, playlist, job.output_path,
+                                                   build_options)
+            except Exception as e:
+                future = Future()
+                future.set_exception(e)
+                self._finish(job.id, future)
+                continue
+            future.add_done_callback(lambda f, job_id=job.id: self._finish(job_id, f))
+
+    def _finish(self, job_id, future):
+        error = future.exception()
+        self.admission.release(job_id, succeeded=error is None)
+        with self._lock:
+            progress_queue = self._progress_queue
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.finished_at = time.time()
+            if job.started_at is None:
+                job.started_at = job.finished_at
+            if error is None:
+                job.status = "done"
+                job.stage = "done"
+                job.progress = 1.0
+                job.estimate = future.result()
+            else:
+                job.status = "failed"
+                job.error = str(error)
+                log.error("job failed job_id=%s error=%s", job_id, error)
+            metrics.inc("swaplist_jobs_finished_total", status=job.status)
+            self._prune()
+            record = job.to_dict()
+        self._save(record)
+        # The next jobs are started from the listener thread, not the pool's callback thread
+        if progress_queue is not None:
+            progress_queue.put(("dispatch",))
+
+    def _save(self, record):
+        """Writes a job's status (to_dict) to the storage for the other API workers."""
+        try:
+            storage.put_json(storage_key(JOBS, f"{record['job_id']}.json"), record)
+        except Exception as e:
+            log.warning("could not save job record job_id=%s error=%s", record["job_id"], e)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    def paths_in_use(self):
+        """
+        Source and output paths of unfinished jobs (kept safe from the janitor).
+        """
+        with self._lock:
+            paths = []
+            for job in self._jobs.values():
+                if not job.finished:
+                    paths.extend(job.source_paths)
+                    paths.append(job.output_path)
+            return paths
+
+    def get(self, job_id):
+        """Returns the job's to_dict(); jobs of other workers come from their stored record."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return job.to_dict()
+        if not JOB_ID_RE.fullmatch(job_id):
+            return None
+        return storage.get_json(storage_key(JOBS, f"{job_id}.json"))
+
+    def _reset(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._progress_queue.put(None)
+        self._executor = None
+
+    def shutdown(self):
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._progress_queue.put(None)
+        self._listener.join(timeout=5)
+        self._executor = None
+
+job_manager = JobManager()
@@ -0,0 +1,144 @@
+import os
+import logging
+import threading
+
+# Leveled logging for the app and the generate workers
+LOG_LEVEL = os.environ.get("SWAPLIST_LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s %(message)s"
+
+# Histogram buckets (seconds) for pipeline stage durations
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+def configure_logging(level=LOG_LEVEL):
+    """
+    Sends "swaplist.*" logs to stderr at the given level. Safe to call more
+    than once (e.g. in every worker process).
+    """
+    logging.basicConfig(format=LOG_FORMAT)
+    logging.getLogger("swaplist").setLevel(level)
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key):
+    if not key:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in key)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(key, escaped)) + "}"
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metrics:
+    """
+    Minimal in-process metrics registry rendered in the Prometheus text format.
+    Counters and histograms are updated in place; gauges are read from
+    callbacks at scrape time so they are never stale.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {} # name -> (type, help)
+        self._counters = {} # name -> {label_key: value}
+        self._histograms = {} # name -> {label_key: [bucket counts..., sum, count]}
+        self._gauge_callbacks = []
+
+    def describe(self, name, kind, help_text):
+        self._meta[name] = (kind, help_text)
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            key = _label_key(labels)
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            key = _label_key(labels)
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [0] * len(DURATION_BUCKETS) + [0.0, 0]
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def add_gauge_callback(self, callback):
+        """
+        Registers callback() -> iterable of (name, labels dict, value), read on every scrape.
+        """
+        self._gauge_callbacks.append(callback)
+
+    def record_span(self, record):
+        """Span listener: stage durations, bytes and errors."""
+        stage = record["stage"]
+        self.observe("swaplist_stage_duration_seconds", record["duration"], stage=stage)
+        if record.get("bytes"):
+            self.inc("swaplist_stage_bytes_total", record["bytes"], stage=stage)
+        if record.get("error"):
+            self.inc("swaplist_stage_errors_total", stage=stage)
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format (0.0.4)."""
+        gauges = {}
+        for callback in self._gauge_callbacks:
+            try:
+                for name, labels, value in callback():
+                    gauges.setdefault(name, {})[_label_key(labels)] = value
+            except Exception:
+                logging.getLogger("swaplist.metrics").exception("gauge callback failed")
+        
+        lines = []
+        def header(name, default_kind):
+            kind, help_text = self._meta.get(name, (default_kind, name))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+        
+        with self._lock:
+            for name in sorted(self._counters):
+                header(name, "counter")
+                for key, value in sorted(self._counters[name].items()):
+                    lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+            for name in sorted(self._histograms):
+                header(name, "histogram")
+                for key, state in sorted(self._histograms[name].items()):
+                    for bound, count in zip(DURATION_BUCKETS, state):
+                        lines.append(f"{name}_bucket{_format_labels(key + (('le', bound),))} {count}")
+                    lines.append(f"{name}_bucket{_format_labels(key + (('le', '+Inf'),))} {state[-1]}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {_format_value(state[-2])}")
+                    lines.append(f"{name}_count{_format_labels(key)} {state[-1]}")
+        for name in sorted(gauges):
+            header(name, "gauge")
+            for key, value in sorted(gauges[name].items()):
+                lines.append(f"{name}{_format_labels(key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+def server_timing(spans):
+    """
+    Formats collected span records as a Server-Timing header value,
+    e.g. 'store;dur=3.1, parse_3mf;dur=12.4'.
+    """
+    return ", ".join(f"{record['stage']};dur={record['duration'] * 1000:.1f}" for record in spans)
+
+metrics = Metrics()
+metrics.describe("swaplist_stage_duration_seconds", "histogram", "Duration of pipeline stages (upload parsing and swap builds)")
+metrics.describe("swaplist_stage_bytes_total", "counter", "Bytes processed by pipeline stages")
+metrics.describe("swaplist_stage_errors_total", "counter", "Pipeline stages that raised")
+metrics.describe("swaplist_uploads_total", "counter", "Uploaded files by metadata cache result")
+metrics.describe("swaplist_upload_bytes_total", "counter", "Bytes received by the upload endpoint")
+metrics.describe("swaplist_jobs_submitted_total", "counter", "Generate requests by outcome (queued, cache_hit, joined, rejected, too_large)")
+metrics.describe("swaplist_jobs_finished_total", "counter", "Finished generate jobs by status")
+metrics.describe("swaplist_jobs", "gauge", "Generate jobs currently tracked, by status")
+metrics.describe("swaplist_job_queue_depth", "gauge", "Generate jobs waiting for admission")
+metrics.describe("swaplist_job_queue_clients", "gauge", "Clients with generate jobs waiting for admission")
+metrics.describe("swaplist_job_queue_estimated_wait_seconds", "gauge", "Estimated wait before a generate job queued now starts")
+metrics.describe("swaplist_job_queue_wait_seconds", "histogram", "Time generate jobs waited for admission")
+metrics.describe("swaplist_build_bytes_per_second", "gauge", "Measured build throughput (combined G-code bytes per second)")
+metrics.describe("swaplist_admission_reserved_bytes", "gauge", "Memory and disk reserved by running generate jobs")
+metrics.describe("swaplist_admission_budget_bytes", "gauge", "Memory and disk budgets of the admission queue")
+metrics.describe("swaplist_storage_bytes", "gauge", "Bytes in managed storage at the last janitor pass")
+metrics.describe("swaplist_storage_files", "gauge", "Files in managed storage at the last janitor pass")
+metrics.describe("swaplist_storage_evictions_total", "counter", "Files evicted by the storage janitor since start")
+metrics.describe("swaplist_open_archives", "gauge", "Uploaded archives held open (memory-mapped) by the archive registry")
+metrics.describe("swaplist_archive_leases_total", "counter", "Archive registry lookups by result (hit, miss)")
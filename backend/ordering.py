@@ -0,0 +1,123 @@
+import os
+
+from .core import read_playlist_stats
+
+# Cost of loading a filament the previous plate did not use (AMS unload/load + flush).
+# Rough A1 mini figures; tune them to the printer's flush volumes.
+FILAMENT_CHANGE_SECONDS = int(os.environ.get("SWAPLIST_FILAMENT_CHANGE_SECONDS", "100"))
+FILAMENT_CHANGE_GRAMS = float(os.environ.get("SWAPLIST_FILAMENT_CHANGE_GRAMS", "1.0"))
+# Swap-improvement passes after the greedy ordering (each pass is O(n^2) moves)
+MAX_IMPROVEMENT_PASSES = 8
+
+def filament_signature(stats):
+    """
+    The set of (type, colour) a plate prints with, ignoring filaments it lists
+    but never uses. None if the plate has no filament information.
+    """
+    if not stats or not stats["filaments"]:
+        return None
+    used = [fil for fil in stats["filaments"] if fil["used_g"] > 0] or stats["filaments"]
+    return frozenset((fil["type"], fil["color"]) for fil in used)
+
+def transition_changes(previous, following):
+    """
+    Filament loads needed between two consecutive plates: every filament of the
+    following plate the previous one did not print with. Unknown plates cost nothing.
+    """
+    if previous is None or following is None:
+        return 0
+    return len(following - previous)
+
+def count_changes(signatures, order):
+    """Filament loads for a whole sequence (list of positions into signatures)."""
+    return sum(transition_changes(signatures[a], signatures[b]) for a, b in zip(order, order[1:]))
+
+def optimize_order(signatures, pinned):
+    """
+    Reorders playlist entries to group plates printed with the same filaments.
+    signatures: Filament signature per playlist position.
+    pinned: Per position, True if that entry must stay where it is.
+    Returns the new order as a list of original positions. Unpinned entries only
+    move into unpinned slots; the result is never worse than the original order.
+
+    Greedy fill of the free slots (cheapest next entry, looking ahead at a pinned
+    neighbour, ties kept in playlist order), then pairwise swaps of free slots
+    while they reduce the change count.
+    """
+    size = len(signatures)
+    original = list(range(size))
+    free_slots = [slot for slot in original if not pinned[slot]]
+    if len(free_slots) < 2:
+        return original
+
+    def edge_cost(order, slot):
+        # Cost of the transition into `slot`
+        if slot <= 0 or slot >= size:
+            return 0
+        return transition_changes(signatures[order[slot - 1]], signatures[order[slot]])
+
+    # Greedy: walk the slots, filling each free one with the cheapest remaining entry
+    remaining = list(free_slots)
+    order = []
+    for slot in original:
+        if pinned[slot]:
+            order.append(slot)
+            continue
+        previous = signatures[order[-1]] if order else None
+        following = signatures[slot + 1] if slot + 1 < size and pinned[slot + 1] else None
+        best = min(remaining, key=lambda position: (
+            transition_changes(previous, signatures[position]) + transition_changes(signatures[position], following),
+            position,
+        ))
+        remaining.remove(best)
+        order.append(best)
+
+    # Improve: swap two free slots whenever that lowers the cost of the edges they touch
+    for _ in range(MAX_IMPROVEMENT_PASSES):
+        improved = False
+        for i, a in enumerate(free_slots):
+            for b in free_slots[i + 1:]:
+                edges = {a, a + 1, b, b + 1}
+                before = sum(edge_cost(order, edge) for edge in edges)
+                order[a], order[b] = order[b], order[a]
+                if sum(edge_cost(order, edge) for edge in edges) < before:
+                    improved = True
+                else:
+                    order[a], order[b] = order[b], order[a]
+        if not improved:
+            break
+
+    if count_changes(signatures, order) >= count_changes(signatures, original):
+        return original
+    return order
+
+def _estimate(changes):
+    return {
+        "filament_changes": changes,
+        "seconds": changes * FILAMENT_CHANGE_SECONDS,
+        "grams": round(changes * FILAMENT_CHANGE_GRAMS, 2),
+    }
+
+def plan_reorder(playlist, pinned, playlist_stats=None):
+    """
+    Plans a filament-aware order for a (path, index, count) playlist.
+    pinned: Per entry, True to keep it in place.
+    playlist_stats: read_playlist_stats(playlist), read here if not given.
+    Returns {"order": [original positions], "original": estimate,
+    "optimized": estimate, "saved": estimate}, an estimate being
+    {"filament_changes", "seconds", "grams"}.
+    Copies of one entry print back to back, so only changes between entries count.
+    """
+    if playlist_stats is None:
+        playlist_stats = read_playlist_stats(playlist)
+    signatures = [filament_signature(playlist_stats.get((path, index))) for path, index, _ in playlist]
+
+    order = optimize_order(signatures, pinned)
+    original_changes = count_changes(signatures, list(range(len(playlist))))
+    optimized_changes = count_changes(signatures, order)
+    return {
+        "order": order,
+        "original": _estimate(original_changes),
+        "optimized": _estimate(optimized_changes),
+        "saved": _estimate(original_changes - optimized_changes),
+    }
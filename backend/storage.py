@@ -0,0 +1,171 @@
+import os
+import re
+import json
+import logging
+import tempfile
+
+log = logging.getLogger("swaplist.storage")
+
+# "local": uploads, outputs and job records live in the directories below. Every
+# uvicorn worker on the box shares them (mount them from shared storage to run
+# several nodes).
+# "s3": an S3-compatible bucket holds them (SWAPLIST_S3_*, credentials from the
+# usual AWS variables); the directories are then node-local caches.
+STORAGE_BACKEND = os.environ.get("SWAPLIST_STORAGE", "local")
+UPLOAD_STORE_DIR = os.path.abspath(os.environ.get("SWAPLIST_UPLOAD_DIR", os.path.join(tempfile.gettempdir(), "swap_uploads")))
+OUTPUT_DIR = os.path.abspath(os.environ.get("SWAPLIST_OUTPUT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")))
+JOB_RECORD_DIR = os.path.abspath(os.environ.get("SWAPLIST_JOB_DIR", os.path.join(tempfile.gettempdir(), "swap_jobs")))
+S3_BUCKET = os.environ.get("SWAPLIST_S3_BUCKET", "")
+S3_PREFIX = os.environ.get("SWAPLIST_S3_PREFIX", "swaplist/")
+S3_ENDPOINT_URL = os.environ.get("SWAPLIST_S3_ENDPOINT_URL") or None # MinIO and other stand-ins
+
+# Key namespaces: keys look like "uploads/<sha256>.3mf", "outputs/<name>.3mf", "jobs/<id>.json"
+UPLOADS = "uploads"
+OUTPUTS = "outputs"
+JOBS = "jobs"
+KEY_NAME_RE = re.compile(r"[A-Za-z0-9_][A-Za-z0-9_.-]*")
+
+def storage_key(namespace, name):
+    return f"{namespace}/{name}"
+
+class LocalStorage:
+    """
+    Keys map straight onto local directories (one per namespace), so there is
+    nothing to publish or fetch: a file is visible to every process that sees
+    the directory as soon as it is in place.
+    """
+    name = "local"
+
+    def __init__(self, dirs):
+        self.dirs = dirs
+
+    def local_path(self, key):
+        """Path of `key` on this node (the file itself, or its cached copy)."""
+        namespace, _, name = key.partition("/")
+        if namespace not in self.dirs or not KEY_NAME_RE.fullmatch(name):
+            raise ValueError(f"Invalid storage key {key!r}")
+        return os.path.join(self.dirs[namespace], name)
+
+    def publish(self, key):
+        """Makes the complete file at local_path(key) visible to every worker and node."""
+
+    def fetch(self, key):
+        """Returns local_path(key), making sure the file is there. Raises FileNotFoundError."""
+        path = self.local_path(key)
+        if not os.path.exists(path):
+            raise FileNotFoundError(key)
+        return path
+
+    def exists(self, key):
+        return os.path.exists(self.local_path(key))
+
+    def put_json(self, key, value):
+        """Stores a small JSON record (replacing any previous one)."""
+        path = self.local_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".record_", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(value, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def get_json(self, key):
+        """Returns a JSON record, or None if there is none."""
+        try:
+            with open(self.local_path(key)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+class S3Storage(LocalStorage):
+    """
+    Keys are objects in an S3-compatible bucket under `prefix`. Files are still
+    written and read through local_path(): publish() uploads a finished file,
+    fetch() downloads a missing one (the local directories act as a cache the
+    janitor trims). JSON records go to the bucket only. Needs boto3.
+    """
+    name = "s3"
+
+    def __init__(self, dirs, bucket, prefix="", endpoint_url=None):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("SWAPLIST_STORAGE=s3 needs boto3 (pip install boto3)")
+        if not bucket:
+            raise RuntimeError("SWAPLIST_STORAGE=s3 needs SWAPLIST_S3_BUCKET")
+        super().__init__(dirs)
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+        self._client_error = ClientError
+
+    def _object(self, key):
+        self.local_path(key) # validates the key
+        return self.prefix + key
+
+    def _is_missing(self, error):
+        return isinstance(error, self._client_error) and \
+            error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+
+    def publish(self, key):
+        self.client.upload_file(self.local_path(key), self.bucket, self._object(key))
+        log.info("published key=%s", key)
+
+    def fetch(self, key):
+        path = self.local_path(key)
+        if os.path.exists(path):
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Download under a temp name so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(prefix=".fetch_", dir=os.path.dirname(path))
+        os.close(fd)
+        try:
+            self.client.download_file(self.bucket, self._object(key), tmp_path)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if self._is_missing(e):
+                raise FileNotFoundError(key)
+            raise
+        log.info("fetched key=%s bytes=%d", key, os.path.getsize(path))
+        return path
+
+    def exists(self, key):
+        if os.path.exists(self.local_path(key)):
+            return True
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object(key))
+        except self._client_error as e:
+            if self._is_missing(e):
+                return False
+            raise
+        return True
+
+    def put_json(self, key, value):
+        self.client.put_object(Bucket=self.bucket, Key=self._object(key), Body=json.dumps(value).encode("utf-8"),
+                               ContentType="application/json")
+
+    def get_json(self, key):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._object(key))
+        except self._client_error as e:
+            if self._is_missing(e):
+                return None
+            raise
+        return json.loads(response["Body"].read())
+
+def create_storage(backend=STORAGE_BACKEND):
+    dirs = {UPLOADS: UPLOAD_STORE_DIR, OUTPUTS: OUTPUT_DIR, JOBS: JOB_RECORD_DIR}
+    if backend == "local":
+        return LocalStorage(dirs)
+    if backend == "s3":
+        return S3Storage(dirs, S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL)
+    raise RuntimeError(f"Unknown SWAPLIST_STORAGE backend {backend!r} (use 'local' or 's3')")
+
+storage = create_storage()
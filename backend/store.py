@@ -0,0 +1,170 @@
+import os
+import re
+import hashlib
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+
+from .storage import storage, storage_key, UPLOADS, UPLOAD_STORE_DIR
+
+# Uploads are stored once per content hash: <UPLOAD_STORE_DIR>/<sha256>.3mf,
+# published to the shared storage as uploads/<sha256>.3mf
+HASH_CHUNK_SIZE = 1024 * 1024
+METADATA_CACHE_SIZE = 256
+CONTENT_HASH_RE = re.compile(r"[0-9a-f]{64}")
+
+def hash_fileobj(fileobj):
+    """
+    Computes the SHA-256 of a binary file object, reading it in chunks from its
+    current position. Returns the hex digest.
+    """
+    hash_sha256 = hashlib.sha256()
+    for chunk in iter(lambda: fileobj.read(HASH_CHUNK_SIZE), b""):
+        hash_sha256.update(chunk)
+    return hash_sha256.hexdigest()
+
+def upload_path(content_hash):
+    """Returns the store path for an upload with the given content hash."""
+    return os.path.join(UPLOAD_STORE_DIR, f"{content_hash}.3mf")
+
+def upload_key(content_hash):
+    """Returns the storage key of an upload."""
+    return storage_key(UPLOADS, f"{content_hash}.3mf")
+
+class UnknownUpload(LookupError):
+    pass
+
+def resolve_upload(upload_token):
+    """
+    Returns the store path for an upload token (the content hash handed out by
+    /upload), fetching the file from the shared storage if another worker or
+    node received it. Raises UnknownUpload if the token is malformed or the
+    upload was evicted from the store.
+    """
+    if not isinstance(upload_token, str) or not CONTENT_HASH_RE.fullmatch(upload_token):
+        raise UnknownUpload("Invalid upload token")
+    try:
+        return storage.fetch(upload_key(upload_token))
+    except FileNotFoundError:
+        raise UnknownUpload(f"Upload {upload_token[:12]} has expired, please upload the file again")
+
+def stored_hash(file_path):
+    """Returns the content hash of a path inside the upload store, or None for any other path."""
+    name, ext = os.path.splitext(os.path.basename(file_path))
+    if os.path.dirname(os.path.abspath(file_path)) == UPLOAD_STORE_DIR and ext == ".3mf" and CONTENT_HASH_RE.fullmatch(name):
+        return name
+    return None
+
+def store_upload(fileobj):
+    """
+    Hashes an uploaded file and stores it under its content hash.
+    The file is only written if no upload with the same content is stored yet.
+    Returns (file_path, content_hash, is_new).
+    """
+    content_hash = hash_fileobj(fileobj)
+    file_path = upload_path(content_hash)
+    
+    if os.path.exists(file_path):
+        return file_path, content_hash, False
+    
+    os.makedirs(UPLOAD_STORE_DIR, exist_ok=True)
+    
+    # Write to a temp name first so concurrent uploads never see a partial file
+    fileobj.seek(0)
+    fd, tmp_path = tempfile.mkstemp(prefix=".upload_", dir=UPLOAD_STORE_DIR)
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            for chunk in iter(lambda: fileobj.read(HASH_CHUNK_SIZE), b""):
+                buffer.write(chunk)
+        file_path, is_new = store_file(tmp_path, content_hash)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    
+    return file_path, content_hash, is_new
+
+def store_file(path, content_hash):
+    """
+    Moves a complete file whose SHA-256 is already known into the store.
+    The file is consumed either way (removed if the content is already stored).
+    Returns (file_path, is_new).
+    """
+    file_path = upload_path(content_hash)
+    if os.path.exists(file_path):
+        os.remove(path)
+        return file_path, False
+    
+    os.makedirs(UPLOAD_STORE_DIR, exist_ok=True)
+    os.replace(path, file_path)
+    return file_path, True
+
+_file_hash_memo = {}
+_file_hash_lock = threading.Lock()
+
+def content_hash_for(file_path):
+    """
+    Returns the SHA-256 of a source 3MF.
+    Files in the upload store are named by their hash already; anything else is
+    hashed once and memoized by (path, size, mtime).
+    """
+    content_hash = stored_hash(file_path)
+    if content_hash is not None:
+        return content_hash
+    
+    st = os.stat(file_path)
+    key = (os.path.abspath(file_path), st.st_size, st.st_mtime_ns)
+    with _file_hash_lock:
+        if key in _file_hash_memo:
+            return _file_hash_memo[key]
+    
+    with open(file_path, "rb") as f:
+        content_hash = hash_fileobj(f)
+    
+    with _file_hash_lock:
+        if len(_file_hash_memo) >= METADATA_CACHE_SIZE:
+            _file_hash_memo.clear()
+        _file_hash_memo[key] = content_hash
+    return content_hash
+
+class MetadataCache:
+    """
+    Bounded LRU of parsed plate lists keyed by upload content hash.
+    """
+    def __init__(self, max_entries=METADATA_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, content_hash, filename=None):
+        """
+        Returns a fresh copy of the cached plates (new ids, optional new filename),
+        or None on a miss.
+        """
+        with self._lock:
+            plates = self._entries.get(content_hash)
+            if plates is None:
+                return None
+            self._entries.move_to_end(content_hash)
+        
+        copies = []
+        for plate in plates:
+            copy = dict(plate, id=str(uuid.uuid4()))
+            if filename:
+                copy["filename"] = filename
+            copies.append(copy)
+        return copies
+
+    def put(self, content_hash, plates):
+        with self._lock:
+            self._entries[content_hash] = [dict(p) for p in plates]
+            self._entries.move_to_end(content_hash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, content_hash):
+        with self._lock:
+            self._entries.pop(content_hash, None)
+
+metadata_cache = MetadataCache()
@@ -0,0 +1,283 @@
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import logging
+import tempfile
+import threading
+import zipfile
+
+from .store import store_file, CONTENT_HASH_RE
+
+log = logging.getLogger("swaplist.uploads")
+
+# Partial uploads: <UPLOAD_SESSION_DIR>/<id>.part + <id>.json (state, survives restarts)
+UPLOAD_SESSION_DIR = os.path.join(tempfile.gettempdir(), "swap_sessions")
+# Chunk size suggested to clients, and the largest chunk we accept
+UPLOAD_CHUNK_SIZE = int(os.environ.get("SWAPLIST_UPLOAD_CHUNK_BYTES", str(8 * 1024 * 1024)))
+MAX_CHUNK_SIZE = 32 * 1024 * 1024
+MAX_UPLOAD_SIZE = int(os.environ.get("SWAPLIST_MAX_UPLOAD_BYTES", str(2 * 1024 ** 3)))
+# Sessions idle for longer than this are dropped
+UPLOAD_SESSION_TTL_SECONDS = int(os.environ.get("SWAPLIST_UPLOAD_SESSION_TTL_SECONDS", str(24 * 3600)))
+
+REHASH_CHUNK_SIZE = 1024 * 1024
+SESSION_ID_RE = re.compile(r"[0-9a-f]{32}")
+
+class UploadSessionNotFound(Exception):
+    pass
+
+class UploadOffsetMismatch(Exception):
+    """The chunk does not start at the session's current offset (resume from .offset)."""
+    def __init__(self, offset):
+        super().__init__(f"Expected offset {offset}")
+        self.offset = offset
+
+class UploadChecksumMismatch(Exception):
+    pass
+
+class UploadInvalid(Exception):
+    """Rejected session or chunk; if raised once the last chunk landed, the upload is discarded."""
+    pass
+
+def validate_archive(path):
+    """
+    Structural check of an assembled upload: the zip central directory parses
+    and every member's local header and data lie where the directory says.
+    Raises zipfile.BadZipFile otherwise. Member data is not decompressed.
+    """
+    size = os.path.getsize(path)
+    with zipfile.ZipFile(path) as zf:
+        for info in zf.infolist():
+            zf.fp.seek(info.header_offset)
+            if zf.fp.read(4) != zipfile.stringFileHeader:
+                raise zipfile.BadZipFile(f"Bad local header for {info.filename}")
+            if info.header_offset + zipfile.sizeFileHeader + info.compress_size > size:
+                raise zipfile.BadZipFile(f"Truncated member {info.filename}")
+
+class UploadSession:
+    """
+    One resumable upload. Chunks are written at their offset into a .part file
+    and fed to a running SHA-256, so the content hash is ready the moment the
+    last byte lands.
+    """
+    def __init__(self, session_id, filename, size, expected_hash=None, offset=0, created_at=None):
+        self.id = session_id
+        self.filename = filename
+        self.size = size
+        self.expected_hash = expected_hash
+        self.offset = offset
+        self.created_at = created_at or time.time()
+        self.updated_at = time.time()
+        self.lock = threading.Lock()
+        self.hash = hashlib.sha256()
+
+    @property
+    def part_path(self):
+        return os.path.join(UPLOAD_SESSION_DIR, f"{self.id}.part")
+
+    @property
+    def state_path(self):
+        return os.path.join(UPLOAD_SESSION_DIR, f"{self.id}.json")
+
+    def save_state(self):
+        state = {
+            "filename": self.filename,
+            "size": self.size,
+            "expected_hash": self.expected_hash,
+            "offset": self.offset,
+            "created_at": self.created_at,
+        }
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def to_dict(self):
+        return {
+            "upload_id": self.id,
+            "filename": self.filename,
+            "size": self.size,
+            "offset": self.offset,
+            "chunk_size": UPLOAD_CHUNK_SIZE,
+            "expires_at": self.updated_at + UPLOAD_SESSION_TTL_SECONDS,
+        }
+
+    def remove_files(self):
+        for path in (self.part_path, self.state_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+class UploadSessionManager:
+    """
+    Tracks resumable uploads. Session state is kept on disk next to the partial
+    file, so an upload can be resumed after a server restart (the running hash
+    is then rebuilt from the bytes received so far), and chunks of one upload
+    can land on different API workers of the same node.
+    """
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def create(self, filename, size, expected_hash=None):
+        if size <= 0 or size > MAX_UPLOAD_SIZE:
+            raise UploadInvalid(f"Upload size must be between 1 and {MAX_UPLOAD_SIZE} bytes")
+        if expected_hash is not None and not CONTENT_HASH_RE.fullmatch(expected_hash):
+            raise UploadInvalid("sha256 must be a lowercase hex SHA-256 digest")
+
+        os.makedirs(UPLOAD_SESSION_DIR, exist_ok=True)
+        session = UploadSession(uuid.uuid4().hex, filename, size, expected_hash)
+        open(session.part_path, "wb").close()
+        session.save_state()
+
+        with self._lock:
+            self._prune()
+            self._sessions[session.id] = session
+        return session
+
+    def get(self, session_id):
+        """Returns the session, reloading it from disk if needed. Raises UploadSessionNotFound."""
+        if not SESSION_ID_RE.fullmatch(session_id):
+            raise UploadSessionNotFound(session_id)
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._load(session_id)
+                self._sessions[session_id] = session
+                return session
+        # Another worker may have taken chunks since
+        with session.lock:
+            self._sync(session)
+        return session
+
+    def _load(self, session_id):
+        try:
+            with open(os.path.join(UPLOAD_SESSION_DIR, f"{session_id}.json")) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            raise UploadSessionNotFound(session_id)
+
+        session = UploadSession(session_id, state["filename"], state["size"], state["expected_hash"],
+                                state["offset"], state["created_at"])
+        if not os.path.exists(session.part_path):
+            raise UploadSessionNotFound(session_id)
+
+        # Rebuild the running hash from what was received before the restart
+        with open(session.part_path, "rb") as f:
+            remaining = session.offset
+            while remaining > 0:
+                chunk = f.read(min(REHASH_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                session.hash.update(chunk)
+                remaining -= len(chunk)
+        session.offset -= remaining # a truncated .part resumes from what is really there
+        log.info("upload session reloaded upload_id=%s offset=%d", session_id, session.offset)
+        return session
+
+    def _sync(self, session):
+        """
+        Catches up with chunks another worker process wrote since this one last
+        saw the session: hashes the new bytes and takes over the saved offset.
+        Raises UploadSessionNotFound if the upload was completed or aborted there.
+        """
+        try:
+            with open(session.state_path) as f:
+                saved_offset = json.load(f)["offset"]
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self._sessions.pop(session.id, None)
+            raise UploadSessionNotFound(session.id)
+        if saved_offset <= session.offset:
+            return
+        with open(session.part_path, "rb") as f:
+            f.seek(session.offset)
+            remaining = saved_offset - session.offset
+            while remaining > 0:
+                chunk = f.read(min(REHASH_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                session.hash.update(chunk)
+                session.offset += len(chunk)
+                remaining -= len(chunk)
+
+    def write_chunk(self, session_id, offset, data, checksum=None):
+        """
+        Writes a chunk at `offset` (must equal the session's current offset).
+        checksum: Optional SHA-256 hex digest of `data`.
+        Returns (session, stored) where stored is None until the upload is
+        complete, then (file_path, content_hash, is_new) for the upload store.
+        """
+        session = self.get(session_id)
+        with session.lock:
+            self._sync(session)
+            if offset != session.offset:
+                raise UploadOffsetMismatch(session.offset)
+            if len(data) > MAX_CHUNK_SIZE:
+                raise UploadInvalid(f"Chunks are limited to {MAX_CHUNK_SIZE} bytes")
+            if offset + len(data) > session.size:
+                raise UploadInvalid("Chunk extends past the declared upload size")
+            if checksum is not None and hashlib.sha256(data).hexdigest() != checksum.lower():
+                raise UploadChecksumMismatch("Chunk checksum mismatch")
+
+            fd = os.open(session.part_path, os.O_WRONLY)
+            try:
+                view = memoryview(data)
+                while view:
+                    written = os.pwrite(fd, view, offset)
+                    view = view[written:]
+                    offset += written
+            finally:
+                os.close(fd)
+            session.hash.update(data)
+            session.offset = offset
+            session.updated_at = time.time()
+
+            if session.offset < session.size:
+                session.save_state()
+                return session, None
+
+            return session, self._finalize(session)
+
+    def _finalize(self, session):
+        """Validates the assembled file and moves it into the upload store."""
+        with self._lock:
+            self._sessions.pop(session.id, None)
+
+        content_hash = session.hash.hexdigest()
+        try:
+            if session.expected_hash and content_hash != session.expected_hash:
+                raise UploadInvalid("Upload content does not match the declared sha256")
+            try:
+                validate_archive(session.part_path)
+            except (zipfile.BadZipFile, OSError) as e:
+                raise UploadInvalid(f"Not a valid 3MF archive: {e}")
+            file_path, is_new = store_file(session.part_path, content_hash)
+        finally:
+            session.remove_files()
+
+        log.info("upload assembled upload_id=%s content_hash=%s bytes=%d", session.id, content_hash, session.size)
+        return file_path, content_hash, is_new
+
+    def abort(self, session_id):
+        session = self.get(session_id)
+        with session.lock:
+            with self._lock:
+                self._sessions.pop(session.id, None)
+            session.remove_files()
+
+    def _prune(self):
+        # Forget idle in-memory sessions; their files are left to the janitor's TTL
+        cutoff = time.time() - UPLOAD_SESSION_TTL_SECONDS
+        for session_id in [s.id for s in self._sessions.values() if s.updated_at < cutoff]:
+            del self._sessions[session_id]
+
+    def paths_in_use(self):
+        """Files of sessions that are still active (kept safe from the janitor)."""
+        cutoff = time.time() - UPLOAD_SESSION_TTL_SECONDS
+        with self._lock:
+            return [path for s in self._sessions.values() if s.updated_at >= cutoff
+                    for path in (s.part_path, s.state_path)]
+
+upload_sessions = UploadSessionManager()
@@ -0,0 +1,569 @@
+"""
+Load test for the upload/generate HTTP API.
+
+Starts a local server (uvicorn backend.app:app with its storage in a temp
+directory) unless --url is given, uploads a synthetic corpus, then has
+virtual users replay a weighted mix of /api/upload, /api/generate (polling
+the job until it is done) and /static downloads for --duration seconds at
+each --concurrency level. Reports throughput, p50/p95/p99 latency and error
+rates per endpoint, and the server's RSS (process tree) over time.
+
+    python -m benchmarks.load_test run --concurrency 1 4 16 --duration 30 --output load.json
+    python -m benchmarks.load_test compare baseline.json load.json
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+import urllib.parse
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.synthetic_3mf import MB, build_synthetic_3mf
+from benchmarks.run_benchmarks import _git_revision
+
+RESULTS_FORMAT_VERSION = 1
+
+# Endpoints as reported; "generate_e2e" is submit -> job done, polls included
+ENDPOINTS = ("upload", "generate", "jobs", "generate_e2e", "download")
+DEFAULT_MIX = "upload=1,generate=3,download=4"
+# Longest we wait on one job before counting it as failed
+JOB_TIMEOUT_SECONDS = 600
+MAX_RETRY_AFTER_SECONDS = 30
+
+# --- HTTP ---
+
+def _multipart(field, filename, data):
+    """Returns (body, content type) of a multipart/form-data request with one file."""
+    boundary = uuid.uuid4().hex
+    head = (f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n").encode("utf-8")
+    return head + data + f"\r\n--{boundary}--\r\n".encode("utf-8"), f"multipart/form-data; boundary={boundary}"
+
+class ApiClient:
+    """One keep-alive connection to the server, as one virtual user."""
+    def __init__(self, base_url, client_ip=None, timeout=JOB_TIMEOUT_SECONDS):
+        url = urllib.parse.urlsplit(base_url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.prefix = url.path.rstrip("/")
+        self.timeout = timeout
+        # Admission control queues fairly per client; give each user its own address
+        self.headers = {"X-Real-IP": client_ip} if client_ip else {}
+        self._conn = None
+
+    def request(self, method, path, body=None, headers=None):
+        """Returns (status, response headers, body, seconds); status 0 on connection errors."""
+        all_headers = dict(self.headers, **(headers or {}))
+        start = time.perf_counter()
+        try:
+            if self._conn is None:
+                self._conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self._conn.request(method, self.prefix + path, body=body, headers=all_headers)
+            response = self._conn.getresponse()
+            data = response.read()
+            return response.status, dict(response.getheaders()), data, time.perf_counter() - start
+        except (OSError, http.client.HTTPException) as e:
+            self.close()
+            return 0, {}, str(e).encode("utf-8"), time.perf_counter() - start
+
+    def json(self, method, path, payload):
+        return self.request(method, path, json.dumps(payload).encode("utf-8"),
+                            {"Content-Type": "application/json"})
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+# --- LOAD ---
+
+class Recorder:
+    """Thread-safe log of (endpoint, started at, seconds, status, ok) samples."""
+    def __init__(self):
+        self.samples = []
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+
+    def record(self, endpoint, seconds, status, ok):
+        with self._lock:
+            self.samples.append((endpoint, time.perf_counter() - self.started - seconds, seconds, status, ok))
+
+class SharedState:
+    """What the virtual users have uploaded and generated so far (plates, download URLs)."""
+    def __init__(self):
+        self.plates = {} # (upload token, plate index) -> plate, as /api/upload returned it
+        self.downloads = []
+        self._lock = threading.Lock()
+
+    def add_plates(self, plates):
+        with self._lock:
+            for plate in plates:
+                self.plates[(plate["upload_token"], plate["plate_index"])] = plate
+
+    def add_download(self, url):
+        with self._lock:
+            if url not in self.downloads:
+                self.downloads.append(url)
+
+    def pick_plates(self, rng, n):
+        with self._lock:
+            plates = list(self.plates.values())
+        return rng.sample(plates, min(n, len(plates)))
+
+    def pick_download(self, rng):
+        with self._lock:
+            return rng.choice(self.downloads) if self.downloads else None
+
+class VirtualUser(threading.Thread):
+    """Replays the request mix until `stop` is set."""
+    def __init__(self, number, args, corpus, state, recorder, stop, mix):
+        super().__init__(daemon=True, name=f"user-{number}")
+        client_ip = None if args.same_client else f"10.200.{number // 256}.{number % 256}"
+        self.client = ApiClient(args.url, client_ip)
+        self.args = args
+        self.corpus = corpus
+        self.state = state
+        self.recorder = recorder
+        self.stop = stop
+        self.actions, self.weights = zip(*mix.items())
+        self.rng = random.Random(args.seed * 1000 + number)
+
+    def run(self):
+        try:
+            while not self.stop.is_set():
+                action = self.rng.choices(self.actions, self.weights)[0]
+                getattr(self, action)()
+                if self.args.think_ms:
+                    self.stop.wait(self.rng.expovariate(1000 / self.args.think_ms))
+        finally:
+            self.client.close()
+
+    def _backoff(self, headers):
+        # Honour Retry-After like a well-behaved client would
+        if self.args.ignore_retry_after:
+            return
+        try:
+            seconds = float(headers.get("retry-after") or headers.get("Retry-After") or 1)
+        except ValueError:
+            seconds = 1
+        self.stop.wait(min(seconds, MAX_RETRY_AFTER_SECONDS))
+
+    def upload(self):
+        name, data = self.rng.choice(self.corpus)
+        body, content_type = _multipart("file", name, data)
+        status, headers, response, seconds = self.client.request("POST", "/api/upload", body,
+                                                                 {"Content-Type": content_type})
+        self.recorder.record("upload", seconds, status, status == 200)
+        if status == 200:
+            self.state.add_plates(json.loads(response)["plates"])
+        elif status == 503:
+            self._backoff(headers)
+
+    def generate(self):
+        plates = self.state.pick_plates(self.rng, self.rng.randint(1, self.args.playlist_plates))
+        if not plates:
+            return self.upload()
+        playlist = [dict(plate, count=self.rng.randint(1, self.args.max_copies)) for plate in plates]
+        payload = {"playlist": playlist, "compression_level": self.args.compress_level}
+        started = time.perf_counter()
+        status, headers, response, seconds = self.client.json("POST", "/api/generate", payload)
+        self.recorder.record("generate", seconds, status, status == 202)
+        if status == 503:
+            return self._backoff(headers)
+        if status != 202:
+            return
+
+        job = json.loads(response)
+        while job["status"] not in ("done", "failed") and time.perf_counter() - started < JOB_TIMEOUT_SECONDS:
+            time.sleep(self.args.poll_interval)
+            status, _, response, seconds = self.client.request("GET", f"/api/jobs/{job['job_id']}")
+            self.recorder.record("jobs", seconds, status, status == 200)
+            if status != 200:
+                break
+            job = json.loads(response)
+        done = job["status"] == "done"
+        self.recorder.record("generate_e2e", time.perf_counter() - started, 200 if done else 500, done)
+        if done:
+            self.state.add_download(job["download_url"])
+
+    def download(self):
+        url = self.state.pick_download(self.rng)
+        if url is None:
+            return self.generate()
+        status, _, _, seconds = self.client.request("GET", url)
+        self.recorder.record("download", seconds, status, status == 200)
+
+# --- SERVER ---
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(workers, env_overrides, log_path):
+    """
+    Starts uvicorn backend.app:app on a free local port with its storage in a
+    temp directory. Returns (process, base URL, storage dir).
+    """
+    storage_dir = tempfile.mkdtemp(prefix="swap_load_")
+    port = _free_port()
+    env = dict(os.environ,
+               SWAPLIST_UPLOAD_DIR=os.path.join(storage_dir, "uploads"),
+               SWAPLIST_OUTPUT_DIR=os.path.join(storage_dir, "outputs"),
+               SWAPLIST_JOB_DIR=os.path.join(storage_dir, "jobs"),
+               SWAPLIST_SEGMENT_DIR=os.path.join(storage_dir, "segments"),
+               SWAPLIST_LOG_LEVEL="WARNING")
+    env.update(env_overrides)
+    with open(log_path, "w") as log_file:
+        process = subprocess.Popen([sys.executable, "-m", "uvicorn", "backend.app:app", "--host", "127.0.0.1",
+                                    "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+                                   cwd=REPO_ROOT, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+    client = ApiClient(base_url, timeout=2)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode}, see {log_path}")
+        if client.request("GET", "/")[0] == 200:
+            client.close()
+            return process, base_url, storage_dir
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"Server did not come up within 30s, see {log_path}")
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def _process_tree_rss(pid):
+    """Resident bytes of a process and all its descendants (Linux /proc), or None."""
+    children = {}
+    rss = {}
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return None
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+            with open(f"/proc/{entry}/statm") as f:
+                resident_pages = int(f.read().split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        # Fields after the parenthesised command: state, ppid, ...
+        ppid = int(stat.rpartition(")")[2].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+        rss[int(entry)] = resident_pages * page_size
+    if pid not in rss:
+        return None
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        total += rss.get(current, 0)
+        stack.extend(children.get(current, ()))
+    return total
+
+class ServerSampler(threading.Thread):
+    """Samples the server's RSS and generate queue depth every `interval` seconds."""
+    def __init__(self, base_url, pid, interval, recorder):
+        super().__init__(daemon=True, name="sampler")
+        self.client = ApiClient(base_url, timeout=5)
+        self.pid = pid
+        self.interval = interval
+        self.recorder = recorder
+        self.samples = []
+        self.stop = threading.Event()
+
+    def _queue_depth(self):
+        status, _, body, _ = self.client.request("GET", "/metrics")
+        if status != 200:
+            return None
+        for line in body.decode("utf-8", "replace").splitlines():
+            if line.startswith("swaplist_job_queue_depth "):
+                return float(line.split()[1])
+        return None
+
+    def run(self):
+        while not self.stop.is_set():
+            rss = _process_tree_rss(self.pid) if self.pid else None
+            self.samples.append({
+                "t": round(time.perf_counter() - self.recorder.started, 2),
+                "rss_mb": round(rss / MB, 1) if rss is not None else None,
+                "queue_depth": self._queue_depth(),
+            })
+            self.stop.wait(self.interval)
+        self.client.close()
+
+# --- REPORTING ---
+
+def _percentile(sorted_values, fraction):
+    # Nearest rank
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def summarize(samples, duration):
+    """
+    Per-endpoint request counts, throughput, latency percentiles (ms), status
+    counts, error rate and rejected rate (503s, the server shedding load).
+    """
+    endpoints = {}
+    for endpoint in ENDPOINTS:
+        selected = [s for s in samples if s[0] == endpoint]
+        if not selected:
+            continue
+        latencies = sorted(s[2] * 1000 for s in selected)
+        rejected = sum(1 for s in selected if s[3] == 503)
+        errors = sum(1 for s in selected if not s[4]) - rejected
+        statuses = {}
+        for s in selected:
+            statuses[str(s[3])] = statuses.get(str(s[3]), 0) + 1
+        endpoints[endpoint] = {
+            "requests": len(selected),
+            "throughput_rps": len(selected) / duration,
+            "p50_ms": _percentile(latencies, 0.50),
+            "p95_ms": _percentile(latencies, 0.95),
+            "p99_ms": _percentile(latencies, 0.99),
+            "max_ms": latencies[-1],
+            "error_rate": errors / len(selected),
+            "rejected_rate": rejected / len(selected),
+            "statuses": statuses,
+        }
+    return endpoints
+
+def _print_stage(stage):
+    rss = [s["rss_mb"] for s in stage["server"] if s["rss_mb"] is not None]
+    queue = [s["queue_depth"] for s in stage["server"] if s["queue_depth"] is not None]
+    print(f"\nconcurrency {stage['concurrency']}: {stage['requests']} requests in {stage['duration_s']:.1f}s "
+          f"({stage['throughput_rps']:.1f} req/s)")
+    print(f"  {'endpoint':<14} {'reqs':>6} {'req/s':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} "
+          f"{'errors':>7} {'503s':>7}  statuses")
+    for endpoint, e in stage["endpoints"].items():
+        statuses = " ".join(f"{code}x{n}" for code, n in sorted(e["statuses"].items()))
+        print(f"  {endpoint:<14} {e['requests']:>6} {e['throughput_rps']:>7.2f} {e['p50_ms']:>9.1f} {e['p95_ms']:>9.1f} "
+              f"{e['p99_ms']:>9.1f} {e['max_ms']:>9.1f} {e['error_rate']:>7.1%} {e['rejected_rate']:>7.1%}  {statuses}")
+    if rss:
+        print(f"  server RSS MB: start {rss[0]:.0f}  peak {max(rss):.0f}  end {rss[-1]:.0f}"
+              + (f"   queue depth peak {max(queue):.0f}" if queue else ""))
+
+# --- COMMANDS ---
+
+def _parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ("upload", "generate", "download"):
+            raise argparse.ArgumentTypeError(f"unknown action {name!r} (upload, generate, download)")
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("the mix needs at least one positive weight")
+    return mix
+
+def build_corpus(args, corpus_dir):
+    """Generates (or reuses) the synthetic 3MFs; returns [(file name, bytes)]."""
+    corpus = []
+    for n in range(args.files):
+        # Vary the plate size a little so playlists differ in cost
+        gcode_mb = args.gcode_mb * (1 + 0.5 * n / max(1, args.files - 1))
+        path = os.path.join(corpus_dir, f"load_{n}_p{args.plates}_g{gcode_mb:g}_s{args.seed}.3mf")
+        if not os.path.exists(path):
+            build_synthetic_3mf(path, args.plates, int(gcode_mb * MB), seed=args.seed + n)
+        with open(path, "rb") as f:
+            corpus.append((os.path.basename(path), f.read()))
+    return corpus
+
+def run_stage(args, concurrency, corpus, state, server_pid):
+    recorder = Recorder()
+    sampler = ServerSampler(args.url, server_pid, args.sample_interval, recorder)
+    stop = threading.Event()
+    users = [VirtualUser(n, args, corpus, state, recorder, stop, args.mix) for n in range(concurrency)]
+    sampler.start()
+    for user in users:
+        user.start()
+    time.sleep(args.duration)
+    stop.set()
+    for user in users:
+        user.join()
+    duration = time.perf_counter() - recorder.started
+    sampler.stop.set()
+    sampler.join()
+
+    requests = sum(1 for s in recorder.samples if s[0] != "generate_e2e")
+    stage = {
+        "concurrency": concurrency,
+        "duration_s": duration,
+        "requests": requests,
+        "throughput_rps": requests / duration,
+        "error_rate": (sum(1 for s in recorder.samples if not s[4] and s[3] != 503) / len(recorder.samples))
+                      if recorder.samples else 0.0,
+        "endpoints": summarize(recorder.samples, duration),
+        "server": sampler.samples,
+    }
+    _print_stage(stage)
+    return stage
+
+def run_load(args):
+    corpus_dir = args.corpus_dir or tempfile.mkdtemp(prefix="swap_load_corpus_")
+    os.makedirs(corpus_dir, exist_ok=True)
+    process = storage_dir = None
+    try:
+        print(f"Generating corpus in {corpus_dir} ...")
+        corpus = build_corpus(args, corpus_dir)
+
+        server_pid = args.server_pid
+        if args.url is None:
+            env = dict(var.split("=", 1) for var in args.server_env)
+            log_path = os.path.join(corpus_dir, "server.log")
+            process, args.url, storage_dir = start_server(args.server_workers, env, log_path)
+            server_pid = process.pid
+            print(f"Started server at {args.url} (pid {server_pid}, log {log_path})")
+
+        # Seed the shared state so generate/download have something to work with
+        state = SharedState()
+        client = ApiClient(args.url)
+        for name, data in corpus:
+            body, content_type = _multipart("file", name, data)
+            status, _, response, _ = client.request("POST", "/api/upload", body, {"Content-Type": content_type})
+            if status != 200:
+                raise RuntimeError(f"Seeding upload of {name} failed with HTTP {status}: {response[:200]!r}")
+            state.add_plates(json.loads(response)["plates"])
+        client.close()
+
+        stages = [run_stage(args, concurrency, corpus, state, server_pid) for concurrency in args.concurrency]
+    finally:
+        if process is not None:
+            stop_server(process)
+        if storage_dir:
+            shutil.rmtree(storage_dir, ignore_errors=True)
+        if not args.corpus_dir and not args.keep_corpus:
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+
+    report = {
+        "format": RESULTS_FORMAT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_revision": _git_revision(),
+        "cpu_count": os.cpu_count(),
+        "params": {"files": args.files, "plates": args.plates, "gcode_mb": args.gcode_mb, "mix": args.mix,
+                   "max_copies": args.max_copies, "playlist_plates": args.playlist_plates,
+                   "compress_level": args.compress_level, "think_ms": args.think_ms,
+                   "server_workers": args.server_workers, "external_server": args.server_pid is not None},
+        "stages": stages,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    return report
+
+def compare(baseline, current, threshold):
+    """
+    Prints p99 latency and throughput per concurrency level and endpoint of two
+    reports. Returns the list of (concurrency, endpoint, metric, ratio) regressions
+    beyond `threshold`.
+    """
+    base_index = {(stage["concurrency"], endpoint): e
+                  for stage in baseline["stages"] for endpoint, e in stage["endpoints"].items()}
+    regressions = []
+    print(f"{'conc':>5} {'endpoint':<14} {'p99 base':>10} {'p99 new':>10} {'ratio':>7} {'rps base':>9} {'rps new':>9} {'err base':>9} {'err new':>9}")
+    for stage in current["stages"]:
+        for endpoint, e in stage["endpoints"].items():
+            base = base_index.get((stage["concurrency"], endpoint))
+            if base is None:
+                print(f"{stage['concurrency']:>5} {endpoint:<14} {'-':>10} {e['p99_ms']:10.1f}")
+                continue
+            p99_ratio = e["p99_ms"] / base["p99_ms"] if base["p99_ms"] else 1.0
+            rps_ratio = base["throughput_rps"] / e["throughput_rps"] if e["throughput_rps"] else float("inf")
+            flag = ""
+            for metric, ratio in (("p99", p99_ratio), ("throughput", rps_ratio)):
+                if ratio > 1 + threshold:
+                    regressions.append((stage["concurrency"], endpoint, metric, ratio))
+                    flag = "  REGRESSION"
+            if e["error_rate"] > base["error_rate"] + threshold:
+                regressions.append((stage["concurrency"], endpoint, "errors", e["error_rate"]))
+                flag = "  REGRESSION"
+            print(f"{stage['concurrency']:>5} {endpoint:<14} {base['p99_ms']:10.1f} {e['p99_ms']:10.1f} {p99_ratio:7.2f} "
+                  f"{base['throughput_rps']:9.2f} {e['throughput_rps']:9.2f} {base['error_rate']:9.1%} {e['error_rate']:9.1%}{flag}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test for the upload/generate HTTP API.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="Run the load test")
+    run_parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16],
+                            help="Virtual users; one stage of --duration seconds per value")
+    run_parser.add_argument("--duration", type=float, default=30.0, help="Seconds per concurrency level")
+    run_parser.add_argument("--mix", type=_parse_mix, default=_parse_mix(DEFAULT_MIX),
+                            help=f"Action weights (default {DEFAULT_MIX})")
+    run_parser.add_argument("--files", type=int, default=3, help="Synthetic 3MFs in the corpus")
+    run_parser.add_argument("--plates", type=int, default=2)
+    run_parser.add_argument("--gcode-mb", type=float, default=2.0, help="Uncompressed G-code per plate, in MB (smallest file)")
+    run_parser.add_argument("--max-copies", type=int, default=5, help="Copies per playlist item, drawn from 1..N")
+    run_parser.add_argument("--playlist-plates", type=int, default=3, help="Plates per playlist, drawn from 1..N")
+    run_parser.add_argument("--compress-level", type=int, default=6)
+    run_parser.add_argument("--think-ms", type=float, default=0.0, help="Mean pause between a user's actions")
+    run_parser.add_argument("--poll-interval", type=float, default=0.25, help="Seconds between job status polls")
+    run_parser.add_argument("--sample-interval", type=float, default=1.0, help="Seconds between server RSS samples")
+    run_parser.add_argument("--same-client", action="store_true",
+                            help="Send every user's requests as one client (no X-Real-IP per user)")
+    run_parser.add_argument("--ignore-retry-after", action="store_true", help="Retry 503s right away")
+    run_parser.add_argument("--url", help="Test a running server instead of starting one")
+    run_parser.add_argument("--server-pid", type=int, help="PID of the --url server, to sample its RSS")
+    run_parser.add_argument("--server-workers", type=int, default=1, help="uvicorn --workers of the local server")
+    run_parser.add_argument("--server-env", nargs="*", default=[], metavar="NAME=VALUE",
+                            help="Extra environment for the local server, e.g. SWAPLIST_JOB_WORKERS=4")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--corpus-dir", help="Reuse/keep generated corpora in this directory")
+    run_parser.add_argument("--keep-corpus", action="store_true")
+    run_parser.add_argument("--output", "-o", help="Write JSON results here")
+    run_parser.add_argument("--compare", help="Baseline JSON to compare against after running")
+    run_parser.add_argument("--threshold", type=float, default=0.20, help="Allowed p99/throughput ratio before flagging")
+
+    cmp_parser = sub.add_parser("compare", help="Compare two result files")
+    cmp_parser.add_argument("baseline")
+    cmp_parser.add_argument("current")
+    cmp_parser.add_argument("--threshold", type=float, default=0.20)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        current = run_load(args)
+        if not args.compare:
+            return 0
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+
+    regressions = compare(baseline, current, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
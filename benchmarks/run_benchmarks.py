@@ -0,0 +1,288 @@
+"""
+Micro-benchmarks for the swap pipeline.
+
+Each case runs in a fresh spawned process so peak RSS and I/O counters
+belong to the measured call alone; setup (corpus generation, extraction)
+happens in the parent and is not timed.
+
+    python -m benchmarks.run_benchmarks run --gcode-mb 10 100 --output bench.json
+    python -m benchmarks.run_benchmarks compare baseline.json bench.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import zipfile
+import argparse
+import platform
+import tempfile
+import resource
+import statistics
+import contextlib
+import subprocess
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.synthetic_3mf import MB, build_synthetic_3mf
+
+RESULTS_FORMAT_VERSION = 1
+
+# --- CHILD SIDE ---
+
+def _proc_io():
+    """Returns /proc/self/io counters (Linux only), or an empty dict."""
+    try:
+        with open("/proc/self/io") as f:
+            return {k: int(v) for k, v in (line.split(": ") for line in f)}
+    except (OSError, ValueError):
+        return {}
+
+def _bench_parse_3mf(threemf_path):
+    from backend.core import parse_3mf
+    parse_3mf(threemf_path)
+
+def _bench_merge_slice_info(playlist, output_path):
+    import generate_swap_gcode as gsg
+    gsg.merge_slice_info(playlist, output_path)
+
+def _bench_generate_swap_gcode_content(playlist):
+    import generate_swap_gcode as gsg
+    gsg.generate_swap_gcode_content(playlist)
+
+def _bench_estimate_gcode(gcode_path):
+    from gcode_estimator import GcodeTimeEstimator
+    estimator = GcodeTimeEstimator()
+    with open(gcode_path, "rb") as f:
+        for chunk in iter(lambda: f.read(MB), b""):
+            estimator.feed(chunk)
+    estimator.finish()
+
+def _bench_scan_gcode(gcode_path):
+    from gcode_scanner import scan_gcode_file
+    scan_gcode_file(gcode_path)
+
+def _bench_zip_directory(folder, output_path, compress_level):
+    import generate_swap_gcode as gsg
+    gsg.zip_directory(folder, output_path, compress_level)
+
+def _bench_process_3mf_playlist(playlist_3mf, output_path, streaming, compress_level):
+    import generate_swap_gcode as gsg
+    gsg.process_3mf_playlist(playlist_3mf, output_path, streaming=streaming, compress_level=compress_level)
+
+BENCH_FUNCTIONS = {
+    "parse_3mf": _bench_parse_3mf,
+    "merge_slice_info": _bench_merge_slice_info,
+    "generate_swap_gcode_content": _bench_generate_swap_gcode_content,
+    "estimate_gcode": _bench_estimate_gcode,
+    "scan_gcode": _bench_scan_gcode,
+    "zip_directory": _bench_zip_directory,
+    "process_3mf_playlist.streaming": _bench_process_3mf_playlist,
+    "process_3mf_playlist.staged": _bench_process_3mf_playlist,
+}
+
+def _measure(name, args):
+    """Runs one benchmark call in this (fresh) process and returns its measurements."""
+    func = BENCH_FUNCTIONS[name]
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    io_start = _proc_io()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        func(*args)
+        wall = time.perf_counter() - start
+    io_end = _proc_io()
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss_unit = 1 if sys.platform == "darwin" else 1024
+    return {
+        "wall_s": wall,
+        "peak_rss_mb": rss_peak * rss_unit / MB,
+        "rss_growth_mb": (rss_peak - rss_start) * rss_unit / MB,
+        # wchar: bytes handed to write()-style syscalls; write_bytes: bytes that reached the block layer
+        "bytes_written": io_end.get("wchar", 0) - io_start.get("wchar", 0) if io_start else None,
+        "storage_bytes_written": io_end.get("write_bytes", 0) - io_start.get("write_bytes", 0) if io_start else None,
+    }
+
+# --- PARENT SIDE ---
+
+def run_isolated(name, args):
+    """Runs a benchmark in a new spawned process."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) as pool:
+        return pool.submit(_measure, name, args).result()
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _corpus_cases(corpus_path, work_dir, count, compress_level):
+    """
+    Yields (name, args, cleanup_path) for every benchmark of one corpus file.
+    Setup that the measured function expects (extracted folders) is done here.
+    """
+    extract_dir = os.path.join(work_dir, "extracted")
+    if not os.path.isdir(extract_dir):
+        with zipfile.ZipFile(corpus_path) as zf:
+            zf.extractall(extract_dir)
+    metadata_dir = os.path.join(extract_dir, "Metadata")
+    plates = sorted(int(f[len("plate_"):-len(".gcode")]) for f in os.listdir(metadata_dir)
+                    if f.startswith("plate_") and f.endswith(".gcode"))
+    gcode_playlist = [(os.path.join(metadata_dir, f"plate_{p}.gcode"), count) for p in plates]
+    output_3mf = os.path.join(work_dir, "out.3mf")
+    
+    yield "parse_3mf", (corpus_path,), None
+    yield "merge_slice_info", (gcode_playlist, os.path.join(work_dir, "slice_info.config")), None
+    yield "generate_swap_gcode_content", (gcode_playlist,), None
+    yield "estimate_gcode", (gcode_playlist[0][0],), None
+    yield "scan_gcode", (gcode_playlist[0][0],), None
+    yield "zip_directory", (extract_dir, output_3mf, compress_level), output_3mf
+    
+    playlist_3mf = [(corpus_path, p, count) for p in plates]
+    yield "process_3mf_playlist.streaming", (playlist_3mf, output_3mf, True, compress_level), output_3mf
+    yield "process_3mf_playlist.staged", (playlist_3mf, output_3mf, False, compress_level), output_3mf
+
+def run_suite(args):
+    corpus_dir = args.corpus_dir or tempfile.mkdtemp(prefix="swap_bench_")
+    os.makedirs(corpus_dir, exist_ok=True)
+    results = []
+    try:
+        for gcode_mb in args.gcode_mb:
+            params = {"plates": args.plates, "gcode_mb": gcode_mb, "thumbnails": args.thumbnails,
+                      "filaments": args.filaments, "count": args.count, "compress_level": args.compress_level}
+            tag = f"p{args.plates}_g{gcode_mb:g}_t{args.thumbnails}_f{args.filaments}"
+            corpus_path = os.path.join(corpus_dir, f"corpus_{tag}.3mf")
+            if not os.path.exists(corpus_path):
+                print(f"Generating {corpus_path} ...")
+                build_synthetic_3mf(corpus_path, args.plates, int(gcode_mb * MB), args.thumbnails, args.filaments)
+            work_dir = os.path.join(corpus_dir, f"work_{tag}")
+            os.makedirs(work_dir, exist_ok=True)
+            
+            for name, bench_args, cleanup_path in _corpus_cases(corpus_path, work_dir, args.count, args.compress_level):
+                if args.only and not any(name.startswith(prefix) for prefix in args.only):
+                    continue
+                runs = []
+                for _ in range(args.repeat):
+                    runs.append(run_isolated(name, bench_args))
+                    if cleanup_path:
+                        if os.path.isdir(cleanup_path):
+                            shutil.rmtree(cleanup_path)
+                        elif os.path.exists(cleanup_path):
+                            os.remove(cleanup_path)
+                
+                walls = [r["wall_s"] for r in runs]
+                result = {
+                    "name": name,
+                    "params": params,
+                    "wall_s": walls,
+                    "wall_s_median": statistics.median(walls),
+                    "wall_s_min": min(walls),
+                    "peak_rss_mb": max(r["peak_rss_mb"] for r in runs),
+                    "rss_growth_mb": max(r["rss_growth_mb"] for r in runs),
+                    "bytes_written": runs[-1]["bytes_written"],
+                    "storage_bytes_written": runs[-1]["storage_bytes_written"],
+                }
+                results.append(result)
+                print(f"{tag:<28} {name:<32} median {result['wall_s_median']:8.3f}s  "
+                      f"peak RSS {result['peak_rss_mb']:8.1f} MB  written {(result['bytes_written'] or 0) / MB:8.1f} MB")
+    finally:
+        if not args.corpus_dir and not args.keep_corpus:
+            shutil.rmtree(corpus_dir, ignore_errors=True)
+    
+    report = {
+        "format": RESULTS_FORMAT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+    return report
+
+def _result_key(result):
+    return (result["name"], json.dumps(result["params"], sort_keys=True))
+
+def compare(baseline, current, threshold):
+    """
+    Prints a side-by-side comparison of two result files.
+    Returns the list of (name, params, metric, ratio) regressions beyond `threshold`.
+    """
+    base_index = {_result_key(r): r for r in baseline["results"]}
+    regressions = []
+    print(f"{'benchmark':<32} {'params':<22} {'wall base':>10} {'wall new':>10} {'ratio':>7} {'rss base':>9} {'rss new':>9}")
+    for result in current["results"]:
+        base = base_index.get(_result_key(result))
+        p = result["params"]
+        params = f"p{p['plates']} g{p['gcode_mb']:g}MB x{p['count']}"
+        if base is None:
+            print(f"{result['name']:<32} {params:<22} {'-':>10} {result['wall_s_median']:10.3f}")
+            continue
+        wall_ratio = result["wall_s_median"] / base["wall_s_median"] if base["wall_s_median"] else 1.0
+        rss_ratio = result["peak_rss_mb"] / base["peak_rss_mb"] if base["peak_rss_mb"] else 1.0
+        flag = ""
+        for metric, ratio in (("wall", wall_ratio), ("rss", rss_ratio)):
+            if ratio > 1 + threshold:
+                regressions.append((result["name"], params, metric, ratio))
+                flag = "  REGRESSION"
+        print(f"{result['name']:<32} {params:<22} {base['wall_s_median']:10.3f} {result['wall_s_median']:10.3f} "
+              f"{wall_ratio:7.2f} {base['peak_rss_mb']:9.1f} {result['peak_rss_mb']:9.1f}{flag}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Swap pipeline micro-benchmarks.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    
+    run_parser = sub.add_parser("run", help="Run the benchmark suite")
+    run_parser.add_argument("--plates", type=int, default=2)
+    run_parser.add_argument("--gcode-mb", type=float, nargs="+", default=[10.0],
+                            help="Uncompressed G-code per plate, in MB (one corpus per value)")
+    run_parser.add_argument("--thumbnails", type=int, default=4)
+    run_parser.add_argument("--filaments", type=int, default=2)
+    run_parser.add_argument("--count", type=int, default=2, help="Copies of each plate in the playlist")
+    run_parser.add_argument("--compress-level", type=int, default=6)
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--only", nargs="+", help="Run only benchmarks whose name starts with one of these")
+    run_parser.add_argument("--corpus-dir", help="Reuse/keep generated corpora in this directory")
+    run_parser.add_argument("--keep-corpus", action="store_true")
+    run_parser.add_argument("--output", "-o", help="Write JSON results here")
+    run_parser.add_argument("--compare", help="Baseline JSON to compare against after running")
+    run_parser.add_argument("--threshold", type=float, default=0.10, help="Allowed slowdown ratio before flagging")
+    
+    cmp_parser = sub.add_parser("compare", help="Compare two result files")
+    cmp_parser.add_argument("baseline")
+    cmp_parser.add_argument("current")
+    cmp_parser.add_argument("--threshold", type=float, default=0.10)
+    
+    args = parser.parse_args(argv)
+    
+    if args.command == "run":
+        current = run_suite(args)
+        if not args.compare:
+            return 0
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+    
+    regressions = compare(baseline, current, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+"""
+Synthetic Bambu-style 3MF generator for benchmarks.
+
+Builds projects with the same layout the swap pipeline expects (3D/ model,
+Metadata/plate_N.gcode + .md5, plate/pick/top thumbnails, slice_info.config,
+model_settings.config, project/filament settings) without needing real
+sliced files. Output is deterministic for a given seed.
+"""
+import os
+import sys
+import zlib
+import struct
+import random
+import hashlib
+import zipfile
+import argparse
+
+MB = 1024 * 1024
+
+# G-code is streamed from a pool of pre-rendered chunks, so even 1 GB plates
+# generate quickly with realistic (text, ~3-4x) compressibility.
+GCODE_CHUNK_SIZE = 64 * 1024
+GCODE_CHUNK_POOL = 32
+
+FILAMENT_TYPES = ["PLA", "PETG", "ABS", "TPU", "PLA-CF"]
+
+def _png(width, height, rng):
+    """Returns a valid RGB PNG of random noise."""
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+    rows = b"".join(b"\x00" + rng.randbytes(width * 3) for _ in range(height))
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows, 6))
+            + chunk(b"IEND", b""))
+
+def _gcode_chunks(rng):
+    chunks = []
+    z = 0.2
+    for _ in range(GCODE_CHUNK_POOL):
+        lines = []
+        size = 0
+        while size < GCODE_CHUNK_SIZE:
+            if rng.random() < 0.002:
+                z += 0.2
+                line = f";LAYER_CHANGE\n;Z:{z:.2f}\nG1 Z{z:.2f} F600\n"
+            elif rng.random() < 0.05:
+                line = f"G0 X{rng.uniform(0, 180):.3f} Y{rng.uniform(0, 180):.3f} F12000\n"
+            else:
+                line = (f"G1 X{rng.uniform(0, 180):.3f} Y{rng.uniform(0, 180):.3f} "
+                        f"E{rng.uniform(0, 1.5):.5f} F{rng.choice([1200, 3000, 6000, 9000])}\n")
+            lines.append(line)
+            size += len(line)
+        chunks.append("".join(lines).encode("ascii"))
+    return chunks
+
+def _write_gcode(zf, arcname, size, rng, chunks):
+    """Streams `size` bytes of G-code into a member. Returns its MD5."""
+    hash_md5 = hashlib.md5()
+    header = b"; HEADER_BLOCK_START\n; generated by benchmarks.synthetic_3mf\n; HEADER_BLOCK_END\nM104 S220\nG28\n"
+    footer = b"M104 S0\nM140 S0\n; EXECUTABLE_BLOCK_END\n"
+    with zf.open(arcname, "w", force_zip64=size > zipfile.ZIP64_LIMIT) as dst:
+        body = max(size - len(header) - len(footer), 0)
+        dst.write(header)
+        hash_md5.update(header)
+        while body > 0:
+            chunk = rng.choice(chunks)[:body]
+            dst.write(chunk)
+            hash_md5.update(chunk)
+            body -= len(chunk)
+        dst.write(footer)
+        hash_md5.update(footer)
+    return hash_md5.hexdigest()
+
+def build_synthetic_3mf(path, plates=2, gcode_bytes=MB, thumbnails=4, filaments=2, seed=0):
+    """
+    Writes a synthetic sliced 3MF to `path`.
+    plates: Number of sliced plates (plate_1 .. plate_N).
+    gcode_bytes: Uncompressed G-code size per plate.
+    thumbnails: PNGs per plate (plate_N.png, plate_N_small.png, pick_N.png, top_N.png, then extras).
+    filaments: Filaments per plate listed in slice_info.config.
+    Returns the path.
+    """
+    rng = random.Random(seed)
+    chunks = _gcode_chunks(rng)
+    thumb_names = ["plate_{}.png", "plate_{}_small.png", "pick_{}.png", "top_{}.png"]
+    
+    slice_info = ['<?xml version="1.0" encoding="UTF-8"?>', "<config>", "  <header>",
+                  '    <header_item key="X-BBL-Client-Type" value="slicer"/>',
+                  '    <header_item key="X-BBL-Client-Version" value="02.00.00.00"/>', "  </header>"]
+    model_settings = ['<?xml version="1.0" encoding="UTF-8"?>', "<config>"]
+    
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", '<?xml version="1.0" encoding="UTF-8"?>\n<Types/>\n')
+        zf.writestr("_rels/.rels", '<?xml version="1.0" encoding="UTF-8"?>\n<Relationships/>\n')
+        vertices = "".join(f'<vertex x="{rng.uniform(0, 50):.4f}" y="{rng.uniform(0, 50):.4f}" z="{rng.uniform(0, 50):.4f}"/>'
+                           for _ in range(5000))
+        zf.writestr("3D/3dmodel.model", f'<?xml version="1.0" encoding="UTF-8"?>\n<model><mesh><vertices>{vertices}</vertices></mesh></model>\n')
+        zf.writestr("Metadata/project_settings.config", '{"printer_model": "Bambu Lab A1 mini"}\n')
+        zf.writestr("Metadata/filament_settings_1.config", '{"filament_type": ["PLA"]}\n')
+        
+        for plate in range(1, plates + 1):
+            md5 = _write_gcode(zf, f"Metadata/plate_{plate}.gcode", gcode_bytes, rng, chunks)
+            zf.writestr(f"Metadata/plate_{plate}.gcode.md5", md5)
+            zf.writestr(f"Metadata/plate_{plate}.json", '{"bbox_objects": []}\n')
+            for t in range(thumbnails):
+                name = thumb_names[t] if t < len(thumb_names) else f"plate_{{}}_extra_{t}.png"
+                size = 256 if t == 0 else 64
+                zf.writestr("Metadata/" + name.format(plate), _png(size, size, rng))
+            
+            slice_info += ["  <plate>",
+                           f'    <metadata key="index" value="{plate}"/>',
+                           f'    <metadata key="prediction" value="{rng.randint(600, 36000)}"/>',
+                           f'    <metadata key="weight" value="{rng.uniform(1, 200):.2f}"/>']
+            for f in range(1, filaments + 1):
+                slice_info.append(f'    <filament id="{f}" tray_info_idx="GFA0{f % 10}" type="{FILAMENT_TYPES[f % len(FILAMENT_TYPES)]}" '
+                                  f'color="#{rng.randrange(0x1000000):06X}" used_m="{rng.uniform(0.1, 60):.2f}" used_g="{rng.uniform(0.3, 180):.2f}" />')
+            slice_info.append("  </plate>")
+            model_settings += ["  <plate>",
+                               f'    <metadata key="plater_id" value="{plate}"/>',
+                               '    <metadata key="plater_name" value=""/>',
+                               '    <metadata key="locked" value="false"/>',
+                               '    <metadata key="filament_map_mode" value="Auto"/>',
+                               "  </plate>"]
+        
+        zf.writestr("Metadata/slice_info.config", "\n".join(slice_info + ["</config>", ""]))
+        zf.writestr("Metadata/model_settings.config", "\n".join(model_settings + ["</config>", ""]))
+    
+    return path
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic Bambu-style 3MF.")
+    parser.add_argument("output")
+    parser.add_argument("--plates", type=int, default=2)
+    parser.add_argument("--gcode-mb", type=float, default=1.0, help="Uncompressed G-code per plate, in MB")
+    parser.add_argument("--thumbnails", type=int, default=4, help="Thumbnails per plate")
+    parser.add_argument("--filaments", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    
+    build_synthetic_3mf(args.output, args.plates, int(args.gcode_mb * MB), args.thumbnails, args.filaments, args.seed)
+    print(f"Wrote {args.output} ({os.path.getsize(args.output) / MB:.1f} MB)")
+
+if __name__ == "__main__":
+    sys.exit(main())
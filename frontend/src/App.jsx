@@ -4,40 +4,153 @@ import { arrayMove, SortableContext, sortableKeyboardCoordinates, rectSortingStr
 import axios from 'axios';
 import { PlateCard } from './components/PlateCard';
 import { Dropzone } from './components/Dropzone';
-import { Download, RefreshCcw, Loader2 } from 'lucide-react';
+import { Download, RefreshCcw, Loader2, Shuffle } from 'lucide-react';
 
 // In specific production deploy (behind Nginx with /a1mini-swap prefix)
 // API is at /a1mini-swap/api
 // In dev, it's at localhost:8000/api
 const API_BASE = import.meta.env.PROD ? "/a1mini-swap/api" : "http://127.0.0.1:8000/api";
+const JOB_POLL_INTERVAL_MS = 1000;
+const CHECKS_POLL_INTERVAL_MS = 1000;
+const MAX_PRINTERS = 8;
+
+const downloadHref = (downloadUrl) => (
+  import.meta.env.PROD ? `/a1mini-swap/api${downloadUrl}` : `http://127.0.0.1:8000${downloadUrl}`
+);
+// Files above this size use the resumable chunked upload instead of the batch request
+const CHUNKED_UPLOAD_THRESHOLD = 32 * 1024 * 1024;
+const CHUNK_RETRIES = 5;
+
+const sha256Hex = async (buffer) => {
+  const digest = await crypto.subtle.digest('SHA-256', buffer);
+  return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+};
+
+// Sends one file through /uploads in offset-addressed chunks, resuming from the
+// server's offset after a failed request. Resolves with the upload result (plates).
+const uploadResumable = async (file) => {
+  const { data: session } = await axios.post(`${API_BASE}/uploads`, { filename: file.name, size: file.size });
+  let offset = session.offset;
+  let attempts = 0;
+  for (;;) {
+    const chunk = await file.slice(offset, offset + session.chunk_size).arrayBuffer();
+    const headers = { 'Content-Type': 'application/offset+octet-stream', 'Upload-Offset': String(offset) };
+    if (crypto.subtle) {
+      headers['Upload-Checksum'] = `sha256 ${await sha256Hex(chunk)}`;
+    }
+    try {
+      const { data } = await axios.patch(`${API_BASE}/uploads/${session.upload_id}`, chunk, { headers });
+      if (data.complete) return data;
+      offset = data.offset;
+      attempts = 0;
+    } catch (err) {
+      const status = err.response?.status;
+      if (status === 400 || status === 404 || ++attempts > CHUNK_RETRIES) throw err;
+      await new Promise(resolve => setTimeout(resolve, 1000 * attempts));
+      // The failed chunk may still have landed; ask the server where to continue
+      const { data } = await axios.get(`${API_BASE}/uploads/${session.upload_id}`);
+      offset = data.offset;
+    }
+  }
+};
+
+// Uploads several files in one request and calls onResult for every NDJSON line.
+const uploadBatch = async (files, onResult) => {
+  const formData = new FormData();
+  for (const file of files) {
+    formData.append('files', file);
+  }
+
+  const res = await fetch(`${API_BASE}/upload/batch`, { method: 'POST', body: formData });
+  if (!res.ok) {
+    throw new Error(`Upload failed with status ${res.status}`);
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffered = '';
+  for (;;) {
+    const { done, value } = await reader.read();
+    buffered += decoder.decode(value || new Uint8Array(), { stream: !done });
+    const lines = buffered.split('\n');
+    buffered = lines.pop();
+    lines.filter(line => line.trim()).forEach(line => onResult(JSON.parse(line)));
+    if (done) break;
+  }
+  if (buffered.trim()) {
+    onResult(JSON.parse(buffered));
+  }
+};
 
 function App() {
   const [playlist, setPlaylist] = useState([]);
   const [uploading, setUploading] = useState(false);
   const [generating, setGenerating] = useState(false);
+  const [jobProgress, setJobProgress] = useState(null);
+  const [compressionLevel, setCompressionLevel] = useState(6);
+  const [printerCount, setPrinterCount] = useState(1);
+  const [farmResult, setFarmResult] = useState(null);
+  const [optimizing, setOptimizing] = useState(false);
+  const [reorderResult, setReorderResult] = useState(null);
+  const [jobEstimate, setJobEstimate] = useState(null);
 
   const sensors = useSensors(
     useSensor(PointerSensor),
     useSensor(KeyboardSensor, { coordinateGetter: sortableKeyboardCoordinates })
   );
 
+  const loadChecks = async (checksUrl) => {
+    // Plate checks (G-code bounds, truncation) are scanned after the upload
+    // answers; poll until they are done and fill in every item of that plate
+    while (true) {
+      const res = await axios.get(`${API_BASE}${checksUrl}`);
+      if (res.status === 200) {
+        const { gcode_stats, warnings } = res.data;
+        setPlaylist(items => items.map(i => i.checks_url === checksUrl ? { ...i, gcode_stats, warnings } : i));
+        return;
+      }
+      await new Promise(resolve => setTimeout(resolve, CHECKS_POLL_INTERVAL_MS));
+    }
+  };
+
   const handleDropFiles = async (files) => {
     setUploading(true);
     try {
-      const newItems = [];
-      for (const file of files) {
-        const formData = new FormData();
-        formData.append('file', file);
-
-        const res = await axios.post(`${API_BASE}/upload`, formData);
-        if (res.data.plates) {
-          newItems.push(...res.data.plates);
+      const failed = [];
+      const addResult = (result) => {
+        if (result.error) {
+          failed.push(`${result.filename}: ${result.error}`);
+        } else if (result.plates) {
+          // Backend returns fresh IDs per upload, so the same file can be added twice.
+          setPlaylist(prev => [...prev, ...result.plates.map(p => ({ ...p, count: 1 }))]);
+          for (const plate of result.plates) {
+            if (plate.checks_url) {
+              loadChecks(plate.checks_url).catch(err => console.warn("Plate checks failed", err));
+            }
+          }
+        }
+      };
+
+      // Big projects go up in resumable chunks, one file at a time
+      const largeFiles = files.filter(file => file.size > CHUNKED_UPLOAD_THRESHOLD);
+      for (const file of largeFiles) {
+        try {
+          addResult(await uploadResumable(file));
+        } catch (err) {
+          addResult({ filename: file.name, error: err.response?.data?.detail || err.message });
         }
       }
 
-      // Add default count and ensure IDs are unique if same file added twice? 
-      // Backend returns generic IDs.
-      setPlaylist(prev => [...prev, ...newItems.map(p => ({ ...p, count: 1 }))]);
+      // The rest go up in one request; the backend parses them concurrently and
+      // streams back one NDJSON line per file as soon as it is ready.
+      const smallFiles = files.filter(file => file.size <= CHUNKED_UPLOAD_THRESHOLD);
+      if (smallFiles.length) {
+        await uploadBatch(smallFiles, addResult);
+      }
+
+      if (failed.length) {
+        alert(`Some files could not be read:\n${failed.join('\n')}`);
+      }
     } catch (err) {
       console.error("Upload failed", err);
       alert("Failed to upload file");
@@ -54,6 +167,7 @@ function App() {
         const newIndex = items.findIndex((i) => i.id === over.id);
         return arrayMove(items, oldIndex, newIndex);
       });
+      setReorderResult(null);
     }
   };
 
@@ -65,27 +179,86 @@ function App() {
     setPlaylist(items => items.map(i => i.id === id ? { ...i, count } : i));
   };
 
+  const togglePin = (id) => {
+    setPlaylist(items => items.map(i => i.id === id ? { ...i, pinned: !i.pinned } : i));
+  };
+
+  const handleOptimize = async () => {
+    // Group plates by filament to cut AMS changes; pinned plates stay where they are
+    if (playlist.length < 2) return;
+    setOptimizing(true);
+    try {
+      const res = await axios.post(`${API_BASE}/playlist/optimize`, { playlist });
+      const byId = new Map(playlist.map(item => [item.id, item]));
+      setPlaylist(res.data.order.map(id => byId.get(id)));
+      setReorderResult(res.data);
+    } catch (err) {
+      console.error("Optimize failed", err);
+      alert("Failed to optimize the playlist order");
+    } finally {
+      setOptimizing(false);
+    }
+  };
+
   const handleReset = () => {
     if (confirm("Clear playlist?")) {
       setPlaylist([]);
+      setReorderResult(null);
+    }
+  };
+
+  const waitForJob = async (jobId, onProgress = setJobProgress) => {
+    // Generation runs as a background job on the server; poll until it settles
+    while (true) {
+      const res = await axios.get(`${API_BASE}/jobs/${jobId}`);
+      const job = res.data;
+      if (job.status === 'done') return job;
+      if (job.status === 'failed') throw new Error(job.error || 'Job failed');
+      onProgress(job.progress);
+      await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
     }
   };
 
+  const generateFarm = async (payload) => {
+    // One swap file per printer, balanced by print time; the builds run in parallel
+    const res = await axios.post(`${API_BASE}/generate/farm`, { ...payload, printers: printerCount });
+    const progress = res.data.printers.map(p => (p.job && p.job.status === 'done' ? 1 : 0));
+    const printers = await Promise.all(res.data.printers.map(async (printer, i) => {
+      if (!printer.job) return printer;
+      const job = printer.job.status === 'done' ? printer.job : await waitForJob(printer.job.job_id, (value) => {
+        progress[i] = value || 0;
+        setJobProgress(progress.reduce((a, b) => a + b, 0) / progress.length);
+      });
+      return { ...printer, download_url: job.download_url, estimate: job.estimate };
+    }));
+    setFarmResult({ ...res.data, printers });
+  };
+
   const handleGenerate = async () => {
     if (playlist.length === 0) return;
     setGenerating(true);
+    setJobProgress(null);
+    setFarmResult(null);
+    setJobEstimate(null);
     try {
-      const payload = { playlist };
+      const payload = { playlist, compression_level: compressionLevel };
+      if (printerCount > 1) {
+        await generateFarm(payload);
+        return;
+      }
       const res = await axios.post(`${API_BASE}/generate`, payload);
-      if (res.data.download_url) {
-        const url = import.meta.env.PROD ? `/a1mini-swap/api${res.data.download_url}` : `http://127.0.0.1:8000${res.data.download_url}`;
-        window.open(url, '_blank');
+      // Playlists built before come back already done
+      const job = res.data.status === 'done' ? res.data : await waitForJob(res.data.job_id);
+      setJobEstimate(job.estimate);
+      if (job.download_url) {
+        window.open(downloadHref(job.download_url), '_blank');
       }
     } catch (err) {
       console.error("Generate failed", err);
       alert("Failed to generate swap file");
     } finally {
       setGenerating(false);
+      setJobProgress(null);
     }
   };
 
@@ -117,6 +290,12 @@ function App() {
                 <span className="font-bold">{formatTime(totalDuration)}</span>
                 <span>Plates:</span>
                 <span className="font-bold">{totalPlates}</span>
+                {jobEstimate && (
+                  <>
+                    <span>With swaps:</span>
+                    <span className="font-bold">{formatTime(jobEstimate.total_seconds)}</span>
+                  </>
+                )}
               </div>
             </div>
 
@@ -127,6 +306,18 @@ function App() {
                 <span className="font-bold">{totalWeight.toFixed(2)}g</span>
               </div>
             </div>
+
+            {reorderResult && (
+              <div>
+                <span className="font-bold block text-gray-600">Filament changes:</span>
+                <div className="grid grid-cols-[auto_1fr] gap-x-2 mt-1">
+                  <span>Changes:</span>
+                  <span className="font-bold">{reorderResult.original.filament_changes} → {reorderResult.optimized.filament_changes}</span>
+                  <span>Saved:</span>
+                  <span className="font-bold">~{formatTime(reorderResult.saved.seconds)}, {reorderResult.saved.grams.toFixed(1)}g</span>
+                </div>
+              </div>
+            )}
           </div>
         </div>
 
@@ -138,6 +329,42 @@ function App() {
             <RefreshCcw size={14} /> Reset
           </button>
 
+          <button
+            onClick={handleOptimize}
+            disabled={playlist.length < 2 || optimizing || generating}
+            className="bg-gray-200 hover:bg-gray-300 text-gray-800 py-1 px-4 rounded text-sm flex items-center gap-2 disabled:opacity-50"
+          >
+            {optimizing ? <Loader2 size={14} className="animate-spin" /> : <Shuffle size={14} />} Optimize order
+          </button>
+
+          <label className="text-sm text-gray-600 flex items-center gap-2">
+            Compression:
+            <select
+              value={compressionLevel}
+              onChange={(e) => setCompressionLevel(Number(e.target.value))}
+              disabled={generating}
+              className="border border-gray-300 rounded px-1 py-0.5"
+            >
+              <option value={1}>Fast</option>
+              <option value={6}>Balanced</option>
+              <option value={9}>Smallest</option>
+            </select>
+          </label>
+
+          <label className="text-sm text-gray-600 flex items-center gap-2">
+            Printers:
+            <select
+              value={printerCount}
+              onChange={(e) => setPrinterCount(Number(e.target.value))}
+              disabled={generating}
+              className="border border-gray-300 rounded px-1 py-0.5"
+            >
+              {Array.from({ length: MAX_PRINTERS }, (_, i) => i + 1).map(n => (
+                <option key={n} value={n}>{n}</option>
+              ))}
+            </select>
+          </label>
+
           <button
             onClick={handleGenerate}
             disabled={playlist.length === 0 || generating}
@@ -145,6 +372,7 @@ function App() {
           >
             {generating ? <Loader2 className="animate-spin" /> : <Download size={18} />}
             Generate SWAP file
+            {generating && jobProgress != null && ` (${Math.round(jobProgress * 100)}%)`}
           </button>
         </div>
       </div>
@@ -153,6 +381,31 @@ function App() {
       <div className="flex-1 p-6 max-w-7xl mx-auto w-full flex flex-col gap-6">
         <Dropzone onDropFiles={handleDropFiles} uploading={uploading} />
 
+        {farmResult && (
+          <div className="bg-white border border-gray-200 rounded p-4 text-sm">
+            <span className="font-bold block text-gray-600 mb-2">
+              Farm plan: all printers done in {formatTime(farmResult.makespan_seconds)}
+            </span>
+            <div className="grid grid-cols-[auto_auto_auto_auto_1fr] gap-x-4 gap-y-1">
+              {farmResult.printers.map(printer => (
+                <React.Fragment key={printer.printer}>
+                  <span>Printer {printer.printer}</span>
+                  <span>{printer.items.reduce((acc, item) => acc + item.count, 0)} plates</span>
+                  <span className="font-bold">{formatTime(printer.planned_seconds)}</span>
+                  <span title="Estimated from the generated G-code">
+                    {printer.estimate ? `est. ${formatTime(printer.estimate.total_seconds)}` : ''}
+                  </span>
+                  {printer.download_url ? (
+                    <a href={downloadHref(printer.download_url)} target="_blank" rel="noreferrer" className="text-blue-600 hover:underline">
+                      Download
+                    </a>
+                  ) : <span className="text-gray-400">Idle</span>}
+                </React.Fragment>
+              ))}
+            </div>
+          </div>
+        )}
+
         <DndContext
           sensors={sensors}
           collisionDetection={closestCenter}
@@ -170,6 +423,7 @@ function App() {
                   index={idx}
                   onRemove={removeItem}
                   onUpdateCount={updateCount}
+                  onTogglePin={togglePin}
                 />
               ))}
             </div>
@@ -1,10 +1,13 @@
 import React from 'react';
 import { useSortable } from '@dnd-kit/sortable';
 import { CSS } from '@dnd-kit/utilities';
-import { GripVertical, Clock, Weight, X } from 'lucide-react';
+import { GripVertical, Clock, Weight, X, Pin, AlertTriangle } from 'lucide-react';
 import { cn } from '../lib/utils';
 
-export function PlateCard({ item, index, onRemove, onUpdateCount }) {
+// Copies of one plate the backend accepts (MAX_COPIES in backend/api.py)
+const MAX_COPIES = 1000;
+
+export function PlateCard({ item, index, onRemove, onUpdateCount, onTogglePin }) {
     const {
         attributes,
         listeners,
@@ -29,7 +32,7 @@ export function PlateCard({ item, index, onRemove, onUpdateCount }) {
 
     const handleCountChange = (e) => {
         const val = parseInt(e.target.value);
-        if (val > 0) onUpdateCount(item.id, val);
+        if (val > 0 && val <= MAX_COPIES) onUpdateCount(item.id, val);
     };
 
     return (
@@ -43,8 +46,24 @@ export function PlateCard({ item, index, onRemove, onUpdateCount }) {
         >
             {/* Header / ID */}
             <div className="flex items-center justify-between px-3 py-1 bg-gray-300/50">
-                <span className="font-bold text-gray-500 text-lg">{index + 1}</span>
+                <div className="flex items-center gap-1">
+                    <span className="font-bold text-gray-500 text-lg">{index + 1}</span>
+                    {/* Plate checks, fetched after the upload (bounds vs. the swap sequence, truncation) */}
+                    {item.warnings && item.warnings.length > 0 && (
+                        <span title={item.warnings.join("\n")} className="text-amber-600">
+                            <AlertTriangle size={16} />
+                        </span>
+                    )}
+                </div>
                 <div className="flex items-center gap-2">
+                    {/* Pin: keep this position when the order is optimized */}
+                    <button
+                        onClick={() => onTogglePin(item.id)}
+                        title={item.pinned ? "Unpin" : "Keep in place when optimizing"}
+                        className={item.pinned ? "text-blue-600" : "text-gray-400 hover:text-blue-600"}
+                    >
+                        <Pin size={16} />
+                    </button>
                     {/* Drag Handle */}
                     <div {...attributes} {...listeners} className="cursor-grab hover:text-blue-600">
                         <GripVertical size={18} />
@@ -60,7 +79,7 @@ export function PlateCard({ item, index, onRemove, onUpdateCount }) {
             <div className="relative aspect-square bg-white m-2 rounded-md overflow-hidden flex items-center justify-center">
                 {item.image_url ? (
                     <img
-                        src={item.image_url.startsWith('http') ? item.image_url : (import.meta.env.PROD ? `/a1mini-swap/api${item.image_url}` : `http://127.0.0.1:8000${item.image_url}`)}
+                        src={item.image_url.startsWith('http') ? item.image_url : (import.meta.env.PROD ? `/a1mini-swap/api${item.image_url}` : `http://127.0.0.1:8000/api${item.image_url}`)}
                         alt="Plate"
                         className="object-contain w-full h-full"
                     />
@@ -80,16 +99,29 @@ export function PlateCard({ item, index, onRemove, onUpdateCount }) {
                     <input
                         type="number"
                         min="1"
+                        max={MAX_COPIES}
                         value={item.count}
                         onChange={handleCountChange}
                         className="w-12 px-1 py-0.5 border border-gray-400 rounded text-center bg-white"
                     />
                 </div>
 
-                <div className="flex items-center gap-1 text-gray-700 col-span-2">
+                <div className="flex items-center gap-1 text-gray-700">
                     <Weight size={14} />
                     <span>{item.weight ? item.weight.toFixed(2) : "0"}g</span>
                 </div>
+
+                {/* Filament colours */}
+                <div className="flex justify-end gap-1">
+                    {(item.filaments || []).map((fil, i) => (
+                        <span
+                            key={i}
+                            title={fil.type}
+                            className="w-3 h-3 rounded-full border border-gray-400"
+                            style={{ backgroundColor: fil.color.slice(0, 7) }}
+                        />
+                    ))}
+                </div>
             </div>
 
             {/* Filename Overlay (like reference) */}
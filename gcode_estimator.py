@@ -0,0 +1,438 @@
+import math
+
+try:
+    import numpy as np
+except ImportError: # a dependency, but the per-line parser gives the same estimate (only slower)
+    np = None
+
+# --- KINEMATIC MODEL ---
+# A simple trapezoidal planner: every move accelerates from the junction speed
+# to its feedrate and back down. No lookahead, so long runs of short segments
+# come out a little pessimistic. Temperature waits (M109/M190) and the firmware's
+# own calibration routines are not modelled.
+
+DEFAULT_FEEDRATE = 50.0 # mm/s until the first F word
+DEFAULT_ACCELERATION = 10000.0 # mm/s^2 until the first M204
+JUNCTION_SPEED = 10.0 # mm/s, speed every move starts and ends at
+# Axis speed limits (mm/s), the feedrate is clamped so no axis exceeds them
+MAX_AXIS_SPEED = {"X": 500.0, "Y": 500.0, "Z": 30.0, "E": 50.0}
+# Fixed cost of a G28 homing
+HOMING_SECONDS = 15.0
+
+_LINEAR_MOVES = {b"G0", b"G1", b"G00", b"G01"}
+_ARC_MOVES = {b"G2", b"G3", b"G02", b"G03"}
+_CLOCKWISE_ARCS = {b"G2", b"G02"}
+
+# --- ARRAY PATH ---
+# Plain "G0 "/"G1 " lines (the bulk of any plate) are parsed and costed as
+# arrays: their X/Y/Z/E/F words are read as numbers column by column, and the
+# machine state between them is carried with running sums / last-set indices.
+# Every other line that can change the state (arcs, dwells, G28, G90/G91, G92,
+# M82/M83, M204, and moves written in any unusual way) goes through the
+# per-line parser, in order, between the runs of plain moves.
+
+_NUMBER_WIDTH = 16 # bytes of a move word's number read as arrays; longer ones take the per-line path
+_MAX_DIGITS = 15 # up to here digits / 10**decimals is exact, so the result equals float()
+_MOVE_WORDS = b"XYZEF" # array column of each word
+if np is not None:
+    _WORD_COLUMN = np.full(256, -1, dtype=np.int8)
+    _WORD_COLUMN[list(_MOVE_WORDS)] = np.arange(len(_MOVE_WORDS))
+    _ENDS_WORD = np.zeros(256, dtype=bool) # what bytes.split() splits on, and comments
+    _ENDS_WORD[list(b" \t\n\r\x0b\x0c;")] = True
+    _POWERS_OF_TEN = np.array([10.0 ** k for k in range(_NUMBER_WIDTH + 1)])
+
+def move_time(distance, speed, acceleration, junction=JUNCTION_SPEED):
+    """
+    Seconds for a trapezoidal move of `distance` mm cruising at `speed` mm/s,
+    starting and ending at `junction` mm/s (or `speed` if lower).
+    """
+    if distance <= 0 or speed <= 0:
+        return 0.0
+    junction = min(junction, speed)
+    if acceleration <= 0:
+        return distance / speed
+    ramp = (speed * speed - junction * junction) / acceleration # accel + decel distance
+    if distance >= ramp:
+        return distance / speed + (speed - junction) ** 2 / (acceleration * speed)
+    peak = math.sqrt(junction * junction + acceleration * distance)
+    return 2.0 * (peak - junction) / acceleration
+
+def total_move_time(distances, speeds, accelerations):
+    """Total seconds for parallel lists of move distances, speeds and accelerations."""
+    return sum(map(move_time, distances, speeds, accelerations))
+
+def move_times(distances, speeds, accelerations, junction=JUNCTION_SPEED):
+    """move_time for arrays of moves with positive distances and speeds. Returns an array of seconds."""
+    junction = np.minimum(junction, speeds)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ramp = (speeds * speeds - junction * junction) / accelerations
+        cruising = distances / speeds + (speeds - junction) ** 2 / (accelerations * speeds)
+        peak = np.sqrt(junction * junction + accelerations * distances)
+        short = 2.0 * (peak - junction) / accelerations
+    return np.where(accelerations <= 0, distances / speeds, np.where(distances >= ramp, cruising, short))
+
+def _parse_numbers(arr, positions):
+    """
+    Reads the decimal numbers starting at `positions` of a uint8 array, which
+    must go on for _NUMBER_WIDTH + 1 bytes past the last one.
+    Returns (values, valid). A number is valid only if float() reads it the same:
+    an optional '-', at most _MAX_DIGITS digits with at most one '.', then the
+    end of the word.
+    """
+    negative = arr[positions] == 45 # '-'
+    positions = positions + negative
+    mantissa = np.zeros(len(positions), dtype=np.int64)
+    digits = np.zeros(len(positions), dtype=np.int64)
+    decimals = np.zeros(len(positions), dtype=np.int64)
+    point = np.zeros(len(positions), dtype=bool)
+    running = np.ones(len(positions), dtype=bool)
+    end = np.zeros(len(positions), dtype=np.uint8)
+    for column in range(_NUMBER_WIDTH):
+        byte = arr[positions + column]
+        value = byte - 48
+        digit = value < 10 # uint8 wraps below '0'
+        step = running & (digit | ((byte == 46) & ~point))
+        end = np.where(running & ~step, byte, end)
+        running = step
+        if not running.any():
+            break
+        taken = step & digit
+        mantissa = np.where(taken, mantissa * 10 + value, mantissa)
+        digits += taken
+        decimals += taken & point
+        point |= step & ~digit
+    valid = ~running & (digits > 0) & (digits <= _MAX_DIGITS) & _ENDS_WORD[end]
+    values = mantissa / _POWERS_OF_TEN[np.minimum(decimals, _NUMBER_WIDTH)]
+    return np.where(negative, -values, values), valid
+
+class GcodeTimeEstimator:
+    """
+    Incremental print-time estimator for Marlin/Bambu style G-code.
+    Feed it the file in chunks of bytes (lines may span chunks). With NumPy, a
+    chunk's plain G0/G1 moves are parsed and costed as arrays (see _process_chunk);
+    without it, every line is parsed in Python and the moves summed by
+    total_move_time. Both give the same estimate (up to float rounding).
+    Understands G0/G1, G2/G3 arcs, G4 dwells, G28, G90/G91, G92, M82/M83 and
+    M204 acceleration changes.
+    vectorized: Use NumPy (the default when it is installed).
+    """
+    def __init__(self, vectorized=None):
+        self.vectorized = np is not None if vectorized is None else vectorized
+        if self.vectorized and np is None:
+            raise RuntimeError("Vectorized G-code estimates need NumPy (pip install numpy)")
+        self.x = self.y = self.z = self.e = 0.0
+        self.feedrate = DEFAULT_FEEDRATE
+        self.acceleration = DEFAULT_ACCELERATION
+        self.relative = False
+        self.relative_e = False
+        self.seconds = 0.0
+        self.moves = 0
+        self._carry = b""
+
+    def fork(self):
+        """A copy carrying over the machine state (position, modes, speeds) with the time reset."""
+        other = GcodeTimeEstimator(self.vectorized)
+        other.x, other.y, other.z, other.e = self.x, self.y, self.z, self.e
+        other.feedrate = self.feedrate
+        other.acceleration = self.acceleration
+        other.relative = self.relative
+        other.relative_e = self.relative_e
+        return other
+
+    def feed(self, data):
+        """Parses a chunk of G-code bytes; a trailing partial line is kept for the next call."""
+        if self._carry:
+            data = self._carry + data
+        if not self.vectorized:
+            lines = data.split(b"\n")
+            self._carry = lines.pop()
+            self._process(lines)
+            return
+        end = data.rfind(b"\n") + 1
+        self._carry = data[end:]
+        if end:
+            self._process_chunk(data, end)
+
+    def finish(self):
+        """Parses whatever is left of the last line. Returns the total seconds."""
+        if self._carry:
+            self._process([self._carry])
+            self._carry = b""
+        return self.seconds
+
+    def _process(self, lines):
+        # Hot loop: machine state lives in locals and is written back at the end
+        x, y, z, e = self.x, self.y, self.z, self.e
+        feedrate, acceleration = self.feedrate, self.acceleration
+        relative, relative_e = self.relative, self.relative_e
+        max_z, max_e = MAX_AXIS_SPEED["Z"], MAX_AXIS_SPEED["E"]
+        max_xy = min(MAX_AXIS_SPEED["X"], MAX_AXIS_SPEED["Y"])
+        distances, speeds, accelerations = [], [], []
+        dwell = 0.0
+
+        for line in lines:
+            if b";" in line:
+                line = line.partition(b";")[0]
+            words = line.split()
+            if not words:
+                continue
+            command = words[0]
+
+            if command in _LINEAR_MOVES or command in _ARC_MOVES:
+                nx, ny, nz, ne = x, y, z, e
+                params = None # only arcs carry other words (I, J, R)
+                for word in words[1:]:
+                    try:
+                        value = float(word[1:])
+                    except ValueError:
+                        continue
+                    axis = word[0]
+                    if axis == 88: # X
+                        nx = x + value if relative else value
+                    elif axis == 89: # Y
+                        ny = y + value if relative else value
+                    elif axis == 90: # Z
+                        nz = z + value if relative else value
+                    elif axis == 69: # E
+                        ne = e + value if relative_e else value
+                    elif axis == 70: # F
+                        if value > 0:
+                            feedrate = value / 60.0
+                    elif params is None:
+                        params = {axis: value}
+                    else:
+                        params[axis] = value
+
+                dz = abs(nz - z)
+                de = abs(ne - e)
+                if command in _LINEAR_MOVES:
+                    planar = math.hypot(nx - x, ny - y)
+                else:
+                    planar = _arc_length(x, y, nx, ny, params or {}, command in _CLOCKWISE_ARCS)
+                x, y, z, e = nx, ny, nz, ne
+
+                length = math.hypot(planar, dz) if dz else planar
+                speed = feedrate
+                if length == 0:
+                    if de == 0:
+                        continue
+                    # Extruder-only move (retract / unretract)
+                    length, speed = de, min(speed, max_e)
+                else:
+                    if speed > max_xy:
+                        speed = max_xy
+                    if dz and speed * dz > max_z * length:
+                        speed = max_z * length / dz
+                distances.append(length)
+                speeds.append(speed)
+                accelerations.append(acceleration)
+                continue
+
+            params = {}
+            for word in words[1:]:
+                try:
+                    params[word[0]] = float(word[1:])
+                except ValueError:
+                    pass
+            if command in (b"G4", b"G04"):
+                # P is milliseconds, S seconds
+                dwell += params.get(80, 0.0) / 1000.0 + params.get(83, 0.0)
+            elif command == b"G28":
+                dwell += HOMING_SECONDS
+                # "G28", "G28 XY", "G28 X0 Y0": no axis given homes them all
+                homed = b"".join(words[1:]) or b"XYZ"
+                x = 0.0 if b"X" in homed else x
+                y = 0.0 if b"Y" in homed else y
+                z = 0.0 if b"Z" in homed else z
+            elif command == b"G90":
+                relative = relative_e = False
+            elif command == b"G91":
+                relative = relative_e = True
+            elif command == b"M82":
+                relative_e = False
+            elif command == b"M83":
+                relative_e = True
+            elif command == b"G92":
+                x, y, z, e = params.get(88, x), params.get(89, y), params.get(90, z), params.get(69, e)
+            elif command == b"M204":
+                # S sets both print and travel acceleration; P (print) is the next best thing
+                value = params.get(83, params.get(80))
+                if value:
+                    acceleration = value
+
+        self.x, self.y, self.z, self.e = x, y, z, e
+        self.feedrate, self.acceleration = feedrate, acceleration
+        self.relative, self.relative_e = relative, relative_e
+        self.moves += len(distances)
+        self.seconds += dwell + total_move_time(distances, speeds, accelerations)
+
+    def _process_chunk(self, data, end):
+        """
+        _process for data[:end] (whole lines) as array operations: plain G0/G1
+        lines in bulk, the other state-changing lines one by one through _process.
+        """
+        # Zero padding so numbers can be read past the last line (the padding ends them)
+        arr = np.zeros(end + _NUMBER_WIDTH + 1, dtype=np.uint8)
+        arr[:end] = np.frombuffer(data, dtype=np.uint8, count=end)
+        ends = np.flatnonzero(arr[:end] == 10)
+        starts = np.concatenate(([0], ends[:-1] + 1))
+        heads = arr[starts[:, None] + np.arange(4)]
+        semicolons = np.flatnonzero(arr[:end] == 59)
+        comments = np.minimum(np.append(semicolons, end)[np.searchsorted(semicolons, starts)], ends)
+
+        # Plain moves: "G0 " / "G1 " with every X/Y/Z/E/F word a plain number, each at most once
+        plain = (heads[:, 0] == 71) & ((heads[:, 1] - 48) < 2) & (heads[:, 2] == 32)
+        space = (arr == 32) | ((arr - 9 < 5) & (arr != 10)) # what bytes.split() splits on, but newlines
+        words = np.flatnonzero(space[:end - 1])
+        words = words[_WORD_COLUMN[arr[words + 1]] >= 0] + 1
+        line = np.repeat(np.arange(len(starts)), ends - starts + 1)[words]
+        keep = plain[line] & (words < comments[line])
+        words, line = words[keep], line[keep]
+        column = _WORD_COLUMN[arr[words]].astype(np.int64)
+        values, valid = _parse_numbers(arr, words + 1)
+        irregular = np.zeros(len(starts), dtype=bool)
+        irregular[line[~valid]] = True
+        irregular[np.flatnonzero(np.bincount(line * 5 + column, minlength=len(starts) * 5) > 1) // 5] = True
+        plain &= ~irregular
+
+        # Lines _process has to see: G-codes that aren't plain moves, M82/M83/M204, indented lines
+        m_mode = (heads[:, 0] == 77) & (((heads[:, 1] == 56) & ((heads[:, 2] == 50) | (heads[:, 2] == 51))) |
+                                        ((heads[:, 1] == 50) & (heads[:, 2] == 48) & (heads[:, 3] == 52)))
+        events = np.flatnonzero(((heads[:, 0] == 71) | m_mode | space[starts]) & ~plain)
+        event_starts, event_ends = starts[events].tolist(), ends[events].tolist()
+
+        moves = np.flatnonzero(plain)
+        if not len(moves):
+            for start, stop in zip(event_starts, event_ends):
+                self._process([data[start:stop]])
+            return
+
+        # One row per move, NaN where a word is missing; F <= 0 is ignored like in _process
+        keep = plain[line]
+        table = np.full((len(moves), 5), np.nan)
+        table[np.searchsorted(moves, line[keep]), column[keep]] = values[keep]
+        feedrates = table[:, 4]
+        feedrates[feedrates <= 0] = np.nan
+
+        # Segment k: the moves after the k-th event line (segment 0 before the first)
+        segment = np.searchsorted(events, moves)
+        bounds = np.searchsorted(segment, np.arange(len(events) + 2))
+        first, stop = bounds[:-1], bounds[1:]
+        rows = np.arange(len(moves))
+        latest, sums = [], []
+        for c in range(5):
+            latest.append(np.maximum.accumulate(np.where(np.isnan(table[:, c]), -1, rows)))
+            sums.append(np.concatenate(([0.0], np.cumsum(np.nan_to_num(table[:, c])))))
+        # Per segment: the last value each word was set to (NaN if never) and the sum of its values
+        segment_last, segment_sum = [], []
+        for c in range(5):
+            set_row = latest[c][np.maximum(stop - 1, 0)]
+            segment_last.append(np.where((stop > first) & (set_row >= first), table[set_row, c], np.nan).tolist())
+            segment_sum.append((sums[c][stop] - sums[c][first]).tolist())
+
+        # Walk the segments in order: the state each one starts from, then its end state and next event
+        entries = []
+        last_x, last_y, last_z, last_e, last_f = segment_last
+        sum_x, sum_y, sum_z, sum_e, _ = segment_sum
+        for k in range(len(events) + 1):
+            entries.append((self.x, self.y, self.z, self.e, self.feedrate, self.acceleration,
+                            self.relative, self.relative_e))
+            if self.relative:
+                self.x += sum_x[k]
+                self.y += sum_y[k]
+                self.z += sum_z[k]
+            else:
+                self.x = last_x[k] if last_x[k] == last_x[k] else self.x
+                self.y = last_y[k] if last_y[k] == last_y[k] else self.y
+                self.z = last_z[k] if last_z[k] == last_z[k] else self.z
+            if self.relative_e:
+                self.e += sum_e[k]
+            elif last_e[k] == last_e[k]:
+                self.e = last_e[k]
+            if last_f[k] == last_f[k]:
+                self.feedrate = last_f[k] / 60.0
+            if k < len(events):
+                self._process([data[event_starts[k]:event_ends[k]]])
+
+        # Each move's distance along each axis, from its segment's starting state
+        entry = np.array(entries, dtype=np.float64)[segment]
+        segment_first = first[segment]
+        opens_segment = rows == segment_first
+        deltas = []
+        for c in range(4):
+            target = np.where(latest[c] >= segment_first, table[latest[c], c], entry[:, c])
+            previous = np.where(opens_segment, entry[:, c], np.concatenate(([0.0], target[:-1])))
+            # A relative move's distance is its word's value
+            relative = entry[:, 7 if c == 3 else 6] != 0
+            deltas.append(np.where(relative, np.nan_to_num(table[:, c]), target - previous))
+        dx, dy, dz, de = deltas
+        feedrate = np.where(latest[4] >= segment_first, table[latest[4], 4] / 60.0, entry[:, 4])
+
+        # Lengths and speed limits as in _process
+        dz, de = np.abs(dz), np.abs(de)
+        length = np.hypot(np.hypot(dx, dy), dz)
+        extruder_only = length == 0
+        speed = np.minimum(feedrate, np.where(extruder_only, MAX_AXIS_SPEED["E"],
+                                              min(MAX_AXIS_SPEED["X"], MAX_AXIS_SPEED["Y"])))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            z_limited = ~extruder_only & (dz != 0) & (speed * dz > MAX_AXIS_SPEED["Z"] * length)
+            speed = np.where(z_limited, MAX_AXIS_SPEED["Z"] * length / dz, speed)
+        length = np.where(extruder_only, de, length)
+        counted = length > 0
+        self.moves += int(np.count_nonzero(counted))
+        self.seconds += float(move_times(length[counted], speed[counted], entry[counted, 5]).sum())
+
+def _arc_length(x, y, nx, ny, params, clockwise):
+    """Planar length of a G2/G3 arc from (x, y) to (nx, ny), given I/J (centre offset) or R."""
+    if 82 in params: # R
+        radius = abs(params[82])
+        chord = math.hypot(nx - x, ny - y)
+        if radius == 0:
+            return chord
+        return radius * 2.0 * math.asin(min(1.0, chord / (2.0 * radius)))
+    cx, cy = x + params.get(73, 0.0), y + params.get(74, 0.0) # I, J
+    radius = math.hypot(x - cx, y - cy)
+    if radius == 0:
+        return math.hypot(nx - x, ny - y)
+    angle = math.atan2(ny - cy, nx - cx) - math.atan2(y - cy, x - cx)
+    # Sweep in the arc's direction; equal start and end points make a full circle
+    if clockwise and angle >= 0:
+        angle -= 2.0 * math.pi
+    elif not clockwise and angle <= 0:
+        angle += 2.0 * math.pi
+    return radius * abs(angle)
+
+class JobTimeEstimate:
+    """
+    Whole-job estimate for a swap file: the init block, then every playlist
+    entry's plate G-code and swap sequence, times its copy count.
+    """
+    def __init__(self):
+        self.init_seconds = 0.0
+        self.plates = []
+
+    def add_plate(self, source, gcode_name, count, plate_seconds, swap_seconds):
+        self.plates.append({
+            "source": source,
+            "gcode": gcode_name,
+            "count": count,
+            "plate_seconds": round(plate_seconds),
+            "swap_seconds": round(swap_seconds),
+        })
+
+    @property
+    def total_seconds(self):
+        return round(self.init_seconds + sum((p["plate_seconds"] + p["swap_seconds"]) * p["count"] for p in self.plates))
+
+    def to_dict(self):
+        return {
+            "total_seconds": self.total_seconds,
+            "init_seconds": round(self.init_seconds),
+            "plates": self.plates,
+        }
+
+def estimate_gcode_seconds(data, estimator=None):
+    """Estimates a complete G-code text (bytes). Returns (seconds, estimator)."""
+    estimator = estimator or GcodeTimeEstimator()
+    estimator.feed(data)
+    return estimator.finish(), estimator
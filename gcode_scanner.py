@@ -0,0 +1,276 @@
+import re
+import os
+import mmap
+
+try:
+    import numpy as np
+except ImportError: # a dependency, but the byte-level fallback finds the same stats (only slower)
+    np = None
+
+# --- SCANNER ---
+# Plate checks (bounds, layers, temperatures, truncation) without a Python loop
+# per line: the G-code is taken a chunk of complete lines at a time and searched
+# as a whole, with NumPy array operations if installed, else bytes.find/count
+# and regex findall.
+# Moves count on G0/G1 lines (command at the start of the line) in absolute
+# mode only; moves inside G91 blocks (relative lifts in start/end code) are skipped.
+
+SCAN_CHUNK_SIZE = 8 * 1024 * 1024
+# Comments slicers put on every layer change (PrusaSlicer/Orca, Bambu Studio)
+LAYER_MARKERS = (b";LAYER_CHANGE", b"; CHANGE_LAYER")
+# Bambu Studio brackets the printable G-code with these
+EXECUTABLE_BLOCK_START = b"; EXECUTABLE_BLOCK_START"
+EXECUTABLE_BLOCK_END = b"; EXECUTABLE_BLOCK_END"
+NOZZLE_TEMP_COMMANDS = (b"M104 ", b"M109 ")
+BED_TEMP_COMMANDS = (b"M140 ", b"M190 ")
+MODE_COMMANDS = (b"G90", b"G91")
+SCANNED_AXES = (b"Y", b"Z")
+
+_NUMBER_WIDTH = 16 # bytes of a G-code number we look at
+_NUMBER = re.compile(rb"-?(?:\d+\.?\d*|\.\d+)")
+_AXIS_PATTERNS = {
+    axis: re.compile(rb"^G[01](?: [^ ;\n]*)*? " + axis + rb"(-?(?:\d+\.?\d*|\.\d+))", re.MULTILINE)
+    for axis in SCANNED_AXES
+}
+
+def _line_starts(data, prefix, end):
+    """Offsets of the lines in data[:end] starting with prefix (data starts at a line start)."""
+    found = [0] if data.startswith(prefix) else []
+    needle = b"\n" + prefix
+    pos = data.find(needle, 0, end)
+    while pos != -1:
+        found.append(pos + 1)
+        pos = data.find(needle, pos + 1, end)
+    return found
+
+def _s_value(data, start):
+    """The S parameter of the line at `start`, or None."""
+    end = data.find(b"\n", start)
+    line = data[start:end if end != -1 else len(data)].partition(b";")[0]
+    for word in line.split()[1:]:
+        if word[:1] == b"S":
+            try:
+                return float(word[1:])
+            except ValueError:
+                return None
+    return None
+
+def _max_axes_bytes(data, start, end):
+    """{axis: max value} of the moves in data[start:end], via regex findall."""
+    maxima = {}
+    for axis, pattern in _AXIS_PATTERNS.items():
+        values = pattern.findall(data, start, end)
+        if values:
+            maxima[axis] = max(map(float, values))
+    return maxima
+
+def _number_at(arr, pos):
+    match = _NUMBER.match(arr[pos:pos + _NUMBER_WIDTH].tobytes())
+    return float(match.group()) if match else None
+
+def _max_number(arr, positions):
+    """
+    Largest of the decimal numbers starting at `positions` of a uint8 array, or
+    None. Only the winner is parsed: among the non-negative numbers with the most
+    integer digits, byte order is numeric order, so the candidates are narrowed
+    down one byte column at a time.
+    """
+    last = len(arr) - 1
+    negative = arr[np.minimum(positions, last)] == 45 # '-'
+    candidates = positions[~negative]
+    if not len(candidates):
+        values = [v for v in (_number_at(arr, p) for p in positions) if v is not None]
+        return max(values) if values else None
+
+    # Integer digits of each candidate
+    digits = np.zeros(len(candidates), dtype=np.int64)
+    running = np.ones(len(candidates), dtype=bool)
+    for column in range(_NUMBER_WIDTH):
+        running &= (arr[np.minimum(candidates + column, last)] - 48) < 10 # uint8 wraps below '0'
+        if not running.any():
+            break
+        digits += running
+    width = digits.max()
+    if width == 0: # no integer parts (".5", or no number at all): parse them all
+        values = [v for v in (_number_at(arr, p) for p in candidates) if v is not None]
+        return max(values) if values else None
+    candidates = candidates[digits == width]
+
+    # Same integer width: compare digit by digit. A number's end sorts lowest,
+    # the decimal point (only valid right after the integer part) below any digit.
+    ended = np.zeros(len(candidates), dtype=bool)
+    for column in range(_NUMBER_WIDTH):
+        if len(candidates) == 1 or ended.all():
+            break
+        byte = arr[np.minimum(candidates + column, last)]
+        in_number = ((byte - 48) < 10) | ((byte == 46) & (column == width))
+        ended |= ~in_number
+        byte = np.where(ended, 0, byte)
+        best = byte == byte.max()
+        candidates, ended = candidates[best], ended[best]
+    return _number_at(arr, candidates[0])
+
+def _line_heads(arr, starts, width):
+    """First `width` bytes of every line (padded with the last byte of the chunk), one row per line."""
+    return arr[np.minimum(starts[:, None] + np.arange(width), len(arr) - 1)]
+
+def _lines_starting(heads, starts, prefix):
+    """Start offsets of the lines whose head begins with prefix."""
+    match = np.ones(len(starts), dtype=bool)
+    for column, byte in enumerate(prefix):
+        match &= heads[:, column] == byte
+    return starts[match]
+
+def _max_axes_numpy(arr, starts, is_move, start, end):
+    """{axis: max value} of the moves in arr[start:end], as array operations."""
+    run = arr[start:end]
+    if len(run) < 2:
+        return {}
+    first, last = np.searchsorted(starts, (start, end))
+    run_starts = starts[first:last] - start
+    run_moves = is_move[first:last]
+    semicolons = np.flatnonzero(run == 59)
+    after_space = run[:-1] == 32
+
+    maxima = {}
+    for axis in SCANNED_AXES:
+        letters = np.flatnonzero((run[1:] == axis[0]) & after_space) + 1
+        if not len(letters):
+            continue
+        line = np.searchsorted(run_starts, letters, side="right") - 1
+        keep = run_moves[line]
+        # Not inside the line's comment
+        if len(semicolons):
+            k = np.searchsorted(semicolons, run_starts[line])
+            comment = np.where(k < len(semicolons), semicolons[np.minimum(k, len(semicolons) - 1)], len(run))
+            keep &= letters < comment
+        if keep.any():
+            value = _max_number(run, letters[keep] + 1)
+            if value is not None:
+                maxima[axis] = value
+    return maxima
+
+class GcodeScanner:
+    """
+    Incremental G-code stats for plate checks. Feed it the file in chunks of
+    bytes (lines may span chunks), then finish() for:
+    {"bytes", "lines", "layers", "max_y", "max_z", "max_nozzle_temp",
+     "max_bed_temp", "ends_cleanly"}
+    Maxima are None if the G-code never sets them. ends_cleanly is False if the
+    last line is unterminated or an executable block is opened but never closed
+    (both typical of a truncated file).
+    vectorized: Use NumPy (the default when it is installed).
+    """
+    def __init__(self, vectorized=None):
+        self.vectorized = np is not None if vectorized is None else vectorized
+        if self.vectorized and np is None:
+            raise RuntimeError("Vectorized G-code scanning needs NumPy (pip install numpy)")
+        self.relative = False
+        self.bytes = 0
+        self.lines = 0
+        self.layers = dict.fromkeys(LAYER_MARKERS, 0)
+        self.maxima = {}
+        self.block_open = False
+        self._carry = b""
+
+    def feed(self, data):
+        """Scans a chunk of G-code bytes; a trailing partial line is kept for the next call."""
+        self.bytes += len(data)
+        if self._carry:
+            data = self._carry + data
+        end = data.rfind(b"\n") + 1
+        self._carry = data[end:]
+        if end:
+            self._scan(data, end)
+
+    def finish(self):
+        """Scans whatever is left of the last line. Returns the stats dict."""
+        unterminated = bool(self._carry.strip())
+        if self._carry:
+            data = self._carry + b"\n"
+            self._carry = b""
+            self._scan(data, len(data))
+
+        def rounded(key):
+            value = self.maxima.get(key)
+            return round(value, 3) if value is not None else None
+
+        return {
+            "bytes": self.bytes,
+            "lines": self.lines,
+            "layers": max(self.layers.values()),
+            "max_y": rounded(b"Y"),
+            "max_z": rounded(b"Z"),
+            "max_nozzle_temp": rounded(b"nozzle"),
+            "max_bed_temp": rounded(b"bed"),
+            "ends_cleanly": not unterminated and not self.block_open,
+        }
+
+    def _update(self, key, value):
+        if value is not None and (key not in self.maxima or value > self.maxima[key]):
+            self.maxima[key] = value
+
+    def _scan(self, data, end):
+        # data[:end] is whole lines
+        self.lines += data.count(b"\n", 0, end)
+        for marker in LAYER_MARKERS:
+            self.layers[marker] += data.count(b"\n" + marker, 0, end) + data.startswith(marker)
+
+        # Executable block markers are rare; only look for them in chunks that have any
+        if EXECUTABLE_BLOCK_START in data or EXECUTABLE_BLOCK_END in data:
+            markers = [(pos, True) for pos in _line_starts(data, EXECUTABLE_BLOCK_START, end)]
+            markers += [(pos, False) for pos in _line_starts(data, EXECUTABLE_BLOCK_END, end)]
+            for _, opened in sorted(markers):
+                self.block_open = opened
+
+        # Lines of the few commands we read one by one
+        commands = NOZZLE_TEMP_COMMANDS + BED_TEMP_COMMANDS + MODE_COMMANDS
+        if self.vectorized:
+            arr = np.frombuffer(data, dtype=np.uint8, count=end)
+            starts = np.concatenate(([0], np.flatnonzero(arr == 10) + 1))
+            starts = starts[starts < end]
+            heads = _line_heads(arr, starts, 5)
+            found = {command: _lines_starting(heads, starts, command).tolist() for command in commands}
+            is_move = (heads[:, 0] == 71) & ((heads[:, 1] - 48) < 2) & (heads[:, 2] == 32) # "G0 " / "G1 "
+        else:
+            found = {command: _line_starts(data, command, end) for command in commands}
+
+        for key, temp_commands in ((b"nozzle", NOZZLE_TEMP_COMMANDS), (b"bed", BED_TEMP_COMMANDS)):
+            for command in temp_commands:
+                for pos in found[command]:
+                    self._update(key, _s_value(data, pos))
+
+        # Split at G90/G91 into absolute and relative runs; only absolute runs are searched
+        switches = sorted((pos, command == b"G91") for command in MODE_COMMANDS for pos in found[command]
+                          if not data[pos + 3:pos + 4].isdigit())
+        run_start = 0
+        for pos, relative in switches + [(end, None)]:
+            if not self.relative and pos > run_start:
+                if self.vectorized:
+                    maxima = _max_axes_numpy(arr, starts, is_move, run_start, pos)
+                else:
+                    maxima = _max_axes_bytes(data, run_start, pos)
+                for axis, value in maxima.items():
+                    self._update(axis, value)
+            if relative is not None:
+                self.relative = relative
+            run_start = pos
+
+def scan_gcode(buffer, start=0, end=None, scanner=None):
+    """
+    Scans buffer[start:end] (bytes, or an mmap) in SCAN_CHUNK_SIZE slices.
+    Returns the stats dict (see GcodeScanner).
+    """
+    scanner = scanner or GcodeScanner()
+    end = len(buffer) if end is None else end
+    for offset in range(start, end, SCAN_CHUNK_SIZE):
+        scanner.feed(buffer[offset:min(offset + SCAN_CHUNK_SIZE, end)])
+    return scanner.finish()
+
+def scan_gcode_file(path, scanner=None):
+    """Scans a plain G-code file through a read-only memory map. Returns the stats dict."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return (scanner or GcodeScanner()).finish()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return scan_gcode(mapped, scanner=scanner)
@@ -5,6 +5,22 @@ import xml.etree.ElementTree as ET
 import zipfile
 import tempfile
 import re
+import io
+import mmap
+import struct
+import zlib
+import time
+import collections
+import copy
+import json
+import logging
+import contextlib
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from gcode_estimator import GcodeTimeEstimator, JobTimeEstimate
+from gcode_scanner import GcodeScanner, scan_gcode, SCAN_CHUNK_SIZE
 
 # --- CONSTANTS ---
 
@@ -56,8 +72,94 @@ G4 P500; wait
  
 """
 
+# Changes whenever the swap templates above change, so cached outputs built
+# with older templates are never reused.
+SWAP_TEMPLATE_VERSION = hashlib.sha256((SWAP_INIT_GCODE + SWAP_SEQUENCE_GCODE).encode('utf-8')).hexdigest()[:12]
+
+METADATA_PREFIX = "Metadata/"
+# Per-plate and whole-job time estimate written next to the combined G-code
+SWAP_ESTIMATE_NAME = "swap_estimate.json"
+# slice_info.config key for the estimated whole-job time (the 'prediction' header stays as sliced)
+ESTIMATE_METADATA_KEY = "swap_prediction"
+COPY_CHUNK_SIZE = 1024 * 1024
+# Distinct input archives are opened/extracted concurrently on up to this many threads
+SOURCE_WORKERS = 8
+# Plate time estimates remembered per process (keyed by the plate G-code's SHA-256)
+PLATE_ESTIMATE_CACHE_SIZE = 256
+# Source archives a SourceCache keeps open between builds
+SOURCE_CACHE_SIZE = 32
+
+log = logging.getLogger("swaplist.pipeline")
+
+# --- INSTRUMENTATION ---
+
+# Callables receiving every finished span record (metrics, cross-process forwarding)
+_span_listeners = []
+# Per-request list that spans are appended to while collect_spans() is active
+_span_collector = contextvars.ContextVar("swap_span_collector", default=None)
+
+def add_span_listener(listener):
+    """
+    Registers listener(record), called for every finished span.
+    record: {"stage", "duration" (seconds), "error" (bool), plus any span fields such as "bytes"}
+    """
+    _span_listeners.append(listener)
+
+@contextlib.contextmanager
+def collect_spans():
+    """
+    Collects the span records finished in this context (e.g. one HTTP request)
+    into the yielded list. Spans opened on other threads are not collected.
+    """
+    spans = []
+    token = _span_collector.set(spans)
+    try:
+        yield spans
+    finally:
+        _span_collector.reset(token)
+
+@contextlib.contextmanager
+def span(stage, **fields):
+    """
+    Times a pipeline stage. The yielded record can be updated inside the block,
+    e.g. record["bytes"] = n. On exit the span is logged, added to the active
+    collect_spans() list and passed to the span listeners.
+    """
+    record = dict(fields, stage=stage, error=False)
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException:
+        record["error"] = True
+        raise
+    finally:
+        record["duration"] = time.perf_counter() - start
+        extra = "".join(f" {k}={v}" for k, v in record.items() if k not in ("stage", "duration", "error"))
+        log.log(logging.WARNING if record["error"] else logging.INFO,
+                "span stage=%s duration_ms=%.1f%s%s", stage, record["duration"] * 1000,
+                " error=true" if record["error"] else "", extra)
+        collector = _span_collector.get()
+        if collector is not None:
+            collector.append(record)
+        for listener in _span_listeners:
+            try:
+                listener(record)
+            except Exception:
+                log.exception("span listener failed stage=%s", stage)
+
 # --- HELPER FUNCTIONS ---
 
+def _with_trailing_newline(data):
+    return data if data.endswith(b"\n") else data + b"\n"
+
+def report_progress(progress, stage, fraction=None):
+    """
+    Calls an optional progress callback: progress(stage, fraction).
+    fraction is the completed share of the stage (0.0 - 1.0) or None if unknown.
+    """
+    if progress is not None:
+        progress(stage, fraction)
+
 def get_metadata_dir(gcode_path):
     """Returns the parent directory of a G-code file."""
     return os.path.dirname(os.path.abspath(gcode_path))
@@ -70,196 +172,318 @@ def calculate_md5(file_path):
             hash_md5.update(chunk)
     return hash_md5.hexdigest()
 
-def merge_slice_info(playlist, output_config_path):
+_plate_estimates = collections.OrderedDict() # plate G-code SHA-256 -> (plate_seconds, swap_seconds), LRU
+_plate_estimates_lock = threading.Lock()
+
+class JobTimer:
     """
-    Merges slice_info.config from all items in the playlist.
-    Aggregates stats (weight, time, lengths) and combines unique filaments.
+    Fills a JobTimeEstimate while the combined G-code is being written.
+    Plate G-code is parsed on its first copy only. Each swap sequence is costed
+    from the machine state the plate leaves behind. With a key (the plate's
+    SHA-256), plate results are remembered so later builds skip the parse.
     """
-    
-    total_prediction = 0
-    total_weight = 0.0
-    found_index_1_stats = False
-    merged_filaments = {} # Key: id (or type+color), Value: Filament Element (accumulated)
-    
-    # We need a base XML structure. We'll start fresh or use the first valid one.
-    base_tree = None
-    base_root = None
-    
-    print("Merging slice_info.config data...")
+    def __init__(self):
+        self.estimate = JobTimeEstimate()
+        self._init = GcodeTimeEstimator()
+        self._init.feed(SWAP_INIT_GCODE.encode('utf-8'))
+        self.estimate.init_seconds = self._init.finish()
+
+    def lookup(self, key):
+        """Cached (plate_seconds, swap_seconds) for a plate key, or None."""
+        if key is None:
+            return None
+        with _plate_estimates_lock:
+            result = _plate_estimates.get(key)
+            if result is not None:
+                _plate_estimates.move_to_end(key)
+            return result
+
+    def plate_estimator(self):
+        """A fresh estimator to feed one copy of a plate's G-code to."""
+        return self._init.fork()
+
+    def measure(self, estimator, key=None):
+        """Finishes a plate estimator. Returns (plate_seconds, swap_seconds)."""
+        plate_seconds = estimator.finish()
+        swap = estimator.fork()
+        swap.feed(_with_trailing_newline(SWAP_SEQUENCE_GCODE.encode('utf-8')))
+        result = (plate_seconds, swap.finish())
+        if key is not None:
+            with _plate_estimates_lock:
+                _plate_estimates[key] = result
+                _plate_estimates.move_to_end(key)
+                while len(_plate_estimates) > PLATE_ESTIMATE_CACHE_SIZE:
+                    _plate_estimates.popitem(last=False)
+        return result
 
-    import re
+    def add(self, source, gcode_name, count, seconds):
+        self.estimate.add_plate(source, gcode_name, count, *seconds)
 
+_swap_sequence_seconds = None
+
+def swap_sequence_seconds():
+    """
+    Estimated seconds of one swap sequence, costed like JobTimer does but from
+    the state SWAP_INIT_GCODE leaves behind. Per-job estimates start it where
+    each plate ends, which moves it by a few seconds.
+    """
+    global _swap_sequence_seconds
+    if _swap_sequence_seconds is None:
+        timer = JobTimer()
+        _swap_sequence_seconds = timer.measure(timer.plate_estimator())[1]
+    return _swap_sequence_seconds
+
+def merge_slice_info(playlist, output_config_path, estimated_seconds=None):
+    """
+    Merges slice_info.config from all items in the playlist.
+    Aggregates stats (weight, time, lengths) and combines unique filaments.
+    estimated_seconds: Optional whole-job estimate, see merge_slice_info_configs.
+    """
+    configs = []
     for gcode_path, count in playlist:
         src_dir = get_metadata_dir(gcode_path)
         config_path = os.path.join(src_dir, "slice_info.config")
         
         if not os.path.exists(config_path):
-            print(f"Warning: No slice_info.config found for {gcode_path}")
+            log.warning("no slice_info.config gcode=%s", gcode_path)
             continue
-            
-        tree = ET.parse(config_path)
-        root = tree.getroot()
         
-        # Identify the plate index from filename (e.g. plate_1.gcode -> 1)
-        filename = os.path.basename(gcode_path)
-        match = re.search(r"plate_(\d+)", filename)
-        target_index = match.group(1) if match else None
-        
-        if base_tree is None:
-            # We must parse a fresh copy for the base template so we don't modify 'tree' which we need to read from!
-            base_tree = ET.parse(config_path)
-            base_root = base_tree.getroot()
-            
-            # Ensure we start with a CLEAN single plate structure
-            # Remove all existing plates except the first one
-            plates = base_root.findall('plate')
-            for i, p in enumerate(plates):
-                if i > 0:
-                    base_root.remove(p)
-            
-            target_plate = base_root.find('plate')
-            if target_plate is None:
-                base_tree = None 
-                continue
-                
-            # Clear filaments to rebuild
-            for fil in target_plate.findall('filament'):
-                target_plate.remove(fil)
-            
-            # Force Index to 1 (Swap file convention)
-            for meta in target_plate.findall('metadata'):
-                if meta.get('key') == 'index':
-                    meta.set('value', '1')
-                
-        # Iterate through plates in the config
-        # If we have a target_index, we ONLY process that plate.
-        
-        found_plate = False
+        configs.append((config_path, os.path.basename(gcode_path), count))
+    
+    merge_slice_info_configs(configs, output_config_path, estimated_seconds)
+
+def _parse_config(source):
+    """Parses an XML config given either a file path or its raw bytes."""
+    if isinstance(source, bytes):
+        return ET.parse(io.BytesIO(source))
+    return ET.parse(source)
+
+def merge_slice_info_configs(configs, output_config, estimated_seconds=None):
+    """
+    Merges slice_info.config sources into a single swap config.
+    configs: List of tuples (config_source, gcode_filename, count), where config_source
+    is a path or the raw bytes of a slice_info.config.
+    output_config: Path or binary file object to write the merged config to.
+    estimated_seconds: Optional whole-job time estimate, written as an extra
+    ESTIMATE_METADATA_KEY plate metadata entry.
+    Returns True if a merged config was written.
+    """
+    with span("slice_info", configs=len(configs)):
+        merger = SliceInfoMerger()
+        for config_source, filename, count in configs:
+            merger.add(config_source, filename, count)
+        return merger.write(output_config, estimated_seconds)
+
+class _ParsedSliceInfo:
+    """
+    A slice_info.config parsed once, with its plates pre-extracted and indexed.
+    Each plate is (plate_index, prediction, weight, filaments), filaments being
+    (attrib, used_m, used_g) with the usage already converted to floats.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.plates = []
+        self._by_index = {}
+        self._matches = {}
         
-        for plate in root.findall('plate'):
-            # Check index metadata
+        for position, plate in enumerate(root.findall('plate')):
             plate_index = None
-            for meta in plate.findall('metadata'):
-                if meta.get('key') == 'index':
-                    plate_index = meta.get('value')
-                    break
-            
-            if target_index and plate_index and target_index != plate_index:
-                continue # Skip non-matching plates
-            
-            found_plate = True
-            
-            # --- UPDATE: Header Stats Logic ---
-            # The reference file 'Metadata - Inverted + More Prints' shows that even if Plate 2 is printed first,
-            # the slice_info header statistics (Prediction/Weight) reflect Plate 1 (Index 1).
-            # So, we should prioritize Metadata from Plate 1.
-            
-            # Logic:
-            # - If this plate is Index 1, we captures its stats as the Authority.
-            # - If we haven't found an Authority yet, we take the First Plate's stats as a fallback.
-            # - Overwrite fallback if we find Plate 1 later.
-            
             prediction = 0
             weight = 0.0
-            
             for meta in plate.findall('metadata'):
                 key = meta.get('key')
-                val = meta.get('value')
-                if key == 'prediction':
-                    prediction = int(val)
+                if key == 'index' and plate_index is None:
+                    plate_index = meta.get('value')
+                elif key == 'prediction':
+                    prediction = int(meta.get('value'))
                 elif key == 'weight':
-                    weight = float(val)
-            
-            # Capture if:
-            # 1. We have nothing yet (Fallback to first item).
-            # 2. OR This is Plate 1 (Index 1), which overrides any fallback.
+                    weight = float(meta.get('value'))
             
+            filaments = [
+                (filament.attrib, float(filament.get('used_m', 0.0)), float(filament.get('used_g', 0.0)))
+                for filament in plate.findall('filament')
+            ]
+            self.plates.append((plate_index, prediction, weight, filaments))
+            self._by_index.setdefault(plate_index, []).append(position)
+
+    def matching_plates(self, target_index):
+        """
+        Plates used for a target index, in document order: the plate(s) with that
+        index plus any plate without an index. No target means all plates.
+        """
+        if not target_index:
+            return self.plates
+        if target_index not in self._matches:
+            positions = self._by_index.get(target_index, []) + self._by_index.get(None, [])
+            self._matches[target_index] = [self.plates[p] for p in sorted(positions)]
+        return self._matches[target_index]
+
+class SliceInfoMerger:
+    """
+    Accumulates slice_info.config data for a playlist and writes the merged
+    swap config once at the end.
+    Each distinct config is parsed once, plates are looked up by index and
+    filament usage is summed numerically (rounded to 2 decimals after each
+    addition, exactly like the string round trip the output has always used).
+    """
+    def __init__(self):
+        self._parsed = {}
+        self._base_root = None
+        self.total_prediction = 0
+        self.total_weight = 0.0
+        self._found_index_1_stats = False
+        self._filaments = {} # Key: id, Value: [attrib, used_m, used_g, additions]
+
+    def _parse(self, config_source):
+        # Paths and bytes are both hashable, so they key the parse cache directly
+        parsed = self._parsed.get(config_source)
+        if parsed is None:
+            parsed = _ParsedSliceInfo(_parse_config(config_source).getroot())
+            self._parsed[config_source] = parsed
+        return parsed
+
+    def _init_base(self, parsed):
+        """
+        Builds the output template from the first config: a CLEAN single plate
+        structure with no filaments and index 1 (Swap file convention).
+        Returns False if the config has no plate to use.
+        """
+        plates = parsed.root.findall('plate')
+        if not plates:
+            return False
+        
+        base_root = ET.Element(parsed.root.tag, parsed.root.attrib)
+        base_root.text, base_root.tail = parsed.root.text, parsed.root.tail
+        for child in parsed.root:
+            if child.tag == 'plate' and child is not plates[0]:
+                continue
+            base_root.append(copy.deepcopy(child))
+        
+        target_plate = base_root.find('plate')
+        for fil in target_plate.findall('filament'):
+            target_plate.remove(fil)
+        for meta in target_plate.findall('metadata'):
+            if meta.get('key') == 'index':
+                meta.set('value', '1')
+        
+        self._base_root = base_root
+        return True
+
+    def add(self, config_source, filename, count):
+        """
+        Adds one playlist item: the plate matching `filename` (plate_N.gcode), `count` times.
+        """
+        parsed = self._parse(config_source)
+        
+        if self._base_root is None and not self._init_base(parsed):
+            return
+        
+        # Identify the plate index from filename (e.g. plate_1.gcode -> 1)
+        match = re.search(r"plate_(\d+)", filename)
+        target_index = match.group(1) if match else None
+        
+        plates = parsed.matching_plates(target_index)
+        if not plates:
+            log.warning("plate index not in slice_info plate=%s gcode=%s", target_index, filename)
+            return
+        
+        for plate_index, prediction, weight, filaments in plates:
+            # Header stats reflect Plate 1 (Index 1) when it is in the playlist,
+            # otherwise the first plate (see the reference 'Inverted + More Prints').
             is_index_1 = (plate_index == '1')
             
-            if total_weight == 0.0:
-                total_prediction = prediction
-                total_weight = weight
+            if self.total_weight == 0.0:
+                self.total_prediction = prediction
+                self.total_weight = weight
                 if is_index_1:
-                    found_index_1_stats = True
-            elif is_index_1 and not found_index_1_stats:
-                # Found Plate 1 later in the playlist, override!
-                total_prediction = prediction
-                total_weight = weight
-                found_index_1_stats = True
+                    self._found_index_1_stats = True
+            elif is_index_1 and not self._found_index_1_stats:
+                self.total_prediction = prediction
+                self.total_weight = weight
+                self._found_index_1_stats = True
             
             # Process filaments (Always Sum)
-            for filament in plate.findall('filament'):
-                f_id = filament.get('id')
-                f_type = filament.get('type')
-                f_color = filament.get('color')
-                
-                key = f_id
-                
-                used_m = float(filament.get('used_m', 0.0)) * count
-                used_g = float(filament.get('used_g', 0.0)) * count
+            for attrib, used_m, used_g in filaments:
+                key = attrib.get('id')
+                used_m *= count
+                used_g *= count
                 
-                if key not in merged_filaments:
-                    new_el = ET.Element('filament')
-                    new_el.set('id', f_id)
-                    new_el.set('type', f_type)
-                    new_el.set('color', f_color)
-                    if filament.get('tray_info_idx'):
-                        new_el.set('tray_info_idx', filament.get('tray_info_idx'))
-                        
-                    new_el.set('used_m', str(used_m))
-                    new_el.set('used_g', str(used_g))
-                    merged_filaments[key] = new_el
+                entry = self._filaments.get(key)
+                if entry is None:
+                    self._filaments[key] = [attrib, used_m, used_g, 1]
                 else:
-                    current_el = merged_filaments[key]
-                    cur_m = float(current_el.get('used_m'))
-                    cur_g = float(current_el.get('used_g'))
-                    
-                    current_el.set('used_m', f"{cur_m + used_m:.2f}")
-                    current_el.set('used_g', f"{cur_g + used_g:.2f}")
+                    entry[1] = round(entry[1] + used_m, 2)
+                    entry[2] = round(entry[2] + used_g, 2)
+                    entry[3] += 1
 
-        if not found_plate:
-            print(f"Warning: Could not match plate index {target_index} in config for {filename}")
-    
-    # Write back to Base Tree
-    if base_tree is None:
-        print("Error: Could not parse any slice_info.config files.")
-        return
+    def _filament_element(self, attrib, used_m, used_g, additions):
+        el = ET.Element('filament')
+        el.set('id', attrib.get('id'))
+        el.set('type', attrib.get('type'))
+        el.set('color', attrib.get('color'))
+        if attrib.get('tray_info_idx'):
+            el.set('tray_info_idx', attrib.get('tray_info_idx'))
+        # A filament used once keeps its full precision; sums are written with 2 decimals
+        el.set('used_m', str(used_m) if additions == 1 else f"{used_m:.2f}")
+        el.set('used_g', str(used_g) if additions == 1 else f"{used_g:.2f}")
+        return el
 
-    target_plate = base_root.find('plate')
-    
-    # Update Metadata (Prediction/Weight)
-    found_pred = False
-    found_weight = False
-    
-    for meta in target_plate.findall('metadata'):
-        key = meta.get('key')
-        if key == 'prediction':
-            meta.set('value', str(total_prediction))
-            found_pred = True
-        elif key == 'weight':
-            meta.set('value', f"{total_weight:.2f}")
-            found_weight = True
+    def write(self, output_config, estimated_seconds=None):
+        """
+        Serializes the merged config to a path or binary file object.
+        estimated_seconds: Optional whole-job estimate (ESTIMATE_METADATA_KEY).
+        Returns True if a config was written.
+        """
+        if self._base_root is None:
+            log.error("could not parse any slice_info.config files")
+            return False
+        
+        target_plate = self._base_root.find('plate')
+        
+        # Update Metadata (Prediction/Weight)
+        found_pred = False
+        found_weight = False
+        
+        for meta in target_plate.findall('metadata'):
+            key = meta.get('key')
+            if key == 'prediction':
+                meta.set('value', str(self.total_prediction))
+                found_pred = True
+            elif key == 'weight':
+                meta.set('value', f"{self.total_weight:.2f}")
+                found_weight = True
+                
+        if not found_pred:
+            wm = ET.SubElement(target_plate, 'metadata')
+            wm.set('key', 'prediction')
+            wm.set('value', str(self.total_prediction))
             
-    if not found_pred:
-        wm = ET.SubElement(target_plate, 'metadata')
-        wm.set('key', 'prediction')
-        wm.set('value', str(total_prediction))
+        if not found_weight:
+            wm = ET.SubElement(target_plate, 'metadata')
+            wm.set('key', 'weight')
+            wm.set('value', f"{self.total_weight:.2f}")
         
-    if not found_weight:
-        wm = ET.SubElement(target_plate, 'metadata')
-        wm.set('key', 'weight')
-        wm.set('value', f"{total_weight:.2f}")
-
-    # Append Merged Filaments
-    # Sort by ID for consistency
-    sorted_keys = sorted(merged_filaments.keys(), key=lambda x: int(x) if x.isdigit() else x)
-    
-    for k in sorted_keys:
-        target_plate.append(merged_filaments[k])
-
-    # Save
-    base_tree.write(output_config_path, encoding='UTF-8', xml_declaration=True)
-    print(f"Updated slice_info.config: {total_weight:.2f}g (First Plate), Matches Reference Behavior.")
+        # Whole-job estimate: a key of its own, 'prediction' keeps the sliced value
+        if estimated_seconds is not None:
+            estimate_meta = None
+            for meta in target_plate.findall('metadata'):
+                if meta.get('key') == ESTIMATE_METADATA_KEY:
+                    estimate_meta = meta
+            if estimate_meta is None:
+                estimate_meta = ET.SubElement(target_plate, 'metadata')
+                estimate_meta.set('key', ESTIMATE_METADATA_KEY)
+            estimate_meta.set('value', str(estimated_seconds))
+        
+        # Append Merged Filaments
+        # Sort by ID for consistency
+        sorted_keys = sorted(self._filaments.keys(), key=lambda x: int(x) if x.isdigit() else x)
+        
+        for k in sorted_keys:
+            target_plate.append(self._filament_element(*self._filaments[k]))
+        
+        ET.ElementTree(self._base_root).write(output_config, encoding='UTF-8', xml_declaration=True)
+        log.info("merged slice_info.config weight_g=%.2f", self.total_weight)
+        return True
 
 
 def copy_assets(playlist, output_dir):
@@ -269,7 +493,7 @@ def copy_assets(playlist, output_dir):
     """
     processed_files = set()
     
-    print("Copying assets from source directories...")
+    log.info("copying assets from source directories")
     
     # We want to ensure we copy the model_settings.config from the FIRST item as a base template if possible,
     # or rely on `update_model_settings` to fix it later.
@@ -325,7 +549,7 @@ def copy_assets(playlist, output_dir):
                  if not os.path.exists(d):
                      shutil.copy2(s, d)
 
-    print("Assets copied.")
+    log.info("assets copied files=%d", len(os.listdir(output_dir)))
 
 def generate_swap_gcode_content(playlist):
     """
@@ -337,10 +561,10 @@ def generate_swap_gcode_content(playlist):
     total_items = 0
     for obj_path, count in playlist:
         if not os.path.exists(obj_path):
-            print(f"Warning: File not found: {obj_path}, skipping.")
+            log.warning("gcode not found, skipping path=%s", obj_path)
             continue
         
-        print(f"Processing {count} copies of: {os.path.basename(obj_path)}")
+        log.info("adding gcode copies=%d file=%s", count, os.path.basename(obj_path))
         
         with open(obj_path, 'r', encoding='utf-8') as obj_f:
             obj_content = obj_f.read()
@@ -359,6 +583,98 @@ def generate_swap_gcode_content(playlist):
     return "".join(gcode_content)
 
 
+def _write_all(fd, data):
+    """Writes all of data to a raw file descriptor."""
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+def _copy_file_to_fd(src_fd, size, dst_fd, hash_md5, state, estimator=None):
+    """
+    Appends the first `size` bytes of src_fd to dst_fd, feeding them to hash_md5
+    (and to estimator, a GcodeTimeEstimator, if given).
+    Each chunk is hashed from the page cache and copied kernel-side with
+    os.copy_file_range; if the kernel or filesystem refuses (or the platform
+    lacks it) we fall back to writing the chunk we already read.
+    state: Dict shared across calls to remember that kernel copies are unavailable.
+    """
+    offset = 0
+    while offset < size:
+        chunk = os.pread(src_fd, min(COPY_CHUNK_SIZE, size - offset), offset)
+        if not chunk:
+            raise IOError("Source G-code shrank while it was being copied")
+        hash_md5.update(chunk)
+        if estimator is not None:
+            estimator.feed(chunk)
+        
+        copied = 0
+        if state.get("kernel_copy", True):
+            try:
+                while copied < len(chunk):
+                    n = os.copy_file_range(src_fd, dst_fd, len(chunk) - copied, offset + copied)
+                    if n == 0:
+                        break
+                    copied += n
+            except (AttributeError, OSError):
+                state["kernel_copy"] = False
+        
+        if copied < len(chunk):
+            _write_all(dst_fd, chunk[copied:])
+        offset += len(chunk)
+    return size
+
+def write_swap_gcode(playlist, output_gcode_path, timer=None):
+    """
+    Streams the combined G-code file to disk and returns its MD5 hex digest.
+    Memory stays flat regardless of plate size or copy count: plate G-code is
+    copied in chunks (kernel-side where possible) and hashed in the same pass,
+    so the output never has to be read back.
+    timer: Optional JobTimer to fill with per-plate time estimates.
+    """
+    init_bytes = SWAP_INIT_GCODE.encode('utf-8')
+    swap_bytes = _with_trailing_newline(SWAP_SEQUENCE_GCODE.encode('utf-8'))
+    
+    hash_md5 = hashlib.md5()
+    copy_state = {}
+    
+    dst_fd = os.open(output_gcode_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        _write_all(dst_fd, init_bytes)
+        hash_md5.update(init_bytes)
+        
+        for obj_path, count in playlist:
+            if not os.path.exists(obj_path):
+                log.warning("gcode not found, skipping path=%s", obj_path)
+                continue
+            
+            log.info("adding gcode copies=%d file=%s", count, os.path.basename(obj_path))
+            
+            src_fd = os.open(obj_path, os.O_RDONLY)
+            try:
+                size = os.fstat(src_fd).st_size
+                needs_newline = size == 0 or os.pread(src_fd, 1, size - 1) != b"\n"
+                
+                estimator = timer.plate_estimator() if timer is not None else None
+                for i in range(count):
+                    _copy_file_to_fd(src_fd, size, dst_fd, hash_md5, copy_state, estimator if i == 0 else None)
+                    if needs_newline:
+                        _write_all(dst_fd, b"\n")
+                        hash_md5.update(b"\n")
+                    
+                    _write_all(dst_fd, swap_bytes)
+                    hash_md5.update(swap_bytes)
+                
+                if timer is not None:
+                    timer.add(None, os.path.basename(obj_path), count, timer.measure(estimator))
+            finally:
+                os.close(src_fd)
+    finally:
+        os.close(dst_fd)
+    
+    return hash_md5.hexdigest()
+
+
 def update_model_settings(config_path):
     """
     Updates the model_settings.config to identify as a Swap plate.
@@ -369,8 +685,13 @@ def update_model_settings(config_path):
         return
 
     tree = ET.parse(config_path)
-    root = tree.getroot()
-    
+    apply_swap_model_settings(tree.getroot())
+    tree.write(config_path, encoding='UTF-8', xml_declaration=True)
+
+def apply_swap_model_settings(root):
+    """
+    Applies the Swap plate changes to a parsed model_settings.config root in place.
+    """
     # 1. Keep only the first plate
     plates = root.findall('plate')
     for i, p in enumerate(plates):
@@ -406,44 +727,381 @@ def update_model_settings(config_path):
         
         for item in to_remove:
             plate.remove(item)
-             
-    tree.write(config_path, encoding='UTF-8', xml_declaration=True)
 
 def create_swap_metadata(playlist, output_dir):
     """
     Creates the complete Swap Metadata folder.
+    Returns the job time estimate (JobTimeEstimate.to_dict()).
     """
     if os.path.exists(output_dir):
         shutil.rmtree(output_dir)
     os.makedirs(output_dir)
     
-    print(f"Created output directory: {output_dir}")
+    log.info("created output directory path=%s", output_dir)
 
     # 1. Copy Assets
-    copy_assets(playlist, output_dir)
+    with span("assets"):
+        copy_assets(playlist, output_dir)
 
-    # 2. Generate Combined G-code
+    # 2. Generate Combined G-code (streamed, MD5 computed in the same pass)
     output_gcode_path = os.path.join(output_dir, "plate_1.gcode")
-    gcode_content = generate_swap_gcode_content(playlist)
+    timer = JobTimer()
+    with span("gcode") as record:
+        md5_hash = write_swap_gcode(playlist, output_gcode_path, timer)
+        record["bytes"] = os.path.getsize(output_gcode_path)
     
-    with open(output_gcode_path, 'w', encoding='utf-8') as f:
-        f.write(gcode_content)
-    
-    print(f"Generated combined G-code at {output_gcode_path}")
+    log.info("generated combined gcode path=%s", output_gcode_path)
 
-    # 3. Generate MD5 for the new G-code
-    md5_hash = calculate_md5(output_gcode_path)
+    # 3. Write MD5 for the new G-code
     with open(output_gcode_path + ".md5", 'w', encoding='utf-8') as f:
         f.write(md5_hash)
-    print("Generated MD5 checksum.")
 
     # 4. Update model_settings.config
     output_model_settings = os.path.join(output_dir, "model_settings.config")
-    update_model_settings(output_model_settings)
+    with span("model_settings"):
+        update_model_settings(output_model_settings)
 
     # 5. Merge slice_info.config
     output_slice_info = os.path.join(output_dir, "slice_info.config")
-    merge_slice_info(playlist, output_slice_info)
+    merge_slice_info(playlist, output_slice_info, timer.estimate.total_seconds)
+    
+    # 6. Time estimate
+    estimate = timer.estimate.to_dict()
+    with open(os.path.join(output_dir, SWAP_ESTIMATE_NAME), 'w', encoding='utf-8') as f:
+        json.dump(estimate, f, indent=2)
+    return estimate
+
+# --- PARALLEL DEFLATE ---
+
+DEFAULT_COMPRESS_LEVEL = 6
+DEFLATE_BLOCK_SIZE = 4 * 1024 * 1024
+DEFLATE_DICT_SIZE = 32 * 1024 # deflate window; each block is primed with the previous block's tail
+
+COMPRESS_STRATEGIES = {
+    "default": zlib.Z_DEFAULT_STRATEGY,
+    "filtered": zlib.Z_FILTERED,
+    "huffman": zlib.Z_HUFFMAN_ONLY,
+    "rle": zlib.Z_RLE,
+}
+
+# Empty final block (BFINAL=1, fixed Huffman, end-of-block) closing a stream of sync-flushed blocks
+DEFLATE_END_BLOCK = b"\x03\x00"
+
+def _deflate_block(data, level, strategy, zdict):
+    """
+    Compresses one block into raw deflate data ending on a byte boundary without
+    the final-block bit, so independently compressed blocks can be concatenated.
+    """
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, 8, strategy, zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, 8, strategy)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+class ParallelDeflater:
+    """
+    Raw deflate of a byte stream into a file object, compressing fixed-size blocks
+    on a thread pool (zlib releases the GIL) and writing them in order, like pigz.
+    Every block ends on a byte boundary without the final-block bit, so whoever
+    ends the stream appends DEFLATE_END_BLOCK, and other such data may follow
+    flush(). Tracks the CRC-32 and size of what was written.
+    """
+    def __init__(self, fp, level=DEFAULT_COMPRESS_LEVEL, strategy="default", workers=None,
+                 block_size=DEFLATE_BLOCK_SIZE):
+        if strategy not in COMPRESS_STRATEGIES:
+            raise ValueError(f"Unknown compression strategy: {strategy}")
+        self.fp = fp
+        self.level = level
+        self.strategy = COMPRESS_STRATEGIES[strategy]
+        self.block_size = block_size
+        self.workers = workers or os.cpu_count() or 1
+        self.crc = 0
+        self.size = 0
+        self.compressed_size = 0
+
+        self._pending = bytearray()
+        self._previous_tail = b""
+        self._futures = collections.deque()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+
+    def _submit_block(self, block):
+        zdict = self._previous_tail
+        self._previous_tail = bytes(block[-DEFLATE_DICT_SIZE:])
+        self._futures.append(self._executor.submit(_deflate_block, bytes(block), self.level, self.strategy, zdict))
+        # Bound memory: keep at most two blocks per worker in flight
+        while len(self._futures) > self.workers * 2:
+            self._write_compressed(self._futures.popleft().result())
+
+    def _write_compressed(self, data):
+        self.fp.write(data)
+        self.compressed_size += len(data)
+
+    def write(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        self._pending += data
+        while len(self._pending) >= self.block_size:
+            self._submit_block(self._pending[:self.block_size])
+            del self._pending[:self.block_size]
+        return len(data)
+
+    def flush(self):
+        """
+        Writes out everything written so far. The next block starts without a
+        dictionary, so the output written up to here doesn't have to stay
+        adjacent to what follows.
+        """
+        if self._pending:
+            self._submit_block(self._pending)
+            self._pending = bytearray()
+        while self._futures:
+            self._write_compressed(self._futures.popleft().result())
+        self._previous_tail = b""
+
+    def close(self):
+        self.flush()
+        self._executor.shutdown(wait=True)
+
+    def abort(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+class ParallelDeflateWriter:
+    """
+    Writes one ZIP_DEFLATED member through a ParallelDeflater. The result is a
+    single standard deflate stream, so any unzip implementation can read it.
+    Precompressed DeflateSegments can be spliced in between writes.
+    Use through open_deflate_member(); it must be closed before the archive is
+    written to again.
+    """
+    def __init__(self, zout, arcname, level=DEFAULT_COMPRESS_LEVEL, strategy="default",
+                 force_zip64=False, workers=None, block_size=DEFLATE_BLOCK_SIZE):
+        self.zout = zout
+        self.zip64 = force_zip64
+        self._deflater = ParallelDeflater(zout.fp, level, strategy, workers, block_size)
+
+        self.zinfo = zipfile.ZipInfo(arcname, time.localtime(time.time())[:6])
+        self.zinfo.compress_type = zipfile.ZIP_DEFLATED
+        self.zinfo.external_attr = 0o600 << 16
+        self.zinfo.file_size = 0
+        self.zinfo.compress_size = 0
+        self.zinfo.CRC = 0
+
+        self._crc = 0
+        self._spliced_size = 0
+        self._closed = False
+
+        zout._writecheck(self.zinfo)
+        zout._didModify = True
+        self.zinfo.header_offset = zout.fp.tell()
+        zout.fp.write(self.zinfo.FileHeader(self.zip64))
+        self._data_offset = zout.fp.tell()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._deflater.abort()
+
+    def write(self, data):
+        self._crc = zlib.crc32(data, self._crc)
+        self.zinfo.file_size += len(data)
+        return self._deflater.write(data)
+
+    def write_segment(self, segment):
+        """Splices a precompressed DeflateSegment in at the current position, without recompressing it."""
+        self._deflater.flush()
+        self._spliced_size += segment.copy_to(self.zout.fp)
+        self._crc = crc32_combine(self._crc, segment.crc, segment.size)
+        self.zinfo.file_size += segment.size
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._deflater.close()
+        self.zout.fp.write(DEFLATE_END_BLOCK)
+
+        zinfo = self.zinfo
+        zinfo.CRC = self._crc
+        zinfo.compress_size = self._deflater.compressed_size + self._spliced_size + len(DEFLATE_END_BLOCK)
+        if not self.zip64 and max(zinfo.file_size, zinfo.compress_size) > zipfile.ZIP64_LIMIT:
+            raise RuntimeError(f"{zinfo.filename} is too large for a non-zip64 entry; pass force_zip64")
+
+        # Rewrite the local header now that CRC and sizes are known
+        end = self.zout.fp.tell()
+        self.zout.fp.seek(zinfo.header_offset)
+        self.zout.fp.write(zinfo.FileHeader(self.zip64))
+        self.zout.fp.seek(end)
+
+        self.zout.filelist.append(zinfo)
+        self.zout.NameToInfo[zinfo.filename] = zinfo
+        self.zout.start_dir = end
+
+def open_deflate_member(zout, arcname, expected_size=0, level=DEFAULT_COMPRESS_LEVEL, strategy="default"):
+    """
+    Opens a ParallelDeflateWriter for a (potentially large) output member.
+    expected_size: Upper bound of the uncompressed size, used to decide on zip64.
+    """
+    # Deflate can expand incompressible data slightly; leave headroom for that.
+    return ParallelDeflateWriter(zout, arcname, level, strategy,
+                                 force_zip64=expected_size * 1.01 + 1024 > zipfile.ZIP64_LIMIT)
+
+# --- PRECOMPRESSED SEGMENTS ---
+
+# Plate G-code deflated once and spliced into every output that repeats it
+SEGMENT_CACHE_DIR = os.path.abspath(os.environ.get("SWAPLIST_SEGMENT_DIR", os.path.join(tempfile.gettempdir(), "swap_segments")))
+# Segment file header: magic, CRC-32 and size of the uncompressed data, SHA-256 of it
+_SEGMENT_HEADER = struct.Struct("<4sIQ32s")
+_SEGMENT_MAGIC = b"SWS1"
+
+_CRC32_POLY = 0xEDB88320 # reflected
+
+def _crc32_multmodp(a, b):
+    # a * b modulo the CRC-32 polynomial (bit-reflected, as in zlib's crc32.c)
+    m = 1 << 31
+    p = 0
+    while True:
+        if a & m:
+            p ^= b
+            if a & (m - 1) == 0:
+                break
+        m >>= 1
+        b = (b >> 1) ^ _CRC32_POLY if b & 1 else b >> 1
+    return p
+
+# x^(2^n) modulo the polynomial, for n = 0..31
+_CRC32_X2N = [1 << 30]
+for _ in range(31):
+    _CRC32_X2N.append(_crc32_multmodp(_CRC32_X2N[-1], _CRC32_X2N[-1]))
+
+def crc32_combine(crc1, crc2, len2):
+    """
+    CRC-32 of A + B from crc1 = crc32(A), crc2 = crc32(B) and len2 = len(B),
+    without touching the data (zlib's crc32_combine, which Python doesn't expose).
+    """
+    # crc1 * x^(8 * len2), then add crc2
+    p = 1 << 31 # x^0
+    n, k = len2, 3
+    while n:
+        if n & 1:
+            p = _crc32_multmodp(_CRC32_X2N[k & 31], p)
+        n >>= 1
+        k += 1
+    return _crc32_multmodp(p, crc1) ^ crc2
+
+class DeflateSegment:
+    """
+    Raw deflate data that decompresses to `size` bytes with CRC-32 `crc`: whole
+    sync-flushed blocks referencing nothing before their start, so it can be
+    spliced into any deflate stream (ParallelDeflateWriter.write_segment).
+    The data is held in memory (`data`) or read from an open segment file.
+    """
+    def __init__(self, crc, size, digest=None, data=None, file=None, offset=0):
+        self.crc = crc
+        self.size = size
+        self.digest = digest
+        self.data = data
+        self.file = file
+        self.offset = offset
+
+    def copy_to(self, fp):
+        """Writes the compressed data to fp; returns its length."""
+        if self.data is not None:
+            fp.write(self.data)
+            return len(self.data)
+        copied = 0
+        self.file.seek(self.offset)
+        for chunk in iter(lambda: self.file.read(COPY_CHUNK_SIZE), b""):
+            fp.write(chunk)
+            copied += len(chunk)
+        return copied
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+_precompressed = {}
+_precompressed_lock = threading.Lock()
+
+def precompressed_segment(data, level=DEFAULT_COMPRESS_LEVEL, strategy="default"):
+    """Returns `data` (a small constant such as the swap block) as an in-memory DeflateSegment, compressed once per process."""
+    key = (data, level, strategy)
+    with _precompressed_lock:
+        segment = _precompressed.get(key)
+    if segment is None:
+        segment = DeflateSegment(zlib.crc32(data), len(data),
+                                 data=_deflate_block(data, level, COMPRESS_STRATEGIES[strategy], None))
+        with _precompressed_lock:
+            _precompressed[key] = segment
+    return segment
+
+class SegmentCache:
+    """
+    Plate G-code deflated once, kept as segment files in `directory` so every
+    later copy of the plate (in this build, later builds and other processes
+    sharing the directory) is spliced in instead of compressed again.
+    Files are named by the source member's CRC-32 and size plus the compression
+    settings; each holds the SHA-256 of its content, checked against the plate
+    bytes before a cached segment is used.
+    """
+    def __init__(self, directory=SEGMENT_CACHE_DIR):
+        self.directory = directory
+
+    def _path(self, info, level, strategy):
+        return os.path.join(self.directory, f"{info.CRC:08x}-{info.file_size}-{level}-{strategy}.seg")
+
+    def get(self, info, level=DEFAULT_COMPRESS_LEVEL, strategy="default"):
+        """Returns the cached DeflateSegment for a source member (caller closes it), or None."""
+        path = self._path(info, level, strategy)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        header = f.read(_SEGMENT_HEADER.size)
+        if len(header) < _SEGMENT_HEADER.size or not header.startswith(_SEGMENT_MAGIC):
+            f.close()
+            return None
+        _, crc, size, digest = _SEGMENT_HEADER.unpack(header)
+        with contextlib.suppress(OSError):
+            os.utime(path) # recently used, for the janitor's LRU
+        return DeflateSegment(crc, size, digest, file=f, offset=_SEGMENT_HEADER.size)
+
+    def build(self, info, chunks, level=DEFAULT_COMPRESS_LEVEL, strategy="default"):
+        """
+        Compresses `chunks` (the member's plate G-code, as spliced into outputs)
+        into a segment file, in parallel. Returns the open DeflateSegment.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(info, level, strategy)
+        fd, tmp_path = tempfile.mkstemp(prefix=".segment_", dir=self.directory)
+        f = os.fdopen(fd, "w+b")
+        try:
+            digest = hashlib.sha256()
+            deflater = ParallelDeflater(f, level, strategy)
+            f.write(bytes(_SEGMENT_HEADER.size))
+            try:
+                for chunk in chunks:
+                    deflater.write(chunk)
+                    digest.update(chunk)
+            except BaseException:
+                deflater.abort()
+                raise
+            deflater.close()
+            f.seek(0)
+            f.write(_SEGMENT_HEADER.pack(_SEGMENT_MAGIC, deflater.crc, deflater.size, digest.digest()))
+            f.flush()
+            os.replace(tmp_path, path)
+        except BaseException:
+            f.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        log.info("built deflate segment path=%s bytes=%d compressed_bytes=%d", path, deflater.size,
+                 deflater.compressed_size)
+        return DeflateSegment(deflater.crc, deflater.size, digest.digest(), file=f, offset=_SEGMENT_HEADER.size)
 
 # --- 3MF SUPPORT ---
 
@@ -452,38 +1110,609 @@ def extract_3mf_to_temp(threemf_path):
     Extracts a 3MF file to a temporary directory and returns the path.
     """
     temp_dir = tempfile.mkdtemp(prefix="swap_extract_")
-    with zipfile.ZipFile(threemf_path, 'r') as zip_ref:
-        zip_ref.extractall(temp_dir)
+    try:
+        with zipfile.ZipFile(threemf_path, 'r') as zip_ref:
+            zip_ref.extractall(temp_dir)
+    except Exception:
+        shutil.rmtree(temp_dir)
+        raise
     return temp_dir
 
-def zip_directory(folder_path, output_path):
+def zip_directory(folder_path, output_path, compress_level=DEFAULT_COMPRESS_LEVEL, compress_strategy="default"):
     """
     Zips the contents of a folder into a standard zip file (renamed to .3mf).
+    Files larger than one deflate block are compressed in parallel.
     """
-    with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+    with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=compress_level) as zipf:
         for root, dirs, files in os.walk(folder_path):
             for file in files:
                 file_path = os.path.join(root, file)
                 # Archive name should be relative to folder_path
                 arcname = os.path.relpath(file_path, folder_path)
-                zipf.write(file_path, arcname)
+                size = os.path.getsize(file_path)
+                if size <= DEFLATE_BLOCK_SIZE and compress_strategy == "default":
+                    zipf.write(file_path, arcname)
+                    continue
+                with open(file_path, 'rb') as src, \
+                        open_deflate_member(zipf, arcname, size, compress_level, compress_strategy) as dst:
+                    for chunk in iter(lambda: src.read(DEFLATE_BLOCK_SIZE), b""):
+                        dst.write(chunk)
+
+class _MappedFile(mmap.mmap):
+    """A read-only mmap that zipfile accepts as a file object (it probes seekable())."""
+    def seekable(self):
+        return True
+
+class SourceArchive:
+    """
+    An input 3MF opened for reading, with its Metadata/ folder indexed by file name.
+    The index mirrors what os.listdir() would return on an extracted Metadata folder.
+    mapped: Read the archive through a read-only memory map (self.map), so raw
+    member copies are slices of the mapping and the pages are shared with every
+    other process mapping the same file.
+    """
+    def __init__(self, threemf_path, mapped=False):
+        self.path = threemf_path
+        self.map = None
+        if mapped:
+            with open(threemf_path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    raise zipfile.BadZipFile(f"Empty file {threemf_path}")
+                # The mapping stays valid after the descriptor is closed
+                self.map = _MappedFile(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                self.zip = zipfile.ZipFile(self.map, 'r')
+            except Exception:
+                self.map.close()
+                raise
+        else:
+            self.zip = zipfile.ZipFile(threemf_path, 'r')
+        self._decoded = {} # small config members, decompressed once
+        self.metadata = {}
+        for info in self.zip.infolist():
+            if not info.filename.startswith(METADATA_PREFIX) or info.is_dir():
+                continue
+            name = info.filename[len(METADATA_PREFIX):]
+            if name and "/" not in name:
+                self.metadata[name] = info
+
+    def read_metadata(self, name):
+        """Returns the decompressed bytes of a Metadata/ member (kept for reuse)."""
+        data = self._decoded.get(name)
+        if data is None:
+            data = self._decoded[name] = self.zip.read(self.metadata[name])
+        return data
+
+    def close(self):
+        self.zip.close()
+        if self.map is not None:
+            self.map.close()
+
+class SourceCache:
+    """
+    Keeps SourceArchives open across builds, so a process building many
+    playlists from the same 3MFs indexes (and decodes the configs of) each one
+    once. Entries are keyed by source_key + size + mtime, so a file changed on
+    disk is reopened.
+    Open archives are only closed by trim() (least recently used beyond
+    max_open) or close(), never in the middle of a build.
+    mapped: Open the archives memory-mapped (see SourceArchive).
+    """
+    def __init__(self, max_open=SOURCE_CACHE_SIZE, mapped=False):
+        self.max_open = max_open
+        self.mapped = mapped
+        self._sources = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def open(self, threemf_path):
+        """Returns the cached SourceArchive for a path, opening it if needed."""
+        stat = os.stat(threemf_path)
+        key = (source_key(threemf_path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            source = self._sources.get(key)
+            if source is not None:
+                self._sources.move_to_end(key)
+                return source
+        source = SourceArchive(threemf_path, self.mapped)
+        with self._lock:
+            if key in self._sources: # opened concurrently; keep the first
+                source.close()
+                return self._sources[key]
+            self._sources[key] = source
+        return source
 
-def process_3mf_playlist(playlist_3mf, output_3mf_path):
+    def trim(self):
+        """Closes the least recently used archives beyond max_open."""
+        with self._lock:
+            while len(self._sources) > self.max_open:
+                _, source = self._sources.popitem(last=False)
+                source.close()
+
+    def close(self):
+        with self._lock:
+            for source in self._sources.values():
+                source.close()
+            self._sources.clear()
+
+def _member_data_offset(zf, info):
+    """Returns the offset of a member's compressed data, just past its local file header."""
+    if isinstance(zf.fp, mmap.mmap):
+        # Read straight from the mapping: no shared file position to disturb
+        fheader = struct.unpack_from(zipfile.structFileHeader, zf.fp, info.header_offset)
+    else:
+        zf.fp.seek(info.header_offset)
+        fheader = struct.unpack(zipfile.structFileHeader, zf.fp.read(zipfile.sizeFileHeader))
+    return (info.header_offset + zipfile.sizeFileHeader
+            + fheader[zipfile._FH_FILENAME_LENGTH] + fheader[zipfile._FH_EXTRA_FIELD_LENGTH])
+
+def copy_member_raw(src_zip, info, dst_zip, arcname=None):
+    """
+    Copies a member between two open ZipFiles without decompressing it.
+    The compressed bytes, CRC and sizes are reused as-is, so unchanged members
+    (models, thumbnails, settings) cost a plain byte copy.
+    """
+    zinfo = zipfile.ZipInfo(arcname or info.filename, info.date_time)
+    zinfo.compress_type = info.compress_type
+    zinfo.external_attr = info.external_attr
+    zinfo.create_system = info.create_system
+    zinfo.CRC = info.CRC
+    zinfo.compress_size = info.compress_size
+    zinfo.file_size = info.file_size
+    # Sizes are known up front, so no trailing data descriptor is needed.
+    zinfo.flag_bits = info.flag_bits & ~0x08
+
+    data_offset = _member_data_offset(src_zip, info)
+
+    dst_zip._writecheck(zinfo)
+    dst_zip._didModify = True
+    zinfo.header_offset = dst_zip.fp.tell()
+    dst_zip.fp.write(zinfo.FileHeader())
+
+    if isinstance(src_zip.fp, mmap.mmap):
+        # Memory-mapped source: hand the mapped bytes to write() directly
+        if data_offset + info.compress_size > len(src_zip.fp):
+            raise zipfile.BadZipFile(f"Truncated member {info.filename} in {src_zip.filename}")
+        with memoryview(src_zip.fp) as view:
+            dst_zip.fp.write(view[data_offset:data_offset + info.compress_size])
+        remaining = 0
+    else:
+        src_zip.fp.seek(data_offset)
+        remaining = info.compress_size
+    while remaining > 0:
+        chunk = src_zip.fp.read(min(COPY_CHUNK_SIZE, remaining))
+        if not chunk:
+            raise zipfile.BadZipFile(f"Truncated member {info.filename} in {src_zip.filename}")
+        dst_zip.fp.write(chunk)
+        remaining -= len(chunk)
+
+    dst_zip.filelist.append(zinfo)
+    dst_zip.NameToInfo[zinfo.filename] = zinfo
+    dst_zip.start_dir = dst_zip.fp.tell()
+
+def source_key(threemf_path):
+    """Identity of an input archive; playlist entries with the same key share one source."""
+    return os.path.realpath(threemf_path)
+
+def load_unique_sources(playlist_3mf, loader, cleanup=None, progress=None, stage="indexing"):
+    """
+    Runs loader(path) once per distinct source archive in the playlist, on a
+    thread pool, so setup cost scales with unique sources rather than entries.
+    Returns a dict of source_key -> loader result. If any load fails, the
+    successful results are passed to cleanup before the error is raised.
+    """
+    keys = list(dict.fromkeys(source_key(path) for path, _, _ in playlist_3mf))
+    results = {}
+    errors = []
+    
+    with ThreadPoolExecutor(max_workers=max(1, min(SOURCE_WORKERS, len(keys)))) as pool:
+        futures = {pool.submit(loader, key): key for key in keys}
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                errors.append(e)
+            report_progress(progress, stage, done / len(keys))
+    
+    if errors:
+        if cleanup is not None:
+            for result in results.values():
+                cleanup(result)
+        raise errors[0]
+    
+    log.info("loaded sources unique=%d entries=%d", len(keys), len(playlist_3mf))
+    return results
+
+def find_plate_gcodes(metadata_names, target_plate_idx):
+    """
+    Returns the plate G-code file names to use from a Metadata folder listing.
+    If target_plate_idx is set, only 'plate_{idx}.gcode' is returned (if present),
+    otherwise ALL 'plate_*.gcode' sorted by index.
+    """
+    if target_plate_idx:
+        target_name = f"plate_{target_plate_idx}.gcode"
+        return [target_name] if target_name in metadata_names else []
+
+    files = [f for f in metadata_names if f.startswith("plate_") and f.endswith(".gcode")]
+    # Sort by index
+    files.sort(key=lambda x: int(re.search(r"plate_(\d+)", x).group(1)) if re.search(r"plate_(\d+)", x) else 999)
+    return files
+
+def select_archive_assets(gcode_playlist):
+    """
+    Archive counterpart of copy_assets: picks which Metadata members to carry over.
+    gcode_playlist: List of tuples (SourceArchive, gcode_name, count)
+    Returns a dict of file name -> (SourceArchive, ZipInfo). Later items win on
+    name collisions, same as copy_assets overwriting files in the output dir.
+    """
+    assets = {}
+    
+    for source, gcode_name, _ in gcode_playlist:
+        rootname = os.path.splitext(gcode_name)[0] # "plate_1"
+        
+        for item, info in source.metadata.items():
+            if item.startswith(rootname) or item.startswith("pick_") or item.startswith("top_") or item.startswith("model_settings"):
+                # SKIP gcode files themselves (we generate one)
+                if item.endswith(".gcode"):
+                    continue
+                
+                # SKIP slice_info (we generate/merge it)
+                if item == "slice_info.config":
+                    continue
+                
+                assets[item] = (source, info)
+    
+    # Also take project_settings and other globals from the FIRST source
+    if gcode_playlist:
+        first_source = gcode_playlist[0][0]
+        for item, info in first_source.metadata.items():
+            if item == "project_settings.config" or item.startswith("filament_settings"):
+                if item not in assets:
+                    assets[item] = (first_source, info)
+    
+    return assets
+
+def _plate_gcode_chunks(source, info):
+    """Decompressed chunks of a plate's G-code, ending with a newline (added if missing)."""
+    last_chunk = b""
+    with source.zip.open(info) as src:
+        for chunk in iter(lambda: src.read(COPY_CHUNK_SIZE), b""):
+            yield chunk
+            last_chunk = chunk
+    if not last_chunk.endswith(b"\n"):
+        yield b"\n"
+
+def _copy_to(chunks, f):
+    """Yields chunks, writing each to the file f on the way."""
+    for chunk in chunks:
+        f.write(chunk)
+        yield chunk
+
+def _fed_to(chunks, estimator):
+    """Yields chunks, feeding each to a GcodeTimeEstimator on the way."""
+    for chunk in chunks:
+        estimator.feed(chunk)
+        yield chunk
+
+# --- PLATE CHECKS ---
+
+def _swap_sequence_max(axis):
+    """Highest position the swap sequence moves `axis` to."""
+    return max(float(word[1:]) for line in SWAP_SEQUENCE_GCODE.splitlines()
+               for word in line.partition(";")[0].split()[1:] if word[0] == axis)
+
+# A plate reaching these collides with the swap sequence (nozzle lift, plate push)
+SWAP_MAX_Y = _swap_sequence_max("Y")
+SWAP_MAX_Z = _swap_sequence_max("Z")
+
+def plate_warnings(stats):
+    """Human-readable problems in a plate's scan stats (see GcodeScanner) that would spoil a swap job."""
+    warnings = []
+    if not stats["ends_cleanly"]:
+        warnings.append("G-code does not end cleanly, the file may be truncated")
+    if stats["max_z"] is not None and stats["max_z"] >= SWAP_MAX_Z:
+        warnings.append(f"Moves up to Z{stats['max_z']:g}, the swap sequence lifts to Z{SWAP_MAX_Z:g}")
+    if stats["max_y"] is not None and stats["max_y"] >= SWAP_MAX_Y:
+        warnings.append(f"Moves up to Y{stats['max_y']:g}, the swap sequence pushes the plate at Y{SWAP_MAX_Y:g}")
+    return warnings
+
+def scan_plate_gcode(source, info):
+    """
+    Checks a plate G-code member of an open SourceArchive: the GcodeScanner
+    stats plus "warnings" (see plate_warnings). A stored member of a mapped
+    archive is scanned straight from the mapping, a compressed one inflated in
+    chunks.
+    Raises zipfile.BadZipFile or zlib.error if the member is damaged.
+    """
+    if source.map is not None and info.compress_type == zipfile.ZIP_STORED:
+        start = _member_data_offset(source.zip, info)
+        stats = scan_gcode(source.map, start, start + info.file_size)
+    else:
+        scanner = GcodeScanner()
+        with source.zip.open(info) as src:
+            for chunk in iter(lambda: src.read(SCAN_CHUNK_SIZE), b""):
+                scanner.feed(chunk)
+        stats = scanner.finish()
+    stats["warnings"] = plate_warnings(stats)
+    return stats
+
+def write_swap_gcode_member(gcode_playlist, zout, arcname, progress=None,
+                            compress_level=DEFAULT_COMPRESS_LEVEL, compress_strategy="default", timer=None,
+                            segment_cache=None):
+    """
+    Streams the combined swap G-code straight into an archive member.
+    Each plate is deflated once into a segment (see SegmentCache) and every copy
+    of it, like the swap blocks between them, is spliced in still compressed.
+    The MD5 covers the uncompressed output, so a plate is also decompressed from
+    the source archive once; its later copies are hashed from those bytes, kept
+    in a temp file.
+    Returns the MD5 hex digest.
+    progress: Optional callback, reported as stage "gcode" by bytes written.
+    timer: Optional JobTimer to fill with per-plate time estimates.
+    segment_cache: SegmentCache to take plate segments from and add them to;
+    without one, plate segments live in a temp directory for this call.
+    """
+    segment_dir = None
+    if segment_cache is None:
+        segment_dir = tempfile.mkdtemp(prefix="swap_segments_")
+        segment_cache = SegmentCache(segment_dir)
+    
+    try:
+        init_bytes = SWAP_INIT_GCODE.encode('utf-8')
+        swap_bytes = _with_trailing_newline(SWAP_SEQUENCE_GCODE.encode('utf-8'))
+        init_segment = precompressed_segment(init_bytes, compress_level, compress_strategy)
+        swap_segment = precompressed_segment(swap_bytes, compress_level, compress_strategy)
+
+        expected_size = len(init_bytes)
+        for source, gcode_name, count in gcode_playlist:
+            expected_size += (source.metadata[gcode_name].file_size + 1 + len(swap_bytes)) * count
+
+        hash_md5 = hashlib.md5()
+        written = 0
+
+        def observe(chunks, estimator=None, digest=None):
+            # Feeds the plate bytes of one copy to the MD5 (and estimator / digest) in output order
+            nonlocal written
+            for chunk in chunks:
+                hash_md5.update(chunk)
+                if estimator is not None:
+                    estimator.feed(chunk)
+                if digest is not None:
+                    digest.update(chunk)
+                written += len(chunk)
+                report_progress(progress, "gcode", min(written / expected_size, 1.0))
+                yield chunk
+
+        with open_deflate_member(zout, arcname, expected_size, compress_level, compress_strategy) as dst:
+            dst.write_segment(init_segment)
+            hash_md5.update(init_bytes)
+        
+            for source, gcode_name, count in gcode_playlist:
+                log.info("adding gcode copies=%d file=%s source=%s", count, gcode_name, os.path.basename(source.path))
+                info = source.metadata[gcode_name]
+            
+                segment = segment_cache.get(info, compress_level, compress_strategy)
+                # Plate with the cached segment's SHA-256 estimated before in this process? Skip the parse
+                # (the estimate is dropped with the segment if the plate bytes don't match it).
+                seconds = timer.lookup(segment.digest) if timer is not None and segment is not None else None
+                estimator = timer.plate_estimator() if timer is not None and seconds is None else None
+                # The first copy's plain bytes are kept (in a temp file) for the later copies' MD5
+                plain = tempfile.TemporaryFile(prefix="swap_plate_") if count > 1 else None
+                try:
+                    for i in range(count):
+                        if i > 0:
+                            plain.seek(0)
+                            collections.deque(observe(iter(lambda: plain.read(COPY_CHUNK_SIZE), b"")), maxlen=0)
+                            dst.write_segment(segment)
+                            dst.write_segment(swap_segment)
+                            hash_md5.update(swap_bytes)
+                            continue
+                        # A segment cached under this CRC + size is checked against the plate bytes once
+                        digest = hashlib.sha256() if segment is not None else None
+                        plate = observe(_plate_gcode_chunks(source, info), estimator, digest)
+                        if plain is not None:
+                            plate = _copy_to(plate, plain)
+                        if segment is None:
+                            # First sight of this plate: compress it once, for this copy and every later one
+                            segment = segment_cache.build(info, plate, compress_level, compress_strategy)
+                        else:
+                            collections.deque(plate, maxlen=0) # only the MD5 needs the bytes
+                            if digest.digest() != segment.digest:
+                                log.warning("deflate segment mismatch, rebuilding file=%s source=%s", gcode_name,
+                                            os.path.basename(source.path))
+                                segment.close()
+                                chunks = _plate_gcode_chunks(source, info)
+                                if seconds is not None:
+                                    seconds, estimator = None, timer.plate_estimator()
+                                    chunks = _fed_to(chunks, estimator)
+                                segment = segment_cache.build(info, chunks, compress_level, compress_strategy)
+                        dst.write_segment(segment)
+                        dst.write_segment(swap_segment)
+                        hash_md5.update(swap_bytes)
+                finally:
+                    if segment is not None:
+                        segment.close()
+                    if plain is not None:
+                        plain.close()
+            
+                if timer is not None:
+                    if seconds is None:
+                        # Remembered under the SHA-256 of the bytes just written (checked or built above)
+                        seconds = timer.measure(estimator, segment.digest if segment is not None else None)
+                    timer.add(os.path.basename(source.path), gcode_name, count, seconds)
+    
+        return hash_md5.hexdigest()
+    finally:
+        if segment_dir is not None:
+            shutil.rmtree(segment_dir, ignore_errors=True)
+
+def process_3mf_playlist(playlist_3mf, output_3mf_path, streaming=True, progress=None,
+                         compress_level=DEFAULT_COMPRESS_LEVEL, compress_strategy="default", source_cache=None,
+                         segment_cache=None):
     """
     Process a playlist of 3MF files.
     playlist_3mf: List of tuples (threemf_path, plate_index_or_none, count)
     output_3mf_path: Path to write the final 3MF.
+    streaming: Build zip-to-zip without extracting anything (default). Set to False
+    to use the original extract/stage/re-zip build.
+    progress: Optional callback progress(stage, fraction), see report_progress.
+    compress_level / compress_strategy: zlib level (0-9) and one of COMPRESS_STRATEGIES
+    for the members we compress (the combined G-code above all).
+    source_cache: Optional SourceCache to take the input archives from (streaming
+    builds only), for callers building many playlists from the same files.
+    segment_cache: Optional SegmentCache for plate G-code compressed by earlier
+    builds (streaming builds only); by default plates are compressed once per build.
+    Returns the job time estimate (JobTimeEstimate.to_dict()), or None if no
+    file was written.
+    """
+    with span("build", mode="streaming" if streaming else "staged", entries=len(playlist_3mf)) as record:
+        if streaming:
+            estimate = process_3mf_playlist_streaming(playlist_3mf, output_3mf_path, progress,
+                                                      compress_level, compress_strategy, source_cache,
+                                                      segment_cache)
+        else:
+            estimate = process_3mf_playlist_staged(playlist_3mf, output_3mf_path, progress,
+                                                   compress_level, compress_strategy)
+        if os.path.exists(output_3mf_path):
+            record["bytes"] = os.path.getsize(output_3mf_path)
+    return estimate
+
+def process_3mf_playlist_streaming(playlist_3mf, output_3mf_path, progress=None,
+                                   compress_level=DEFAULT_COMPRESS_LEVEL, compress_strategy="default",
+                                   source_cache=None, segment_cache=None):
+    """
+    Builds the swap 3MF by reading members straight from the source archives.
+    Members we don't change are copied still compressed, and no staging
+    directory is created.
+    source_cache: Optional SourceCache; its archives are left open for later builds.
+    segment_cache: Optional SegmentCache; without one, plate segments live in a
+    temp directory for the duration of the build.
+    """
+    if not playlist_3mf:
+        log.error("empty playlist")
+        return
+    
+    # 1. Open every distinct input once (concurrently)
+    with span("indexing"):
+        if source_cache is not None:
+            sources = load_unique_sources(playlist_3mf, source_cache.open, None, progress)
+        else:
+            sources = load_unique_sources(playlist_3mf, SourceArchive, SourceArchive.close, progress)
+    
+    # We use the FIRST 3MF in the playlist as the base container for models/settings.
+    base = sources[source_key(playlist_3mf[0][0])]
+    segment_dir = None
+    if segment_cache is None:
+        segment_dir = tempfile.mkdtemp(prefix="swap_segments_")
+        segment_cache = SegmentCache(segment_dir)
+    
+    try:
+        # 2. Build G-code Playlist
+        gcode_playlist = []
+        
+        for threemf_path, target_plate_idx, count in playlist_3mf:
+            source = sources[source_key(threemf_path)]
+            
+            if not source.metadata:
+                log.warning("no Metadata folder source=%s", threemf_path)
+                continue
+            
+            found_gcodes = find_plate_gcodes(source.metadata, target_plate_idx)
+            if target_plate_idx and not found_gcodes:
+                log.warning("plate not found plate=%s source=%s", target_plate_idx, threemf_path)
+            
+            for gcode_name in found_gcodes:
+                gcode_playlist.append((source, gcode_name, count))
+        
+        # 3. Write the output archive
+        log.info("writing output path=%s", output_3mf_path)
+        with zipfile.ZipFile(output_3mf_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=compress_level) as zout:
+            # Everything outside Metadata/ comes from the base, untouched.
+            report_progress(progress, "copying")
+            with span("copying") as record:
+                record["bytes"] = 0
+                for info in base.zip.infolist():
+                    if info.is_dir() or info.filename.startswith(METADATA_PREFIX):
+                        continue
+                    copy_member_raw(base.zip, info, zout)
+                    record["bytes"] += info.compress_size
+            
+            # Combined G-code + MD5 + time estimate
+            gcode_arcname = METADATA_PREFIX + "plate_1.gcode"
+            timer = JobTimer()
+            with span("gcode") as record:
+                md5_hash = write_swap_gcode_member(gcode_playlist, zout, gcode_arcname, progress,
+                                                   compress_level, compress_strategy, timer, segment_cache)
+                zout.writestr(gcode_arcname + ".md5", md5_hash)
+                record["bytes"] = zout.getinfo(gcode_arcname).file_size
+            estimate = timer.estimate.to_dict()
+            zout.writestr(METADATA_PREFIX + SWAP_ESTIMATE_NAME, json.dumps(estimate, indent=2))
+            
+            # Assets (thumbnails, plate json, settings)
+            report_progress(progress, "metadata")
+            generated = {"plate_1.gcode", "plate_1.gcode.md5", "model_settings.config", "slice_info.config",
+                         SWAP_ESTIMATE_NAME}
+            with span("assets") as record:
+                record["bytes"] = 0
+                assets = select_archive_assets(gcode_playlist)
+                for name, (source, info) in assets.items():
+                    if name in generated:
+                        continue
+                    copy_member_raw(source.zip, info, zout, METADATA_PREFIX + name)
+                    record["bytes"] += info.compress_size
+            
+            # model_settings.config
+            if "model_settings.config" in assets:
+                with span("model_settings"):
+                    source, info = assets["model_settings.config"]
+                    tree = _parse_config(source.zip.read(info))
+                    apply_swap_model_settings(tree.getroot())
+                    buffer = io.BytesIO()
+                    tree.write(buffer, encoding='UTF-8', xml_declaration=True)
+                    zout.writestr(METADATA_PREFIX + "model_settings.config", buffer.getvalue())
+            
+            # slice_info.config
+            configs = []
+            config_bytes = {} # read (and later parsed) once per source
+            for source, gcode_name, count in gcode_playlist:
+                if "slice_info.config" not in source.metadata:
+                    log.warning("no slice_info.config gcode=%s source=%s", gcode_name, source.path)
+                    continue
+                if source.path not in config_bytes:
+                    config_bytes[source.path] = source.read_metadata("slice_info.config")
+                configs.append((config_bytes[source.path], gcode_name, count))
+            
+            buffer = io.BytesIO()
+            if merge_slice_info_configs(configs, buffer, estimate["total_seconds"]):
+                zout.writestr(METADATA_PREFIX + "slice_info.config", buffer.getvalue())
+    finally:
+        if segment_dir is not None:
+            shutil.rmtree(segment_dir, ignore_errors=True)
+        if source_cache is not None:
+            source_cache.trim()
+        else:
+            for source in sources.values():
+                source.close()
+    
+    log.info("3mf processing complete path=%s estimated_seconds=%d", output_3mf_path, estimate["total_seconds"])
+    return estimate
+
+def process_3mf_playlist_staged(playlist_3mf, output_3mf_path, progress=None,
+                                compress_level=DEFAULT_COMPRESS_LEVEL, compress_strategy="default"):
+    """
+    Builds the swap 3MF by extracting every input to a temp directory, staging the
+    output tree on disk and zipping it back up.
     """
     
     # 1. Setup Staging for Base Container
     # We use the FIRST 3MF in the playlist as the base container for models/settings.
     if not playlist_3mf:
-        print("Error: Empty playlist.")
+        log.error("empty playlist")
         return
         
     first_3mf_path = playlist_3mf[0][0]
-    base_staging_dir = extract_3mf_to_temp(first_3mf_path)
-    print(f"Base 3MF extracted to: {base_staging_dir}")
+    with span("extracting_base"):
+        base_staging_dir = extract_3mf_to_temp(first_3mf_path)
+    log.info("base 3mf extracted path=%s", base_staging_dir)
     
     # Prepare Metadata target in Base Staging
     base_metadata_dir = os.path.join(base_staging_dir, "Metadata")
@@ -491,67 +1720,65 @@ def process_3mf_playlist(playlist_3mf, output_3mf_path):
         shutil.rmtree(base_metadata_dir) # Clear existing metadata
     os.makedirs(base_metadata_dir)
     
-    # 2. Extract Inputs and Build G-code Playlist
+    # 2. Extract Inputs (each distinct archive once, concurrently) and Build G-code Playlist
     gcode_playlist = []
-    temp_dirs = [base_staging_dir] # Keep track to clean up later
     
-    print("Extracting inputs...")
+    try:
+        with span("extracting"):
+            extract_dirs = load_unique_sources(playlist_3mf, extract_3mf_to_temp, shutil.rmtree, progress, "extracting")
+    except Exception:
+        shutil.rmtree(base_staging_dir)
+        raise
+    temp_dirs = [base_staging_dir] + list(extract_dirs.values()) # Keep track to clean up later
+    
     for threemf_path, target_plate_idx, count in playlist_3mf:
-        # Extract to new temp
-        extract_dir = extract_3mf_to_temp(threemf_path)
-        temp_dirs.append(extract_dir)
+        extract_dir = extract_dirs[source_key(threemf_path)]
         
         metadata_dir = os.path.join(extract_dir, "Metadata")
         if not os.path.exists(metadata_dir):
-            print(f"Warning: No Metadata folder in {threemf_path}")
+            log.warning("no Metadata folder source=%s", threemf_path)
             continue
             
         # Find G-codes
         # If target_plate_idx is specified, look for 'plate_{idx}.gcode'
         # Else, look for ALL 'plate_*.gcode' and sort them.
-        
-        found_gcodes = []
-        
-        if target_plate_idx:
-            target_name = f"plate_{target_plate_idx}.gcode"
-            p = os.path.join(metadata_dir, target_name)
-            if os.path.exists(p):
-                found_gcodes.append(p)
-            else:
-                print(f"Warning: Plate {target_plate_idx} not found in {threemf_path}")
-        else:
-            # All plates
-            files = os.listdir(metadata_dir)
-            files = [f for f in files if f.startswith("plate_") and f.endswith(".gcode")]
-            # Sort by index
-            files.sort(key=lambda x: int(re.search(r"plate_(\d+)", x).group(1)) if re.search(r"plate_(\d+)", x) else 999)
-            found_gcodes = [os.path.join(metadata_dir, f) for f in files]
+        found_gcodes = [
+            os.path.join(metadata_dir, f)
+            for f in find_plate_gcodes(os.listdir(metadata_dir), target_plate_idx)
+        ]
+        if target_plate_idx and not found_gcodes:
+            log.warning("plate not found plate=%s source=%s", target_plate_idx, threemf_path)
             
         # Add to playlist
         for gp in found_gcodes:
             gcode_playlist.append((gp, count))
             
     # 3. Generate Swap Metadata into Base Staging
-    print(f"Generating Swap Metadata into {base_metadata_dir}...")
+    log.info("generating swap metadata path=%s", base_metadata_dir)
+    report_progress(progress, "metadata")
     
     # Reuse existing logic!
     # Note: create_swap_metadata handles clearing the dir, but we just made it.
     # It calls copy_assets -> generate_gcode -> update_configs.
     # This matches our needs exactly.
-    create_swap_metadata(gcode_playlist, base_metadata_dir)
+    estimate = create_swap_metadata(gcode_playlist, base_metadata_dir)
     
     # 4. Repackage
-    print(f"Repackaging to {output_3mf_path}...")
-    zip_directory(base_staging_dir, output_3mf_path)
+    log.info("repackaging path=%s", output_3mf_path)
+    report_progress(progress, "zipping")
+    with span("zipping") as record:
+        zip_directory(base_staging_dir, output_3mf_path, compress_level, compress_strategy)
+        record["bytes"] = os.path.getsize(output_3mf_path)
     
     # 5. Cleanup
-    print("Cleaning up temporary directories...")
     for d in temp_dirs:
         shutil.rmtree(d)
         
-    print("3MF Processing Complete.")
+    log.info("3mf processing complete path=%s estimated_seconds=%d", output_3mf_path, estimate["total_seconds"])
+    return estimate
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
     BASE_DIR = "/Users/caio/Downloads/swaplist app"
     
     # --- TEST RUN 1: Combined 2 Objects ---
@@ -1,6 +1,248 @@
-def main():
-    print("Hello from plate-swap-list-app!")
+"""
+Headless batch builder: turns playlist descriptor files into swap 3MFs.
 
+    python main.py build nightly/*.toml --output-dir out/ --workers 4
+
+A descriptor (JSON or TOML) holds one playlist, or several under "playlists":
+
+    {
+      "output": "friday.3mf",
+      "compression_level": 6,
+      "items": [
+        {"file": "parts/bracket.3mf", "plate": 1, "count": 4},
+        {"file": "parts/clip.3mf"}
+      ]
+    }
+
+"file" paths are relative to the descriptor; "plate" defaults to every plate
+of the file and "count" to 1. Playlists are built concurrently on a process
+pool; the exit status is non-zero if any descriptor is invalid or any build fails.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tomllib
+import tempfile
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from generate_swap_gcode import SourceArchive, SourceCache, SegmentCache, collect_spans, find_plate_gcodes, source_key, COMPRESS_STRATEGIES
+from backend.core import build_swap_file
+
+DEFAULT_WORKERS = os.cpu_count() or 2
+
+EXIT_BUILD_FAILED = 1
+EXIT_BAD_DESCRIPTOR = 2
+
+class DescriptorError(ValueError):
+    pass
+
+# --- DESCRIPTORS ---
+
+def load_descriptor(path):
+    """
+    Reads a JSON (.json) or TOML (anything else) descriptor.
+    Returns a list of playlist dicts: {"name", "output", "playlist": [(path, plate, count)], "options"}.
+    Raises DescriptorError on anything malformed.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = json.load(f) if path.endswith(".json") else tomllib.load(f)
+    except (OSError, ValueError) as e: # JSONDecodeError and TOMLDecodeError are ValueErrors
+        raise DescriptorError(f"{path}: {e}")
+    if not isinstance(data, dict):
+        raise DescriptorError(f"{path}: expected an object at the top level")
+
+    stem = os.path.splitext(os.path.basename(path))[0]
+    entries = data.get("playlists")
+    if entries is None:
+        return [_parse_playlist(path, data, stem)]
+    if not isinstance(entries, list) or not entries:
+        raise DescriptorError(f"{path}: 'playlists' must be a non-empty list")
+    return [_parse_playlist(path, entry, f"{stem}_{number}") for number, entry in enumerate(entries, 1)]
+
+def _parse_playlist(path, entry, default_name):
+    base_dir = os.path.dirname(os.path.abspath(path))
+    if not isinstance(entry, dict):
+        raise DescriptorError(f"{path}: every playlist must be an object")
+    name = entry.get("name") or os.path.splitext(entry.get("output") or default_name)[0]
+    where = f"{path} ({name})"
+
+    items = entry.get("items")
+    if not isinstance(items, list) or not items:
+        raise DescriptorError(f"{where}: 'items' must be a non-empty list")
+    playlist = []
+    for number, item in enumerate(items, 1):
+        if not isinstance(item, dict) or not isinstance(item.get("file"), str):
+            raise DescriptorError(f"{where}: item {number} needs a 'file'")
+        file_path = os.path.join(base_dir, item["file"])
+        if not os.path.isfile(file_path):
+            raise DescriptorError(f"{where}: item {number}: no such file {file_path}")
+        plate = item.get("plate")
+        count = item.get("count", 1)
+        if plate is not None and (not isinstance(plate, int) or plate < 1):
+            raise DescriptorError(f"{where}: item {number}: 'plate' must be a positive integer")
+        if not isinstance(count, int) or count < 1:
+            raise DescriptorError(f"{where}: item {number}: 'count' must be a positive integer")
+        playlist.append((file_path, plate, count))
+
+    options = {}
+    if "compression_level" in entry:
+        level = entry["compression_level"]
+        if not isinstance(level, int) or not 0 <= level <= 9:
+            raise DescriptorError(f"{where}: 'compression_level' must be 0-9")
+        options["compress_level"] = level
+    if "compression_strategy" in entry:
+        if entry["compression_strategy"] not in COMPRESS_STRATEGIES:
+            raise DescriptorError(f"{where}: 'compression_strategy' must be one of {sorted(COMPRESS_STRATEGIES)}")
+        options["compress_strategy"] = entry["compression_strategy"]
+
+    return {"name": name, "output": entry.get("output") or f"{name}.3mf", "playlist": playlist, "options": options}
+
+def check_plates(playlists):
+    """
+    Makes sure every referenced plate has G-code, so a typo fails up front
+    instead of producing a swap file without it. Each file is indexed once.
+    Raises DescriptorError.
+    """
+    plate_gcodes = {}
+    for playlist in playlists:
+        for file_path, plate, _ in playlist["playlist"]:
+            key = source_key(file_path)
+            if key not in plate_gcodes:
+                try:
+                    source = SourceArchive(file_path)
+                except (OSError, zipfile.BadZipFile) as e:
+                    raise DescriptorError(f"{playlist['descriptor']} ({playlist['name']}): {file_path}: {e}")
+                plate_gcodes[key] = list(source.metadata)
+                source.close()
+            if not find_plate_gcodes(plate_gcodes[key], plate):
+                what = f"plate {plate}" if plate else "any plate G-code"
+                raise DescriptorError(f"{playlist['descriptor']} ({playlist['name']}): {file_path} has no {what}")
+
+# --- WORKER SIDE ---
+
+# Sources stay open across the jobs a worker runs, so shared 3MFs are indexed once per worker
+_source_cache = None
+# Plates are deflated once per run and spliced into every playlist that uses them
+_segment_cache = None
+
+def _init_worker(log_level, segment_dir):
+    global _source_cache, _segment_cache
+    logging.basicConfig(level=log_level, format="%(levelname)s %(name)s %(message)s")
+    _source_cache = SourceCache()
+    _segment_cache = SegmentCache(segment_dir)
+
+def _build_job(job):
+    """
+    Builds one playlist in a pool process.
+    Returns {"bytes", "seconds", "stages": {stage: seconds}, "estimate_seconds"}.
+    """
+    start = time.perf_counter()
+    with collect_spans() as spans:
+        estimate = build_swap_file(job["playlist"], job["output_path"], build_options=job["options"],
+                                   source_cache=_source_cache, segment_cache=_segment_cache)
+
+    stages = {}
+    for record in spans:
+        if record["stage"] != "build":
+            stages[record["stage"]] = stages.get(record["stage"], 0.0) + record["duration"]
+    return {
+        "bytes": os.path.getsize(job["output_path"]),
+        "seconds": time.perf_counter() - start,
+        "stages": stages,
+        "estimate_seconds": estimate["total_seconds"] if estimate else None,
+    }
+
+# --- COMMANDS ---
+
+def _format_duration(seconds):
+    hours, rest = divmod(int(seconds), 3600)
+    return f"{hours}h{rest // 60:02d}m"
+
+def build_command(args):
+    jobs = []
+    outputs = {}
+    try:
+        for path in args.descriptors:
+            for playlist in load_descriptor(path):
+                output_path = os.path.abspath(os.path.join(args.output_dir, playlist["output"]))
+                if output_path in outputs:
+                    raise DescriptorError(f"{path}: output {output_path} is also written by {outputs[output_path]}")
+                outputs[output_path] = path
+                options = {"compress_level": args.compress_level, "compress_strategy": args.compress_strategy,
+                           "streaming": not args.staged}
+                options.update(playlist["options"])
+                jobs.append(dict(playlist, output_path=output_path, options=options, descriptor=path))
+        check_plates(jobs)
+    except DescriptorError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return EXIT_BAD_DESCRIPTOR
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    # Jobs reading the same files run back to back, so they tend to hit a worker's open sources
+    jobs.sort(key=lambda job: sorted({source_key(path) for path, _, _ in job["playlist"]}))
+
+    results = []
+    started = time.perf_counter()
+    workers = max(1, min(args.workers, len(jobs)))
+    print(f"building {len(jobs)} playlists on {workers} workers")
+    segment_dir = tempfile.mkdtemp(prefix="swap_segments_")
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker, initargs=(args.log_level, segment_dir)) as pool:
+            futures = {pool.submit(_build_job, job): job for job in jobs}
+            for future in as_completed(futures):
+                job = futures[future]
+                result = {"name": job["name"], "descriptor": job["descriptor"], "output": job["output_path"]}
+                try:
+                    result.update(future.result(), status="ok")
+                except Exception as e:
+                    result.update(status="failed", error=f"{type(e).__name__}: {e}")
+                    print(f"FAIL {job['name']}: {result['error']}", file=sys.stderr)
+                else:
+                    stages = " ".join(f"{stage}={seconds:.2f}s" for stage, seconds in result["stages"].items())
+                    estimate = f" print~{_format_duration(result['estimate_seconds'])}" if result["estimate_seconds"] else ""
+                    print(f"ok   {job['name']}  {result['seconds']:.2f}s  {result['bytes'] / 1024 / 1024:.1f} MB{estimate}  [{stages}]")
+                results.append(result)
+    finally:
+        shutil.rmtree(segment_dir, ignore_errors=True)
+
+    failed = [result for result in results if result["status"] != "ok"]
+    elapsed = time.perf_counter() - started
+    print(f"built {len(results) - len(failed)}/{len(results)} playlists in {elapsed:.2f}s"
+          + (f" ({len(failed)} failed)" if failed else ""))
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"elapsed_seconds": elapsed, "jobs": results}, f, indent=2)
+    return EXIT_BUILD_FAILED if failed else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build swap 3MFs from playlist descriptors.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="Build every playlist in the given descriptors")
+    build.add_argument("descriptors", nargs="+", help="JSON or TOML playlist descriptors")
+    build.add_argument("-o", "--output-dir", default=".", help="Directory for the swap files (default: .)")
+    build.add_argument("-j", "--workers", type=int, default=DEFAULT_WORKERS,
+                       help=f"Playlists built in parallel (default: {DEFAULT_WORKERS})")
+    build.add_argument("--compress-level", type=int, default=6, choices=range(10), metavar="0-9",
+                       help="Default zlib level for the combined G-code (default: 6)")
+    build.add_argument("--compress-strategy", default="default", choices=sorted(COMPRESS_STRATEGIES))
+    build.add_argument("--staged", action="store_true", help="Use the extract/stage/re-zip build")
+    build.add_argument("--report", help="Also write per-job results and timings to this JSON file")
+    build.add_argument("-v", "--verbose", dest="log_level", action="store_const",
+                       const=logging.INFO, default=logging.WARNING, help="Log pipeline progress")
+    build.set_defaults(func=build_command)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())